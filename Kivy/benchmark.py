@@ -0,0 +1,250 @@
+#!/usr/bin/python3
+
+import argparse
+import json
+import os
+import platform
+import time
+import numpy as np
+from decoder import make_decoder, VOLTS_PER_CODE
+from simulator import SimulatedWaveDAC
+from time_base import get_time_base
+from plot_window import PlotWindow
+
+"""
+@brief Sample rates swept by default (Hz).
+"""
+SAMPLE_RATES = [100, 1000, 10000, 50000]
+
+"""
+@brief Samples per data packet swept by the decoding benchmark.
+"""
+BATCH_SIZES = [1, 10]
+
+"""
+@brief Plot window lengths swept by default (s).
+"""
+WINDOW_SECONDS = [1, 20, 60, 600]
+
+"""
+@brief Display refresh rate assumed by the benchmarks (fps).
+"""
+DISPLAY_FPS = 50
+
+"""
+@brief Width of the plot assumed by the benchmarks (pixels).
+"""
+PLOT_WIDTH = 800
+
+def bench_decode(sample_rate, batch_size=1, duration=1.0, corruption=0.001):
+    """
+    @brief Throughput of the packet decoder.
+
+    A simulated stream is split in the chunks that the reader
+    thread would get when reading at #DISPLAY_FPS.
+    @return Dictionary with the results.
+    """
+    device = SimulatedWaveDAC(sample_rate, corruption=corruption, seed=0)
+    device.is_streaming = True
+    device.batch_size = batch_size
+    n_samples = int(sample_rate * duration) // batch_size * batch_size
+    stream = device.generate(n_samples)
+    bytes_per_sample = device.packet_size / float(batch_size)
+    chunk_size = max(1, int(bytes_per_sample * sample_rate / DISPLAY_FPS))
+    decoder = make_decoder(device.protocol_version, batch_size)
+    decoded = 0
+    start = time.perf_counter()
+    for offset in range(0, len(stream), chunk_size):
+        decoded += len(decoder.decode(stream[offset:offset + chunk_size]))
+    elapsed = time.perf_counter() - start
+    return {
+        'benchmark': 'decode',
+        'sample_rate': sample_rate,
+        'batch_size': batch_size,
+        'bytes_per_sample': bytes_per_sample,
+        'chunk_bytes': chunk_size,
+        'samples': decoded,
+        'lost_samples': decoder.lost_samples,
+        'seconds': elapsed,
+        'samples_per_second': decoded / elapsed,
+        'realtime_factor': decoded / elapsed / sample_rate,
+    }
+
+def bench_fan_out(serial, sample_rate, n_callbacks=4, duration=1.0):
+    """
+    @brief Cost of dispatching the samples to the callbacks.
+
+    Measured both with batch callbacks and with per-sample
+    callbacks, all of them doing nothing.
+    @return List of dictionaries with the results.
+    """
+    block_len = max(1, sample_rate // DISPLAY_FPS)
+    n_blocks = max(1, int(duration * DISPLAY_FPS))
+    samples = np.random.rand(block_len)
+    timestamps = np.zeros(block_len)
+    results = []
+    for kind in ['batch', 'sample']:
+        callbacks = [lambda *args: None for i in range(n_callbacks)]
+        for callback in callbacks:
+            if (kind == 'batch'):
+                serial.add_batch_callback(callback)
+            else:
+                serial.add_callback(callback)
+        start = time.perf_counter()
+        for i in range(n_blocks):
+            serial.dispatch_samples(samples, timestamps)
+        elapsed = time.perf_counter() - start
+        for callback in callbacks:
+            serial.remove_batch_callback(callback)
+            serial.remove_callback(callback)
+        results.append({
+            'benchmark': 'fan_out',
+            'callback_kind': kind,
+            'callbacks': n_callbacks,
+            'sample_rate': sample_rate,
+            'block_len': block_len,
+            'seconds_per_sample': elapsed / (n_blocks * block_len),
+            'cpu_fraction': elapsed / (n_blocks * block_len) * sample_rate,
+        })
+    return results
+
+def simulated_codes(sample_rate, n_samples):
+    """
+    @brief ADC codes of a simulated stream, as decoded by the reader thread.
+    """
+    device = SimulatedWaveDAC(sample_rate, seed=0)
+    device.is_streaming = True
+    decoder = make_decoder(device.protocol_version, device.batch_size)
+    return decoder.decode_codes(device.generate(n_samples))
+
+def make_plot(window_seconds):
+    """
+    @brief Create the plot of a WaveDAC tab, with the params a #PLOT_WIDTH pixels wide graph would give it.
+    """
+    from line_plot import ArrayLinePlot
+    plot = ArrayLinePlot()
+    plot.line_width = 2
+    plot.params.update({'xmin': -window_seconds, 'xmax': 0, 'ymin': 0, 'ymax': 5,
+                        'size': (0, 0, PLOT_WIDTH, 400)})
+    return plot
+
+def bench_plot_update(sample_rate, window_seconds, n_frames=50, decimation='minmax'):
+    """
+    @brief Cost of the plot update performed at each frame.
+
+    Runs the code of GraphPanelItem: the ADC codes of a
+    simulated stream are pushed to a PlotWindow, which updates
+    the statistics and the decimation of the window, and its
+    points are sent to an ArrayLinePlot. The one-off building
+    of the decimation columns is done before timing.
+    @return Dictionary with the results.
+    """
+    block_len = max(1, sample_rate // DISPLAY_FPS)
+    codes = simulated_codes(sample_rate, block_len * n_frames)
+    window = PlotWindow(get_time_base(sample_rate, window_seconds), codes.dtype, VOLTS_PER_CODE)
+    plot = make_plot(window_seconds)
+    window.points(PLOT_WIDTH, decimation)
+    start = time.perf_counter()
+    for i in range(n_frames):
+        window.push(codes[i * block_len:(i + 1) * block_len])
+        plot.set_data(*window.points(PLOT_WIDTH, decimation))
+    elapsed = time.perf_counter() - start
+    return {
+        'benchmark': 'plot_update',
+        'sample_rate': sample_rate,
+        'window_seconds': window_seconds,
+        'window_points': window.time_base.n_points,
+        'decimation': decimation,
+        'seconds_per_frame': elapsed / n_frames,
+        'seconds_per_sample': elapsed / (n_frames * block_len),
+        'frame_budget_fraction': elapsed / n_frames * DISPLAY_FPS,
+    }
+
+def bench_latency(serial, sample_rate, duration=2.0):
+    """
+    @brief Latency from byte arrival to plot update.
+
+    The simulated device streams through KivySerial, while the
+    sample buffer is drained at #DISPLAY_FPS as the GUI does.
+    The latency of each frame is the time between the arrival
+    of the newest sample drained and the end of the update.
+    @return Dictionary with the results.
+    """
+    serial.port_name = 'sim://?rate={}'.format(sample_rate)
+    serial.connect()
+    device = serial.port.device
+    reader = serial.buffer.reader()
+    window = PlotWindow(get_time_base(sample_rate, 20), serial.buffer.samples.dtype, serial.buffer.scale)
+    plot = make_plot(20)
+    latencies = []
+    received = 0
+    serial.start_streaming()
+    end = time.monotonic() + duration
+    while (time.monotonic() < end):
+        time.sleep(1.0 / DISPLAY_FPS)
+        samples, timestamps = reader.read_raw()
+        if (len(samples) == 0):
+            continue
+        received += len(samples)
+        window.push(samples)
+        plot.set_data(*window.points(PLOT_WIDTH))
+        arrival = device.stream_start + received / float(sample_rate)
+        latencies.append(time.monotonic() - arrival)
+    serial.disconnect()
+    latencies = np.array(latencies) if len(latencies) > 0 else np.zeros(1)
+    return {
+        'benchmark': 'latency',
+        'sample_rate': sample_rate,
+        'samples': received,
+        'samples_lost': reader.lost + serial.decoder.lost_samples,
+        'latency_median': float(np.median(latencies)),
+        'latency_p95': float(np.percentile(latencies, 95)),
+        'latency_max': float(latencies.max()),
+    }
+
+def run(sample_rates, window_seconds, latency_duration):
+    """
+    @brief Run all the benchmarks.
+
+    @return Dictionary with environment information and results.
+    """
+    from communication import KivySerial
+    serial = KivySerial(auto_connect=False)
+    results = []
+    for sample_rate in sample_rates:
+        for batch_size in BATCH_SIZES:
+            results.append(bench_decode(sample_rate, batch_size))
+        results.extend(bench_fan_out(serial, sample_rate))
+        for seconds in window_seconds:
+            results.append(bench_plot_update(sample_rate, seconds))
+        if (latency_duration > 0):
+            results.append(bench_latency(serial, sample_rate, latency_duration))
+    return {
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'results': results,
+    }
+
+if __name__ == '__main__':
+    # Leave the command line to argparse: Kivy parses sys.argv when imported
+    os.environ.setdefault('KIVY_NO_ARGS', '1')
+    parser = argparse.ArgumentParser(description='Benchmark the acquisition-to-pixel pipeline.')
+    parser.add_argument('--rates', type=int, nargs='+', default=SAMPLE_RATES,
+                        help='sample rates to sweep (Hz)')
+    parser.add_argument('--windows', type=float, nargs='+', default=WINDOW_SECONDS,
+                        help='plot window lengths to sweep (s)')
+    parser.add_argument('--latency-duration', type=float, default=2.0,
+                        help='duration of each latency measurement (s), 0 to skip')
+    parser.add_argument('--output', default='benchmark_results.json',
+                        help='file where results are written as JSON')
+    args = parser.parse_args()
+
+    report = run(args.rates, args.windows, args.latency_duration)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    for result in report['results']:
+        print(', '.join('{}={}'.format(key, '{:.4g}'.format(value) if isinstance(value, float)
+                                       else value) for key, value in result.items()))
+    print('Results written to {}'.format(args.output))
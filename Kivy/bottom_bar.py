@@ -6,6 +6,7 @@ from kivy.graphics import Color, Rectangle
 class BottomBar(BoxLayout):
     message_label = ObjectProperty(None)
     connection_label = ObjectProperty(None)
+    stats_label = ObjectProperty(None)
 
     def __init__(self, **kwargs):
         super(BottomBar, self).__init__(**kwargs)
@@ -13,6 +14,24 @@ class BottomBar(BoxLayout):
     def update_text(self, instance, value):
         self.message_label.text = value
 
+    def update_stats(self, stats, frame_stats):
+        """
+        @brief Show the statistics of the acquisition pipeline and of the plot.
+
+        Args:
+            - stats: dictionary returned by KivySerial.get_stats.
+            - frame_stats: dictionary returned by GraphTabs.get_frame_stats.
+        """
+        self.stats_label.text = '{:.0f} S/s | {:.0f} bad/s | {} lost | {} B skipped | buf {} B | cb {:.2f} ms | {:.0f} fps, {:.1f} ms'.format(
+            stats.get('samples_per_second', 0),
+            stats.get('invalid_packets_per_second', 0),
+            stats.get('lost_samples', 0),
+            stats.get('skipped_bytes', 0),
+            stats.get('in_waiting', 0),
+            stats.get('callback_time_per_dispatch', 0) * 1000,
+            frame_stats.get('fps', 0),
+            frame_stats.get('mean_time', 0) * 1000)
+
     def connection_event(self, instance, value):
         if (value == 1):
             self.connection_label.update_color(1, 1, 0)
@@ -1,55 +1,48 @@
+from kivy.clock import Clock
 from kivy.event import EventDispatcher
 from kivy.properties import NumericProperty, StringProperty
-import serial
-import serial.tools.list_ports as list_ports
-import struct
+import re
 import threading
 import time
+import os
+import numpy as np
+from decoder import make_decoder, codes_to_volts, VOLTS_PER_CODE
+from protocol import (WAVE_SINE_CMD, WAVE_TRIANGLE_CMD, RANGE_SMALL_CMD, RANGE_LARGE_CMD,
+                      DEFAULT_BATCH_SIZE, DEFAULT_SAMPLE_RATE, PROTOCOL_VERSION)
+from discovery import (discover_ports, negotiate_batch_size, probe_port, request_sample_rate,
+                       switch_baudrate, configure_device, save_cached_port, StreamReader)
+from transport import open_transport
+from io_engine import get_engine
+from instrumentation import PipelineMonitor
+from ring_buffer import SampleRingBuffer, encode_samples
 
 """
-@brief Start byte of the data packet
+@brief Number of samples retained in the sample buffer.
 """
-START_BYTE = 0xA0
+BUFFER_SIZE = 2 ** 20
 
 """
-@brief End byte of the data packet
-"""
-END_BYTE = 0xC0
-
-"""
-@brief Connection command.
-"""
-CONNECTION_CMD = 'v'
-
-"""
-@brief Start streaming command.
-"""
-START_STREAMING_CMD = 'b'
-
-"""
-@brief Stop streaming command.
-"""
-STOP_STREAMING_CMD = 's'
+@brief Data type of the samples retained in the sample buffer: the ADC codes.
 
+Voltages are #VOLTS_PER_CODE times the codes, and are computed
+by the readers of the buffer when they need them.
 """
-@brief Select wave as sine.
-"""
-WAVE_SINE_CMD = 'e'
+BUFFER_DTYPE = np.uint16
 
 """
-@brief Select wave as triangle.
+@brief Folder where recordings are saved by default.
 """
-WAVE_TRIANGLE_CMD = 'f'
+RECORDINGS_FOLDER = 'recordings'
 
 """
-@brief Select range as small.
+@brief Time between two port discovery attempts (s).
 """
-RANGE_SMALL_CMD = 't'
+DISCOVERY_INTERVAL = 1
 
 """
-@brief Select range as large.
+@brief Time between two updates of the pipeline statistics properties (s).
 """
-RANGE_LARGE_CMD = 'y'
+STATS_INTERVAL = 1
 
 class Singleton(type):
     """
@@ -66,13 +59,14 @@ class Singleton(type):
             cls._instances[cls] = super(Singleton, cls).__call__(*args, **kwargs)
         return cls._instances[cls]
 
-class KivySerial(EventDispatcher, metaclass=Singleton):
+class KivySerial(EventDispatcher):
     """
     @brief Main class used for serial communication.
     
     This is the main class used to communicate with the serial port.
-    It has @Singleton as a metaclass, so only one instance of this
-    class exists throughout the application. 
+    Each instance drives one board: the boards connected to the
+    application are managed by DeviceManager, which creates one
+    instance per board.
     Automatic port discovery is implemented: it is not required to
     specify the serial port, as it is automatically detected by
     scanning all the available ports, and sending a known command
@@ -97,24 +91,93 @@ class KivySerial(EventDispatcher, metaclass=Singleton):
     """
     message_string = StringProperty('')
 
-    def __init__(self, baudrate=115200):
+    """
+    @brief Samples received per second.
+    """
+    samples_per_second = NumericProperty(0)
+
+    """
+    @brief Bytes skipped while looking for packets since streaming started.
+    """
+    skipped_bytes = NumericProperty(0)
+
+    """
+    @brief Invalid packets received per second.
+    """
+    invalid_packet_rate = NumericProperty(0)
+
+    """
+    @brief Bytes waiting in the input buffer of the port at the last read.
+    """
+    input_buffer_fill = NumericProperty(0)
+
+    """
+    @brief Mean time spent in the callbacks for each block of samples (s).
+    """
+    callback_time = NumericProperty(0)
+
+    """
+    @brief Samples lost since streaming started, from the packet sequence numbers.
+    """
+    lost_samples = NumericProperty(0)
+
+    """
+    @brief Sample rate of the device (Hz).
+    """
+    sample_rate = NumericProperty(DEFAULT_SAMPLE_RATE)
+
+    def __init__(self, baudrate=115200, auto_connect=True, port_name=None,
+                 batch_size=DEFAULT_BATCH_SIZE, link_baudrate=None, name='WaveDAC'):
         """
         @brief Initialize the class.
 
         Args:
             - baudrate: the desired baudrate for serial communication.
+            - auto_connect: start automatic port discovery.
+            - port_name: port to connect to, skipping discovery. Names
+              starting with sim:// connect to a simulated device.
+            - batch_size: samples requested in each data packet, for
+              devices supporting protocol version 3.
+            - link_baudrate: baud rate to switch to after connecting,
+              for devices supporting protocol version 4. Discovery
+              and handshake always use baudrate.
+            - name: name of the board shown on the GUI.
         """
+        self.name = name            # name of the board
         self.port_name = ""         # port name, set later when port is found
+        self.port = None            # transport to the device, once connected
+        self.engine = get_engine()  # thread owning the port
         self.baudrate = baudrate    # baudrate for serial communication
         self.is_streaming = False   # streaming status
         self.connected = 0          # connection status
-        self.read_state = 0         # read state for data parser
-        self.callbacks = []         # list of callbacks to be called when new data are available
+        self.protocol_version = PROTOCOL_VERSION  # protocol version of the device
+        self.requested_batch_size = batch_size  # samples requested in each packet
+        self.batch_size = 1         # samples in each packet sent by the device
+        self.link_baudrate = link_baudrate  # baud rate used after connecting
+        self.decoder = make_decoder(self.protocol_version)  # parser for incoming data packets
+        self.callbacks = ()         # callbacks to be called for each new sample
+        self.batch_callbacks = ()   # callbacks to be called for each new block of samples
         self.samples_counter = 0    # counter for samples received
+        self.stream_reader = None   # reader of the samples streamed by the device, once streaming
+        self.buffer = SampleRingBuffer(BUFFER_SIZE, BUFFER_DTYPE, VOLTS_PER_CODE)  # buffer drained by the GUI
+        self.recorder = None        # recorder of the sample stream, if recording
+        self.wave = 'SINE'          # wave currently selected on the board
+        self.range = 'LARGE'        # range currently selected on the board
+        self.replay = None          # replay of a recording, if replaying
+        self.monitor = PipelineMonitor()  # counters of the acquisition pipeline
+        self.stats = {}             # pipeline statistics at the last update
         self.timeout = 1        
-        # Start thread for automatic port discovery
-        find_port_thread = threading.Thread(target=self.find_port, daemon=True)
-        find_port_thread.start()
+        if (port_name is not None):
+            # Connect to the given port
+            self.port_name = port_name
+            connect_thread = threading.Thread(target=self.connect_to_port, daemon=True)
+            connect_thread.start()
+        elif (auto_connect):
+            # Start thread for automatic port discovery
+            find_port_thread = threading.Thread(target=self.find_port, daemon=True)
+            find_port_thread.start()
+        # Publish pipeline statistics on the main thread
+        Clock.schedule_interval(self.publish_stats, STATS_INTERVAL)
         
 
     def add_callback(self, callback):
@@ -123,10 +186,46 @@ class KivySerial(EventDispatcher, metaclass=Singleton):
 
         Add a callback to the list of callbacks
         that are called when a new sample is
-        available.
+        available. The callback receives the
+        sample value as a float.
+        Kept for compatibility: prefer #add_batch_callback
+        when high sample rates are used.
         """
         if (callback not in self.callbacks):
-            self.callbacks.append(callback)
+            self.callbacks = self.callbacks + (callback,)
+
+    def remove_callback(self, callback):
+        """
+        @brief Remove a callback added with #add_callback.
+        """
+        if (callback in self.callbacks):
+            self.callbacks = tuple(c for c in self.callbacks if c != callback)
+
+    def add_batch_callback(self, callback):
+        """
+        @brief Add batch callback.
+
+        Add a callback to the list of callbacks that are
+        called when a new block of samples is available.
+        The callback is called from the reader thread as
+        callback(samples, start_index, timestamps), where
+        samples is a NumPy array of voltages, start_index
+        the index of the first sample since streaming started,
+        and timestamps a NumPy array with the host time of
+        each sample, interpolated between consecutive reads.
+        Callbacks are kept in a tuple replaced on each change,
+        so they can be added and removed from any thread while
+        the reader thread iterates over them.
+        """
+        if (callback not in self.batch_callbacks):
+            self.batch_callbacks = self.batch_callbacks + (callback,)
+
+    def remove_batch_callback(self, callback):
+        """
+        @brief Remove a callback added with #add_batch_callback.
+        """
+        if (callback in self.batch_callbacks):
+            self.batch_callbacks = tuple(c for c in self.batch_callbacks if c != callback)
 
     def find_port(self):
         """
@@ -134,18 +233,30 @@ class KivySerial(EventDispatcher, metaclass=Singleton):
 
         This function scans all the available COM ports
         to check if one of them is correct one. It does it
-        by sending a #CONNECTION_CMD and checking if three
-        $$$ are found in the response.
+        by sending a #CONNECTION_CMD to all the ports at the
+        same time and checking if three $$$ are found in the
+        response. The port found is cached, and tried first
+        at the next launch.
         """
         wave_dac_port_found = False
         while (not wave_dac_port_found):
-            ports = list_ports.comports()
-            for port in ports:
-                wave_dac_port_found = self.check_wave_dac_port(port.device)
-                if (wave_dac_port_found):
-                    self.port_name = port.device
-                    if (self.connect() == 0):
-                        break
+            ports = discover_ports(self.baudrate, progress=self.discovery_progress)
+            if (len(ports) > 0):
+                self.port_name = ports[0].device
+                self.message_string = 'Device found on port: {}'.format(self.port_name)
+                self.connected = 1
+                if (self.connect() == 0):
+                    save_cached_port(ports[0])
+                    wave_dac_port_found = True
+            else:
+                time.sleep(DISCOVERY_INTERVAL)
+
+    def discovery_progress(self, port_name, found):
+        """
+        @brief Show the progress of port discovery.
+        """
+        if (not found):
+            self.message_string = 'Checked: {}'.format(port_name)
 
     def check_wave_dac_port(self, port_name):
         """
@@ -157,44 +268,152 @@ class KivySerial(EventDispatcher, metaclass=Singleton):
         @return True if port was found.
         """
         self.message_string = 'Checking: {}'.format(port_name)
-        try:
-            port = serial.Serial(port=port_name, baudrate=self.baudrate, timeout=5)
-            if (port.is_open):
-                port.write(CONNECTION_CMD.encode('utf-8'))
-                time.sleep(2)
-                received_string = ''
-                while (port.in_waiting > 0):
-                    received_string += port.read().decode('utf-8', errors='replace')
-                if ('$$$' in received_string):
-                    self.message_string = 'Device found on port: {}'.format(port_name)
-                    port.close()
-                    self.connected = 1
-                    time.sleep(1)
-                    return True
-        except serial.SerialException:
-            return False
-        except ValueError:
-            return False
+        if (probe_port(port_name, self.baudrate)):
+            self.message_string = 'Device found on port: {}'.format(port_name)
+            self.connected = 1
+            return True
         return False
 
+    def connect_to_port(self):
+        """
+        @brief Check and connect to the port set in #port_name.
+        """
+        if (self.check_wave_dac_port(self.port_name)):
+            self.connect()
+        else:
+            self.message_string = 'Device not found on port: {}'.format(self.port_name)
+
     def connect(self):
         """
         @brief Connect to the port.
+
+        The port is then used only on the I/O engine thread,
+        where the device is set up by #setup_device.
+        @return 0 if connected.
         """
-        self.port = serial.Serial(port=self.port_name, baudrate=self.baudrate, timeout=self.timeout)
+        self.port = open_transport(self.port_name, self.baudrate, self.timeout)
         if (self.port.isOpen()):
-            self.message_string = f'Device connected at {self.port_name}'
-            self.connected = 2
-            return 0
+            return self.engine.call(self.setup_device)
+
+    def setup_device(self):
+        """
+        @brief Set up the device just connected, on the I/O engine thread.
+
+        The device is set up as by the headless acquisition (see
+        discovery.configure_device): asked to send
+        #requested_batch_size samples in each packet and queried
+        for its sample rate. It is then switched to
+        #link_baudrate.
+        @return 0 if the device answered.
+        """
+        device = configure_device(self.port, self.requested_batch_size)
+        if (device is None):
+            self.port.close()
+            self.connected = 0
+            self.message_string = f'Device not responding at {self.port_name}'
+            return 1
+        self.protocol_version = device['protocol_version']
+        self.batch_size = device['batch_size']
+        self.decoder = device['decoder']
+        self.sample_rate = device['sample_rate'] or self.sample_rate
+        if (self.protocol_version >= 4 and self.link_baudrate is not None):
+            self.set_baudrate(self.link_baudrate)
+        self.message_string = f'Device connected at {self.port_name}'
+        self.connected = 2
+        return 0
+
+    def set_batch_size(self, batch_size):
+        """
+        @brief Set the number of samples in each data packet.
+
+        Only available while not streaming, with devices
+        supporting protocol version 3. The decoder is updated
+        with the batch size accepted by the device.
+        @return Batch size in use.
+        """
+        self.requested_batch_size = batch_size
+        if (not self.is_port_open() or self.is_streaming or self.protocol_version < 3):
+            return self.batch_size
+        accepted = self.engine.call(negotiate_batch_size, self.port, batch_size)
+        if (accepted > 0):
+            self.batch_size = accepted
+            self.decoder = make_decoder(self.protocol_version, accepted)
+        return self.batch_size
+
+    def set_sample_rate(self, sample_rate):
+        """
+        @brief Set the sample rate of the device.
+
+        Only available while not streaming, with devices
+        supporting protocol version 4. #sample_rate is updated
+        with the sample rate obtained by the device.
+        @return Sample rate in use (Hz).
+        """
+        if (not self.is_port_open()):
+            self.message_string = 'Board is not connected.'
+            return self.sample_rate
+        if (self.protocol_version < 4):
+            self.message_string = 'The device does not support changing the sample rate.'
+            return self.sample_rate
+        if (self.is_streaming):
+            self.message_string = 'Stop streaming before changing the sample rate.'
+            return self.sample_rate
+        obtained = self.engine.call(request_sample_rate, self.port, sample_rate)
+        if (obtained > 0):
+            self.sample_rate = obtained
+            self.message_string = f'Sample rate set to {obtained} Hz'
+            self.record_settings()
+        return self.sample_rate
+
+    def set_baudrate(self, baudrate):
+        """
+        @brief Switch the UART of device and host to a new baud rate.
+
+        Only available while not streaming, with devices
+        supporting protocol version 4 (see discovery.switch_baudrate).
+        @return Baud rate in use.
+        """
+        if (not self.is_port_open() or self.protocol_version < 4 or self.is_streaming):
+            return self.baudrate
+        accepted, answered = self.engine.call(switch_baudrate, self.port, baudrate)
+        if (accepted == 0):
+            self.message_string = f'Baud rate {baudrate} not available, using {self.baudrate}'
+            return self.baudrate
+        if (not answered):
+            self.message_string = f'Device not responding at {accepted} baud'
+            return self.baudrate
+        self.baudrate = accepted
+        self.message_string = f'Baud rate set to {accepted}'
+        return self.baudrate
+
+    def disconnect(self):
+        """
+        @brief Stop streaming and close the port.
+        """
+        if (not self.is_port_open()):
+            return
+        self.stop_streaming()
+        self.engine.call(self.port.close)
+        self.connected = 0
 
     def on_connected(self, instance, value):
         """
         @brief Callback for change in connected property.
         """
         if (value == 0):
-            self.is_streaming = False
+            if (self.is_streaming):
+                self.engine.call(self.engine.remove_reader, self.read_serial_binary)
+                self.is_streaming = False
             self.message_string = 'Device disconnected'
 
+    def port_error(self, error):
+        """
+        @brief Called on the I/O engine thread when reading from the port fails.
+        """
+        self.is_streaming = False
+        self.connected = 0
+        self.message_string = f'Device disconnected: {error}'
+
     def start_streaming(self):
         """
         @brief Start streaming data from serial port.
@@ -202,69 +421,125 @@ class KivySerial(EventDispatcher, metaclass=Singleton):
         if (not self.is_connected()):
             self.message_string = 'Board is not connected.'
             return
+        if (self.is_replaying()):
+            self.message_string = 'Stop the replay before streaming.'
+            return
 
         if (not (self.is_streaming)):
             self.message_string = 'Started streaming'
-            self.port.reset_input_buffer()
-            self.port.write(START_STREAMING_CMD.encode('utf-8'))
-            self.is_streaming = True
-            self.read_state = 0
-            self.skipped_bytes = 0
-            read_thread = threading.Thread(target=self.collect_data)
-            read_thread.daemon = True
-            read_thread.start()
-            self.samples_counter = 0
+            self.engine.call(self.begin_streaming)
+
+    def begin_streaming(self):
+        """
+        @brief Start streaming, on the I/O engine thread.
 
-    def collect_data(self):
+        The engine calls #read_serial_binary from now on.
         """
-        @brief Collect data from serial port while streaming is active.
+        self.stream_reader = StreamReader(self.port, self.decoder, self.monitor)
+        self.stream_reader.start()
+        self.samples_counter = 0
+        self.is_streaming = True
+        self.engine.add_reader(self.read_serial_binary, on_error=self.port_error)
+
+    def end_streaming(self):
         """
-        while(self.is_streaming):
-            self.skipped_bytes = 0
-            self.read_serial_binary()
+        @brief Stop streaming, on the I/O engine thread.
 
-    def read_serial_binary(self, max_bytes_to_skip=3000):
+        Once done, #read_serial_binary is not called anymore.
+        """
+        self.engine.remove_reader(self.read_serial_binary)
+        self.is_streaming = False
+        if (self.stream_reader is not None):
+            self.stream_reader.stop()
+
+    def read_serial_binary(self):
         '''
         @brief Serial data parser.
 
-        Parses incoming data packet into a Sample
-        Incoming packet structure:
-        START_BYTE(1)| DATA_MSB(1) | DATA_LSB(1) | END_BYTE (1)
+        Called by the I/O engine while streaming. Reads all the
+        bytes waiting in the input buffer in a single call, without
+        blocking, and decodes all the packets found with the decoder of the
+        protocol version of the device (see discovery.StreamReader).
+        Bytes of incomplete packets are carried over to the next read.
+        Incoming packet structure (protocol version 3, see BatchFrameDecoder):
+        BATCH_START_BYTE(1) | COUNT(1) | SEQ(1) | COUNT x (DATA_MSB(1) | DATA_LSB(1)) | CRC8(1) | END_BYTE (1)
+        @return Number of bytes read.
         '''
-        b = 0
-        while self.is_streaming:
-            while b != START_BYTE:
-                # Check packet header
-                self.skipped_bytes += 1
-                b = self.port.read(1)
-                if len(b) > 0:
-                    b = struct.unpack('B', b)[0]
-
-            self.skipped_bytes = 0
-            # Get three bytes
-            data = self.port.read(3)
-            data = struct.unpack('3B', data)
-            # Compute sensor data from 2 bytes and convert to V
-            sensor_data = (((data[0] << 8) & 0xFFFF) | data[1])
-            sensor_data = sensor_data/65535*5
-            if data[2] == END_BYTE:
-                # valid sample
-                self.samples_counter += 1
-                for callback in self.callbacks:
+        n_bytes, codes, timestamps = self.stream_reader.read()
+        if (codes is not None):
+            self.dispatch_samples(codes_to_volts(codes), timestamps, codes)
+        return n_bytes
+
+    def dispatch_samples(self, samples, timestamps, codes=None):
+        """
+        @brief Forward a block of samples to the callbacks.
+
+        The block is first written to #buffer, as ADC codes,
+        from which the GUI reads on the main thread, and to the
+        recorder, if recording, also as ADC codes. Batch
+        callbacks then receive the whole block at once, and
+        per-sample callbacks are called once per sample, all on
+        the calling thread.
+        Args:
+            - samples: NumPy array of voltages.
+            - timestamps: NumPy array with the host time of each sample.
+            - codes: NumPy array with the ADC codes of the samples, computed from the voltages if None.
+        """
+        start = time.perf_counter()
+        if (codes is None):
+            codes = encode_samples(samples, BUFFER_DTYPE, VOLTS_PER_CODE)
+        start_index = self.samples_counter
+        self.samples_counter += len(samples)
+        self.buffer.write(codes, timestamps)
+        recorder = self.recorder
+        if (recorder is not None):
+            recorder.write(codes, start_index, timestamps)
+        batch_callbacks = self.batch_callbacks
+        callbacks = self.callbacks
+        for callback in batch_callbacks:
+            callback(samples, start_index, timestamps)
+        if (len(callbacks) > 0):
+            for sensor_data in samples.tolist():
+                for callback in callbacks:
                     callback(sensor_data)
-                b = self.port.read(1)
-                if (len(b) > 0):
-                    b = struct.unpack('B', b)[0]
-            else:
-                print("Invalid data.")
+        self.monitor.record_dispatch(len(samples), time.perf_counter() - start)
+
+    def get_stats(self):
+        """
+        @brief Get the statistics of the acquisition pipeline.
+
+        Totals since streaming started, and rates computed
+        over the last #STATS_INTERVAL (see PipelineMonitor.get_stats).
+        """
+        stats = dict(self.stats)
+        stats.update(self.monitor.get_totals(self.decoder))
+        if (self.recorder is not None):
+            stats['recorder_dropped'] = self.recorder.dropped_samples
+        return stats
+
+    def publish_stats(self, dt):
+        """
+        @brief Update the statistics properties from the Kivy Clock.
+        """
+        stats = self.stats = self.monitor.get_stats(self.decoder)
+        self.samples_per_second = stats['samples_per_second']
+        self.skipped_bytes = stats['skipped_bytes']
+        self.invalid_packet_rate = stats['invalid_packets_per_second']
+        self.input_buffer_fill = stats['in_waiting']
+        self.callback_time = stats['callback_time_per_dispatch']
+        self.lost_samples = stats['lost_samples']
 
     def stop_streaming(self):
         """
         @brief Stop streaming from the serial port.
         """
+        if (self.is_replaying()):
+            self.stop_replay()
+            return
+        if (not self.is_connected()):
+            return
         self.message_string = 'Stopped streaming data'
-        self.is_streaming = False
-        self.port.write(STOP_STREAMING_CMD.encode('utf-8'))
+        self.engine.call(self.end_streaming)
 
     def select_wave(self, wave):
         """
@@ -272,18 +547,136 @@ class KivySerial(EventDispatcher, metaclass=Singleton):
 
         """
         if (wave.upper() == 'SINE'):
-            self.port.write(WAVE_SINE_CMD.encode('utf-8'))
+            self.engine.call(self.port.write, WAVE_SINE_CMD.encode('utf-8'))
         elif (wave.upper() == 'TRIANGLE'):
-            self.port.write(WAVE_TRIANGLE_CMD.encode('utf-8'))
+            self.engine.call(self.port.write, WAVE_TRIANGLE_CMD.encode('utf-8'))
+        else:
+            return
+        self.wave = wave.upper()
+        self.record_settings()
 
     def select_range(self, range_val):
         """
         @brief Select range among SMALL LARGE
         """
         if (range_val.upper() == 'SMALL'):
-            self.port.write(RANGE_SMALL_CMD.encode('utf-8'))
+            self.engine.call(self.port.write, RANGE_SMALL_CMD.encode('utf-8'))
         elif (range_val.upper() == 'LARGE'):
-            self.port.write(RANGE_LARGE_CMD.encode('utf-8'))
+            self.engine.call(self.port.write, RANGE_LARGE_CMD.encode('utf-8'))
+        else:
+            return
+        self.range = range_val.upper()
+        self.record_settings()
+
+    def get_settings(self):
+        """
+        @brief Get the current acquisition settings.
+        """
+        return {'wave': self.wave, 'range': self.range, 'sample_rate': self.sample_rate}
+
+    def start_recording(self, path=None):
+        """
+        @brief Start recording the sample stream to a file.
+
+        Samples are written by a dedicated thread, so the reader
+        thread never waits for the disk.
+        Args:
+            - path: file to be written. If not given, a time stamped
+              file is created in #RECORDINGS_FOLDER.
+        @return Path of the recording.
+        """
+        if (self.recorder is not None):
+            return self.recorder.path
+        if (path is None):
+            os.makedirs(RECORDINGS_FOLDER, exist_ok=True)
+            tag = re.sub(r'\W+', '_', self.name).strip('_').lower()
+            path = os.path.join(RECORDINGS_FOLDER,
+                                time.strftime('psockivy_%Y%m%d_%H%M%S_') + tag + '.pskv')
+        metadata = {'device': self.name, 'port': self.port_name, 'baudrate': self.baudrate}
+        metadata.update(self.get_settings())
+        # Loaded on first use, as recording is not needed at startup
+        from recorder import Recorder
+        self.recorder = Recorder(path, metadata)
+        self.recorder.start()
+        self.message_string = f'Recording to {path}'
+        return path
+
+    def stop_recording(self):
+        """
+        @brief Stop recording and close the file.
+        """
+        if (self.recorder is None):
+            return
+        recorder = self.recorder
+        self.recorder = None
+        recorder.stop()
+        self.message_string = f'Recording saved to {recorder.path}'
+
+    def is_recording(self):
+        """
+        @brief Check if the sample stream is being recorded.
+        """
+        return self.recorder is not None
+
+    def start_replay(self, path, speed=1.0):
+        """
+        @brief Replay a recording as if it was streamed by the board.
+
+        Args:
+            - path: recording to be replayed.
+            - speed: replay speed, 1 for real time, 0 for as fast as possible.
+        """
+        if (self.is_streaming):
+            self.message_string = 'Stop streaming before replaying.'
+            return
+        self.stop_replay()
+        from replay import ReplaySource
+        try:
+            self.replay = ReplaySource(self, path, speed)
+        except (OSError, ValueError) as e:
+            self.message_string = f'Cannot replay: {e}'
+            return
+        self.replay.on_finished = self.replay_finished
+        self.samples_counter = 0
+        self.replay.start()
+        self.message_string = f'Replaying {path}'
+
+    def stop_replay(self):
+        """
+        @brief Stop the current replay, if any.
+        """
+        if (self.replay is not None):
+            self.replay.stop()
+
+    def replay_finished(self, replay):
+        """
+        @brief Called from the replay thread when the replay ends.
+        """
+        stats = replay.get_stats()
+        self.message_string = (f"Replay ended: {stats['samples']} samples, "
+                               f"{stats['samples_per_second']:.0f} samples/s")
+        replay.reader.close()
+        if (self.replay is replay):
+            self.replay = None
+
+    def is_replaying(self):
+        """
+        @brief Check if a recording is being replayed.
+        """
+        return self.replay is not None
+
+    def record_settings(self):
+        """
+        @brief Store the current settings in the recording, if any.
+        """
+        if (self.recorder is not None):
+            self.recorder.set_settings(self.samples_counter, **self.get_settings())
+
+    def is_port_open(self):
+        """
+        @brief Check if the port to the device is open.
+        """
+        return self.port is not None and self.port.isOpen()
 
     def is_connected(self):
         """
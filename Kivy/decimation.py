@@ -0,0 +1,189 @@
+import numpy as np
+
+def minmax_decimate(x, y, n_columns):
+    """
+    @brief Min/max decimation of a line.
+
+    The points are split in n_columns consecutive buckets,
+    one per pixel column, and only the minimum and the maximum
+    of each bucket are kept, in their original order. Peaks
+    remain visible whatever the number of input points, while
+    at most 2*n_columns points are returned.
+    Args:
+        - x: array of x values.
+        - y: array of y values.
+        - n_columns: number of buckets (e.g. plot width in pixels).
+    @return Tuple (x, y) with the decimated arrays.
+    """
+    n_points = len(y)
+    if (n_columns < 1 or n_points <= 2 * n_columns):
+        return x, y
+    bucket_len = -(-n_points // n_columns)
+    n_buckets = -(-n_points // bucket_len)
+    # Pad with the last value, which does not change min and max
+    padded = np.empty(n_buckets * bucket_len, dtype=y.dtype)
+    padded[:n_points] = y
+    padded[n_points:] = y[-1]
+    buckets = padded.reshape(n_buckets, bucket_len)
+    offsets = np.arange(n_buckets) * bucket_len
+    i_min = np.minimum(buckets.argmin(axis=1) + offsets, n_points - 1)
+    i_max = np.minimum(buckets.argmax(axis=1) + offsets, n_points - 1)
+    indices = np.empty(2 * n_buckets, dtype=np.intp)
+    indices[0::2] = np.minimum(i_min, i_max)
+    indices[1::2] = np.maximum(i_min, i_max)
+    return x[indices], y[indices]
+
+def lttb_decimate(x, y, n_out):
+    """
+    @brief Largest-Triangle-Three-Buckets decimation of a line.
+
+    Keeps the first and last point and, for each of the n_out-2
+    buckets in between, the point forming the largest triangle
+    with the point selected in the previous bucket and the mean
+    of the next bucket.
+    Args:
+        - x: array of x values.
+        - y: array of y values.
+        - n_out: number of points to return.
+    @return Tuple (x, y) with the decimated arrays.
+    """
+    n_points = len(y)
+    if (n_out < 3 or n_points <= n_out):
+        return x, y
+    # Integer samples, e.g. ADC codes, would wrap around in the differences
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, n_points - 1, n_out - 1).astype(np.intp)
+    indices = np.empty(n_out, dtype=np.intp)
+    indices[0] = 0
+    indices[-1] = n_points - 1
+    selected = 0
+    for bucket in range(n_out - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_end = edges[bucket + 2] if bucket + 2 < len(edges) else n_points
+        next_x = x[end:next_end].mean() if next_end > end else x[-1]
+        next_y = y[end:next_end].mean() if next_end > end else y[-1]
+        areas = np.abs((x[selected] - next_x) * (y[start:end] - y[selected])
+                       - (x[selected] - x[start:end]) * (next_y - y[selected]))
+        selected = start + int(areas.argmax())
+        indices[bucket + 1] = selected
+    return x[indices], y[indices]
+
+class RollingMinMax(object):
+    """
+    @brief Min/max decimation of a rolling window, updated incrementally.
+
+    The samples are split in columns of #column_len consecutive
+    samples, aligned on the index of the samples since the
+    start, so a column does not change once complete. The
+    minimum and the maximum of each column of the window, with
+    their indices, are kept in a ring of columns: pushing a
+    block only updates the columns it touches, and the points
+    to draw are gathered in O(columns), whatever the window
+    length. The oldest column may still hold up to
+    #column_len - 1 samples that left the window; its points
+    are then drawn at the left edge of the window.
+    """
+
+    def __init__(self, samples, n_columns):
+        """
+        @brief Initialize the columns of a window.
+
+        Args:
+            - samples: samples in the window, oldest first; their number is the window length.
+            - n_columns: number of columns (e.g. plot width in pixels).
+        """
+        samples = np.asarray(samples)
+        self.n_points = len(samples)
+        self.n_columns = n_columns
+        self.column_len = max(1, -(-self.n_points // max(n_columns, 1)))
+        n_slots = -(-self.n_points // self.column_len) + 1
+        self.columns = np.full(n_slots, -1, dtype=np.int64)     # column held by each slot
+        self.min_values = np.zeros(n_slots, dtype=samples.dtype)
+        self.max_values = np.zeros(n_slots, dtype=samples.dtype)
+        self.min_indices = np.zeros(n_slots, dtype=np.int64)
+        self.max_indices = np.zeros(n_slots, dtype=np.int64)
+        self.count = 0          # samples pushed so far
+        self.push(samples)
+
+    def push(self, values):
+        """
+        @brief Append a block of samples, updating the columns it touches.
+        """
+        values = np.asarray(values)
+        if (len(values) > self.n_points):
+            self.count += len(values) - self.n_points
+            values = values[-self.n_points:]
+        n_values = len(values)
+        if (n_values == 0):
+            return
+        start = self.count
+        column_len = self.column_len
+        # Samples completing the column of the first sample
+        head = min(n_values, -start % column_len)
+        if (head > 0):
+            self.merge(start // column_len, values[:head], start)
+        # Complete columns, all at once
+        n_full = (n_values - head) // column_len
+        if (n_full > 0):
+            first = start + head
+            blocks = values[head:head + n_full * column_len].reshape(n_full, column_len)
+            rows = np.arange(n_full)
+            slots = (first // column_len + rows) % len(self.columns)
+            i_min = blocks.argmin(axis=1)
+            i_max = blocks.argmax(axis=1)
+            self.columns[slots] = first // column_len + rows
+            self.min_values[slots] = blocks[rows, i_min]
+            self.max_values[slots] = blocks[rows, i_max]
+            self.min_indices[slots] = first + rows * column_len + i_min
+            self.max_indices[slots] = first + rows * column_len + i_max
+        # Samples starting the column of the last sample
+        tail = n_values - head - n_full * column_len
+        if (tail > 0):
+            self.merge((start + n_values - tail) // column_len, values[-tail:], start + n_values - tail)
+        self.count += n_values
+
+    def merge(self, column, values, first_index):
+        """
+        @brief Add samples, all in one column, to the minimum and maximum of the column.
+        """
+        slot = column % len(self.columns)
+        i_min = int(values.argmin())
+        i_max = int(values.argmax())
+        if (self.columns[slot] != column):
+            self.columns[slot] = column
+            self.min_values[slot] = values[i_min]
+            self.max_values[slot] = values[i_max]
+            self.min_indices[slot] = first_index + i_min
+            self.max_indices[slot] = first_index + i_max
+            return
+        # Keep the earliest extremum, as argmin and argmax do
+        if (values[i_min] < self.min_values[slot]):
+            self.min_values[slot] = values[i_min]
+            self.min_indices[slot] = first_index + i_min
+        if (values[i_max] > self.max_values[slot]):
+            self.max_values[slot] = values[i_max]
+            self.max_indices[slot] = first_index + i_max
+
+    def points(self):
+        """
+        @brief Get the minimum and the maximum of each column of the window, in their original order.
+
+        @return Tuple (positions, values) with the position of
+        each point in the window (0 for the oldest sample) and
+        its value, in the data type of the samples.
+        """
+        oldest = self.count - self.n_points
+        columns = np.arange(oldest // self.column_len, (self.count - 1) // self.column_len + 1)
+        slots = columns % len(self.columns)
+        i_min = self.min_indices[slots]
+        i_max = self.max_indices[slots]
+        min_first = i_min <= i_max
+        positions = np.empty(2 * len(slots), dtype=np.int64)
+        positions[0::2] = np.where(min_first, i_min, i_max)
+        positions[1::2] = np.where(min_first, i_max, i_min)
+        values = np.empty(2 * len(slots), dtype=self.min_values.dtype)
+        values[0::2] = np.where(min_first, self.min_values[slots], self.max_values[slots])
+        values[1::2] = np.where(min_first, self.max_values[slots], self.min_values[slots])
+        positions -= oldest
+        np.maximum(positions, 0, out=positions)
+        return positions, values
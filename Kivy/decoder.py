@@ -0,0 +1,363 @@
+import numpy as np
+
+"""
+@brief Start byte of the data packet
+"""
+START_BYTE = 0xA0
+
+"""
+@brief End byte of the data packet
+"""
+END_BYTE = 0xC0
+
+"""
+@brief Size of the data packet in bytes.
+"""
+PACKET_SIZE = 4
+
+"""
+@brief Start byte of the sequence-numbered data packet (protocol version 2).
+"""
+SEQ_START_BYTE = 0xA1
+
+"""
+@brief Size of the sequence-numbered data packet in bytes.
+"""
+SEQ_PACKET_SIZE = 6
+
+"""
+@brief Start byte of the packets carrying a batch of samples (protocol version 3).
+"""
+BATCH_START_BYTE = 0xA2
+
+"""
+@brief Maximum number of samples in a batch packet.
+"""
+MAX_BATCH_SIZE = 64
+
+"""
+@brief Polynomial of the CRC-8 of the sequence-numbered packets.
+"""
+CRC8_POLY = 0x07
+
+"""
+@brief Full scale voltage of the ADC data.
+"""
+FULL_SCALE_VOLTAGE = 5
+
+"""
+@brief ADC code corresponding to #FULL_SCALE_VOLTAGE.
+"""
+MAX_CODE = 65535
+
+"""
+@brief Voltage of one ADC code (V).
+"""
+VOLTS_PER_CODE = FULL_SCALE_VOLTAGE / float(MAX_CODE)
+
+def codes_to_volts(codes):
+    """
+    @brief Convert an array of ADC codes to voltages, all at once.
+    """
+    return codes / MAX_CODE * FULL_SCALE_VOLTAGE
+
+def _crc8_table(poly):
+    """
+    @brief Build the lookup table of a CRC-8 with the given polynomial.
+    """
+    table = np.zeros(256, dtype=np.uint8)
+    for byte in range(256):
+        crc = byte
+        for bit in range(8):
+            crc = ((crc << 1) ^ poly) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        table[byte] = crc
+    return table
+
+"""
+@brief Lookup table of the CRC-8, as used by the firmware.
+"""
+CRC8_TABLE = _crc8_table(CRC8_POLY)
+
+def crc8(data):
+    """
+    @brief CRC-8 (polynomial #CRC8_POLY, initial value 0) of a sequence of bytes.
+    """
+    crc = 0
+    for byte in bytes(data):
+        crc = int(CRC8_TABLE[crc ^ byte])
+    return crc
+
+class FrameDecoder(object):
+    """
+    @brief Vectorized decoder for the binary data packets.
+
+    Bytes received from the serial port are fed to the decoder
+    in chunks of arbitrary size. All the complete packets found
+    in a chunk are located and decoded at once with NumPy, while
+    the trailing bytes of a packet that is not complete yet are
+    kept and prepended to the next chunk.
+    Packet structure:
+    START_BYTE(1)| DATA_MSB(1) | DATA_LSB(1) | END_BYTE (1)
+    """
+
+    """
+    @brief Protocol version of the packets decoded.
+    """
+    version = 1
+
+    """
+    @brief Start byte of the packets decoded.
+    """
+    start_byte = START_BYTE
+
+    """
+    @brief Size of the packets decoded in bytes.
+    """
+    packet_size = PACKET_SIZE
+
+    """
+    @brief Offset of the most significant data byte in the packet.
+    """
+    data_offset = 1
+
+    def __init__(self):
+        """
+        @brief Initialize the decoder.
+        """
+        self.reset()
+
+    def reset(self):
+        """
+        @brief Drop pending bytes and reset the counters.
+        """
+        self.pending = b''          # bytes of an incomplete packet
+        self.skipped_bytes = 0      # bytes discarded while looking for a packet
+        self.invalid_packets = 0    # start bytes not followed by a valid packet
+        self.valid_packets = 0      # number of decoded packets
+        self.lost_samples = 0       # samples missing from the sequence
+        self.sequence_gaps = 0      # interruptions of the sequence
+
+    def decode(self, chunk):
+        """
+        @brief Decode a chunk of bytes.
+
+        Args:
+            - chunk: bytes read from the serial port.
+        @return NumPy array with the voltage of each valid packet.
+        """
+        return codes_to_volts(self.decode_codes(chunk))
+
+    def decode_codes(self, chunk):
+        """
+        @brief Decode a chunk of bytes, without converting the samples to voltages.
+
+        Args:
+            - chunk: bytes read from the serial port.
+        @return NumPy uint16 array with the ADC code of each valid packet.
+        """
+        if (len(self.pending) > 0):
+            chunk = self.pending + chunk
+        data = np.frombuffer(chunk, dtype=np.uint8)
+        packet_size = self.packet_size
+        # Last index at which a complete packet can start
+        last_start = data.size - packet_size
+        if (last_start < 0):
+            self.pending = bytes(chunk)
+            return np.empty(0, dtype=np.uint16)
+
+        headers = data[:last_start + 1] == self.start_byte
+        starts = np.flatnonzero(headers & (data[packet_size - 1:] == END_BYTE))
+        starts = starts[self._check_packets(data, starts)]
+        if (starts.size > 1 and np.any(np.diff(starts) < packet_size)):
+            starts = self._select_packets(starts)
+
+        # Keep the bytes that could still be part of a packet
+        consumed = last_start + 1
+        if (starts.size > 0):
+            consumed = max(consumed, int(starts[-1]) + packet_size)
+        self.pending = bytes(chunk[consumed:])
+
+        # Start bytes inside valid packets are data, not broken packets
+        covered = np.zeros(data.size, dtype=bool)
+        for offset in range(packet_size):
+            covered[starts + offset] = True
+        self.invalid_packets += int(np.count_nonzero(headers & ~covered[:last_start + 1]))
+        self.skipped_bytes += consumed - starts.size * packet_size
+        self.valid_packets += starts.size
+        self._check_sequence(data, starts)
+        return self._values(data, starts)
+
+    def _values(self, data, starts):
+        """
+        @brief Get the ADC codes carried by the decoded packets.
+        """
+        # Compute sensor data from 2 bytes
+        msb = starts + self.data_offset
+        return (data[msb].astype(np.uint16) << 8) | data[msb + 1]
+
+    def _check_packets(self, data, starts):
+        """
+        @brief Check the candidate packets beyond start and end bytes.
+
+        @return Boolean mask of the valid candidates.
+        """
+        return np.ones(starts.size, dtype=bool)
+
+    def _check_sequence(self, data, starts):
+        """
+        @brief Count the samples missing between the decoded packets.
+        """
+        pass
+
+    def _select_packets(self, starts):
+        """
+        @brief Resolve overlapping packet candidates.
+
+        A data byte equal to #START_BYTE can look like the start
+        of a packet overlapping a real one. Candidates that are
+        chained to another candidate exactly one packet apart are
+        preferred, the remaining ones are kept only if they do not
+        overlap an accepted packet.
+        """
+        packet_size = self.packet_size
+        chained = (np.isin(starts + packet_size, starts)
+                   | np.isin(starts - packet_size, starts))
+        accepted = []
+        last_end = -1
+        for start in starts[chained].tolist():
+            if (start >= last_end):
+                accepted.append(start)
+                last_end = start + packet_size
+        for start in starts[~chained].tolist():
+            pos = np.searchsorted(accepted, start)
+            if ((pos == 0 or accepted[pos - 1] + packet_size <= start)
+                    and (pos == len(accepted) or start + packet_size <= accepted[pos])):
+                accepted.insert(pos, start)
+        return np.array(accepted, dtype=np.intp)
+
+
+class SequencedFrameDecoder(FrameDecoder):
+    """
+    @brief Decoder for the sequence-numbered packets of protocol version 2.
+
+    Each packet carries an 8-bit sequence number, incremented
+    for every sample sent since streaming started, and the
+    CRC-8 of sequence number and data. Candidates whose CRC
+    does not match are discarded, so data bytes equal to the
+    start byte cannot cause false resynchronizations, and the
+    jumps in the sequence count the samples lost. Gaps longer
+    than 255 samples are counted modulo 256.
+    Packet structure:
+    SEQ_START_BYTE(1) | SEQ(1) | DATA_MSB(1) | DATA_LSB(1) | CRC8(1) | END_BYTE (1)
+    """
+    version = 2
+    start_byte = SEQ_START_BYTE
+    packet_size = SEQ_PACKET_SIZE
+    data_offset = 2
+
+    """
+    @brief Offset of the sequence number in the packet.
+    """
+    sequence_offset = 1
+
+    """
+    @brief Number of samples in each packet.
+    """
+    samples_per_packet = 1
+
+    def reset(self):
+        """
+        @brief Drop pending bytes and reset the counters.
+        """
+        super(SequencedFrameDecoder, self).reset()
+        self.last_sequence = None   # sequence number of the last packet decoded
+
+    def _check_packets(self, data, starts):
+        """
+        @brief Check the CRC-8 of the candidate packets.
+        """
+        crc = CRC8_TABLE[data[starts + 1]]
+        crc = CRC8_TABLE[crc ^ data[starts + 2]]
+        crc = CRC8_TABLE[crc ^ data[starts + 3]]
+        return crc == data[starts + 4]
+
+    def _check_sequence(self, data, starts):
+        """
+        @brief Count the samples missing between the decoded packets.
+        """
+        if (starts.size == 0):
+            return
+        sequence = data[starts + self.sequence_offset].astype(np.int16)
+        if (self.last_sequence is not None):
+            sequence = np.concatenate(([self.last_sequence], sequence))
+        self.last_sequence = int(sequence[-1])
+        missing = (np.diff(sequence) - self.samples_per_packet) & 0xFF
+        self.lost_samples += int(missing.sum())
+        self.sequence_gaps += int(np.count_nonzero(missing))
+
+class BatchFrameDecoder(SequencedFrameDecoder):
+    """
+    @brief Decoder for the packets carrying a batch of samples.
+
+    Used with protocol version 3, once the batch size has been
+    set with #BATCH_SIZE_CMD. All the packets carry the same
+    number of samples, so they have a fixed size and are
+    located and unpacked at once as with single-sample packets.
+    The sequence number is the one of the first sample of the
+    packet and the CRC-8 covers count, sequence number and data.
+    Packet structure:
+    BATCH_START_BYTE(1) | COUNT(1) | SEQ(1) | COUNT x (DATA_MSB(1) | DATA_LSB(1)) | CRC8(1) | END_BYTE (1)
+    """
+    version = 3
+    start_byte = BATCH_START_BYTE
+    sequence_offset = 2
+
+    def __init__(self, batch_size):
+        """
+        @brief Initialize the decoder.
+
+        Args:
+            - batch_size: number of samples in each packet.
+        """
+        self.samples_per_packet = batch_size
+        self.packet_size = 2 * batch_size + 5
+        super(BatchFrameDecoder, self).__init__()
+
+    def _check_packets(self, data, starts):
+        """
+        @brief Check sample count and CRC-8 of the candidate packets.
+        """
+        crc = np.zeros(starts.size, dtype=np.uint8)
+        for offset in range(1, self.packet_size - 2):
+            crc = CRC8_TABLE[crc ^ data[starts + offset]]
+        return ((data[starts + 1] == self.samples_per_packet)
+                & (crc == data[starts + self.packet_size - 2]))
+
+    def _values(self, data, starts):
+        """
+        @brief Get the ADC codes carried by the decoded packets, in order.
+        """
+        msb = (starts[:, np.newaxis] + 3 + 2 * np.arange(self.samples_per_packet)).reshape(-1)
+        return (data[msb].astype(np.uint16) << 8) | data[msb + 1]
+
+"""
+@brief Decoder class for each protocol version, for single-sample packets.
+"""
+DECODERS = {
+    FrameDecoder.version: FrameDecoder,
+    SequencedFrameDecoder.version: SequencedFrameDecoder,
+    BatchFrameDecoder.version: SequencedFrameDecoder,
+}
+
+def make_decoder(version, batch_size=1):
+    """
+    @brief Create the decoder for the packets of a protocol version.
+
+    Unknown versions fall back to the most recent decoder.
+    Args:
+        - version: protocol version of the device.
+        - batch_size: samples in each packet, as set with #BATCH_SIZE_CMD.
+    """
+    if (version >= BatchFrameDecoder.version and batch_size > 1):
+        return BatchFrameDecoder(batch_size)
+    return DECODERS.get(version, DECODERS[max(DECODERS)])()
@@ -0,0 +1,272 @@
+from kivy.event import EventDispatcher
+from kivy.properties import ListProperty, NumericProperty, ObjectProperty, StringProperty
+import functools
+import threading
+import time
+from communication import KivySerial, Singleton, DEFAULT_BATCH_SIZE, DISCOVERY_INTERVAL
+from discovery import discover_ports, save_cached_port
+
+class DeviceManager(EventDispatcher, metaclass=Singleton):
+    """
+    @brief Manager of the boards connected to the application.
+
+    Each board is driven by its own KivySerial instance, with its
+    own decoder, sample buffer and callbacks, while the reads of
+    all the ports are performed by the shared I/O engine. Samples
+    of different boards are therefore never funnelled through a
+    common callback list, and the acquisition throughput grows
+    with the number of boards.
+    Port discovery probes all the available ports and connects
+    to every board found. The first device always exists, even
+    if no board is connected, so that recordings can be replayed.
+    It has @Singleton as a metaclass, so the GUI widgets share
+    the same manager.
+    """
+
+    """
+    @brief Devices managed, in the order they were added.
+    """
+    devices = ListProperty([])
+
+    """
+    @brief Device the toolbar commands and the bottom bar refer to.
+    """
+    active = ObjectProperty(None)
+
+    """
+    @brief Connection status of the active device (see KivySerial.connected).
+    """
+    connected = NumericProperty(0)
+
+    """
+    @brief Message to be shown, from any of the devices.
+    """
+    message_string = StringProperty('')
+
+    __events__ = ('on_device_added',)
+
+    def __init__(self, baudrate=115200, auto_connect=True, port_names=None,
+                 batch_size=DEFAULT_BATCH_SIZE, link_baudrate=None):
+        """
+        @brief Initialize the manager.
+
+        Args:
+            - baudrate: baudrate for port discovery and handshake.
+            - auto_connect: call #start_discovery now, else it is left to the caller.
+            - port_names: ports to connect to, skipping discovery.
+            - batch_size: samples requested in each data packet.
+            - link_baudrate: baud rate to switch to after connecting.
+        """
+        super(DeviceManager, self).__init__()
+        self.baudrate = baudrate
+        self.batch_size = batch_size
+        self.link_baudrate = link_baudrate
+        self.port_names = list(port_names or [])  # ports to connect to instead of discovery
+        self.batch_callbacks = []   # callbacks called with the samples of any device
+        self.lock = threading.Lock()
+        self.discovery_started = False
+        self.ports_checked = 0      # ports probed by the current discovery
+        self.add_device()
+        if (auto_connect):
+            self.start_discovery()
+
+    def start_discovery(self):
+        """
+        @brief Connect to the ports given, or start the discovery of all the boards.
+
+        Ports are opened and probed on background threads, so
+        this returns immediately; the progress is reported in
+        #message_string. Only the first call has an effect.
+        """
+        if (self.discovery_started):
+            return
+        self.discovery_started = True
+        if (len(self.port_names) > 0):
+            for i, port_name in enumerate(self.port_names):
+                device = self.devices[0] if i == 0 else self.add_device()
+                device.port_name = port_name
+                threading.Thread(target=device.connect_to_port, daemon=True).start()
+        else:
+            # Start thread for automatic discovery of all the boards
+            self.message_string = 'Searching for boards...'
+            threading.Thread(target=self.find_ports, daemon=True).start()
+
+    def on_device_added(self, device):
+        """
+        @brief Event dispatched, possibly on a discovery thread, when a device is added.
+        """
+        pass
+
+    def add_device(self):
+        """
+        @brief Create a new device, not connected.
+
+        @return KivySerial instance of the device.
+        """
+        with self.lock:
+            index = len(self.devices)
+            device = KivySerial(baudrate=self.baudrate, auto_connect=False,
+                                batch_size=self.batch_size, link_baudrate=self.link_baudrate,
+                                name='WaveDAC' if index == 0 else f'WaveDAC {index + 1}')
+            for callback in self.batch_callbacks:
+                device.add_batch_callback(functools.partial(callback, device))
+            device.bind(message_string=self.device_message)
+            device.bind(connected=self.device_connected)
+            self.devices.append(device)
+        if (self.active is None):
+            self.active = device
+        self.dispatch('on_device_added', device)
+        return device
+
+    def find_ports(self):
+        """
+        @brief Discovery of all the boards connected.
+
+        Probes all the ports until at least one board is found,
+        and connects to each of them. The first board found uses
+        the first device, the others get a new device.
+        """
+        while (not self.discover()):
+            time.sleep(DISCOVERY_INTERVAL)
+
+    def discover(self):
+        """
+        @brief Probe the ports not in use and connect to the boards found.
+
+        @return Number of devices connected after discovery.
+        """
+        in_use = set(device.port_name for device in self.devices if device.is_port_open())
+        self.ports_checked = 0
+        for port in discover_ports(self.baudrate, first_only=False, progress=self.discovery_progress):
+            if (port.device in in_use):
+                continue
+            device = self.free_device() or self.add_device()
+            device.port_name = port.device
+            device.message_string = 'Device found on port: {}'.format(port.device)
+            device.connected = 1
+            if (device.connect() == 0):
+                save_cached_port(port)
+        return len(self.connected_devices())
+
+    def discovery_progress(self, port_name, found):
+        """
+        @brief Show the progress of port discovery.
+        """
+        self.ports_checked += 1
+        if (not found):
+            self.message_string = 'Searching for boards: {} ports checked ({})'.format(
+                self.ports_checked, port_name)
+
+    def free_device(self):
+        """
+        @brief Get a device not connected nor replaying, if any.
+        """
+        for device in self.devices:
+            if (not device.is_port_open() and not device.is_replaying()):
+                return device
+        return None
+
+    def connected_devices(self):
+        """
+        @brief Get the devices connected.
+        """
+        return [device for device in self.devices if device.is_connected()]
+
+    def device_message(self, device, value):
+        """
+        @brief Show a message of a device, tagged with its name if several devices exist.
+        """
+        if (len(self.devices) > 1):
+            value = f'{device.name}: {value}'
+        self.message_string = value
+
+    def device_connected(self, device, value):
+        """
+        @brief Callback for change in the connection status of a device.
+        """
+        if (device is self.active):
+            self.connected = value
+
+    def on_active(self, instance, value):
+        """
+        @brief Callback for change of the active device.
+        """
+        self.connected = value.connected if value is not None else 0
+
+    def add_batch_callback(self, callback):
+        """
+        @brief Add a callback receiving the samples of all the devices.
+
+        The callback is added to each device, present or future,
+        as callback(device, samples, start_index, timestamps),
+        and is called on the thread reading that device.
+        """
+        with self.lock:
+            if (callback in self.batch_callbacks):
+                return
+            self.batch_callbacks.append(callback)
+            for device in self.devices:
+                device.add_batch_callback(functools.partial(callback, device))
+
+    def remove_batch_callback(self, callback):
+        """
+        @brief Remove a callback added with #add_batch_callback.
+        """
+        with self.lock:
+            if (callback not in self.batch_callbacks):
+                return
+            self.batch_callbacks.remove(callback)
+            for device in self.devices:
+                for bound in list(device.batch_callbacks):
+                    if (isinstance(bound, functools.partial) and bound.func is callback):
+                        device.remove_batch_callback(bound)
+
+    def start_streaming(self):
+        """
+        @brief Start streaming from all the devices connected.
+        """
+        for device in self.connected_devices():
+            device.start_streaming()
+
+    def stop_streaming(self):
+        """
+        @brief Stop streaming from all the devices.
+        """
+        for device in self.devices:
+            device.stop_streaming()
+
+    def start_recording(self):
+        """
+        @brief Start recording all the devices connected, each to its own file.
+
+        @return List of paths of the recordings.
+        """
+        return [device.start_recording() for device in self.connected_devices()]
+
+    def stop_recording(self):
+        """
+        @brief Stop all the recordings.
+        """
+        for device in self.devices:
+            device.stop_recording()
+
+    def is_recording(self):
+        """
+        @brief Check if any device is being recorded.
+        """
+        return any(device.is_recording() for device in self.devices)
+
+    def get_stats(self):
+        """
+        @brief Get the pipeline statistics of each device.
+
+        @return Dictionary of KivySerial.get_stats dictionaries, by device name.
+        """
+        return dict((device.name, device.get_stats()) for device in self.devices)
+
+    def disconnect(self):
+        """
+        @brief Stop streaming and close the ports of all the devices.
+        """
+        for device in self.devices:
+            device.disconnect()
@@ -0,0 +1,345 @@
+import concurrent.futures
+import json
+import os
+import struct
+import time
+import numpy as np
+import serial
+import serial.tools.list_ports as list_ports
+from protocol import (CONNECTION_CMD, BATCH_SIZE_CMD, GET_SAMPLE_RATE_CMD, SAMPLE_RATE_CMD,
+                      BAUDRATE_CMD, START_STREAMING_CMD, STOP_STREAMING_CMD, CONNECTION_RESPONSE,
+                      SAMPLE_RATE_RESPONSE, BAUDRATE_RESPONSE, MAX_SAMPLE_RATE, DEFAULT_SAMPLE_RATE,
+                      parse_protocol_version, parse_value, parse_batch_size)
+from decoder import make_decoder
+from transport import open_transport
+
+"""
+@brief File where the last port found is cached between launches.
+"""
+CACHE_FILE = os.path.join(os.path.expanduser('~'), '.psockivy', 'last_port.json')
+
+"""
+@brief Maximum time to wait for the response to #CONNECTION_CMD (s).
+"""
+PROBE_TIMEOUT = 1.5
+
+"""
+@brief Maximum number of ports probed at the same time.
+"""
+MAX_PARALLEL_PROBES = 16
+
+def send_command(port, command, marker, timeout=PROBE_TIMEOUT):
+    """
+    @brief Send a command on an open port and wait for the response.
+
+    Polls the port until marker is received or timeout expires.
+    Args:
+        - port: open transport.
+        - command: bytes of the command.
+        - marker: bytes ending the response.
+        - timeout: maximum time to wait for the response (s).
+    @return Bytes received, empty if marker was not received.
+    """
+    port.reset_input_buffer()
+    port.write(command)
+    received = b''
+    deadline = time.monotonic() + timeout
+    while (time.monotonic() < deadline):
+        n_bytes = port.in_waiting
+        if (n_bytes > 0):
+            received += port.read(n_bytes)
+            if (marker in received):
+                return received
+        else:
+            time.sleep(0.01)
+    return b''
+
+def handshake(port, timeout=PROBE_TIMEOUT):
+    """
+    @brief Send #CONNECTION_CMD on an open port and wait for the response.
+
+    @return Protocol version of the device, 0 if it did not answer.
+    """
+    response = send_command(port, CONNECTION_CMD.encode('utf-8'),
+                            CONNECTION_RESPONSE.encode('utf-8'), timeout)
+    return parse_protocol_version(response)
+
+def negotiate_batch_size(port, batch_size, timeout=PROBE_TIMEOUT):
+    """
+    @brief Ask the device to send batch_size samples in each packet.
+
+    Requires protocol version 3. The device may accept a
+    smaller batch size than the one requested.
+    @return Batch size accepted, 0 if the device did not answer.
+    """
+    response = send_command(port, BATCH_SIZE_CMD.encode('utf-8') + bytes([min(max(batch_size, 1), 255)]),
+                            b'\r\n', timeout)
+    return parse_batch_size(response)
+
+def probe_port(port_name, baudrate, timeout=PROBE_TIMEOUT):
+    """
+    @brief Check if the device is connected to a port.
+
+    @return Protocol version of the device, 0 if it did not answer.
+    """
+    try:
+        with open_transport(port_name, baudrate, timeout=0) as port:
+            return handshake(port, timeout)
+    except (serial.SerialException, ValueError, OSError):
+        return 0
+
+def port_info(port):
+    """
+    @brief Get the identifiers of a port as a dictionary.
+
+    Args:
+        - port: port description returned by list_ports.comports().
+    """
+    return {
+        'device': port.device,
+        'vid': port.vid,
+        'pid': port.pid,
+        'serial_number': port.serial_number,
+    }
+
+def load_cached_port(cache_file=CACHE_FILE):
+    """
+    @brief Load the identifiers of the last port found.
+
+    @return Dictionary created by #port_info, or None.
+    """
+    try:
+        with open(cache_file, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_cached_port(port, cache_file=CACHE_FILE):
+    """
+    @brief Save the identifiers of a port found, to try it first next time.
+
+    Args:
+        - port: port description returned by list_ports.comports().
+    """
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with open(cache_file, 'w') as f:
+            json.dump(port_info(port), f)
+    except OSError:
+        pass
+
+def cache_rank(port, cached):
+    """
+    @brief Rank a port by similarity with the cached one (lower is better).
+    """
+    if (cached is None):
+        return 3
+    if (port.vid is not None and port.vid == cached.get('vid') and port.pid == cached.get('pid')):
+        if (port.serial_number == cached.get('serial_number')):
+            return 0
+        return 1
+    if (port.device == cached.get('device')):
+        return 2
+    return 3
+
+def discover_ports(baudrate, timeout=PROBE_TIMEOUT, first_only=True, progress=None,
+                   cache_file=CACHE_FILE):
+    """
+    @brief Find the ports to which the device is connected.
+
+    The port matching the cached one (same USB VID/PID and serial
+    number, or same name) is probed first. The other ports are
+    then probed concurrently, each probe returning as soon as
+    the device answers.
+    Args:
+        - baudrate: baudrate for serial communication.
+        - timeout: maximum time to wait for each response (s).
+        - first_only: return as soon as one device is found.
+        - progress: function called as progress(port_name, found) after each probe.
+        - cache_file: file with the last port found.
+    @return List of port descriptions of the devices found.
+    """
+    cached = load_cached_port(cache_file)
+    ports = sorted(list_ports.comports(), key=lambda port: cache_rank(port, cached))
+    found = []
+    if (len(ports) > 0 and cache_rank(ports[0], cached) < 3):
+        if (probe_port(ports[0].device, baudrate, timeout)):
+            found.append(ports[0])
+        if (progress is not None):
+            progress(ports[0].device, len(found) > 0)
+        if (len(found) > 0 and first_only):
+            return found
+        ports = ports[1:]
+    if (len(ports) == 0):
+        return found
+
+    executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=min(len(ports), MAX_PARALLEL_PROBES))
+    try:
+        futures = {executor.submit(probe_port, port.device, baudrate, timeout): port
+                   for port in ports}
+        for future in concurrent.futures.as_completed(futures):
+            port = futures[future]
+            if (future.result()):
+                found.append(port)
+            if (progress is not None):
+                progress(port.device, future.result())
+            if (len(found) > 0 and first_only):
+                break
+    finally:
+        # Do not wait for the probes that are still running
+        executor.shutdown(wait=False, cancel_futures=True)
+    return found
+
+def query_sample_rate(port, timeout=PROBE_TIMEOUT):
+    """
+    @brief Get the sample rate of the device.
+
+    Requires protocol version 4.
+    @return Sample rate (Hz), 0 if the device did not answer.
+    """
+    response = send_command(port, GET_SAMPLE_RATE_CMD.encode('utf-8'), b'\r\n', timeout)
+    return parse_value(response, SAMPLE_RATE_RESPONSE)
+
+def request_sample_rate(port, sample_rate, timeout=PROBE_TIMEOUT):
+    """
+    @brief Ask the device to sample at sample_rate.
+
+    Requires protocol version 4. The device uses the closest
+    sample rate it can obtain, up to #MAX_SAMPLE_RATE.
+    @return Sample rate obtained (Hz), 0 if the device did not answer.
+    """
+    sample_rate = int(min(max(sample_rate, 1), MAX_SAMPLE_RATE))
+    response = send_command(port, SAMPLE_RATE_CMD.encode('utf-8') + struct.pack('>H', sample_rate),
+                            b'\r\n', timeout)
+    return parse_value(response, SAMPLE_RATE_RESPONSE)
+
+def request_baudrate(port, baudrate, timeout=PROBE_TIMEOUT):
+    """
+    @brief Ask the device to switch its UART to baudrate.
+
+    Requires protocol version 4. The device answers at the
+    current baud rate, and keeps it if baudrate cannot be
+    obtained accurately from its clock.
+    @return Baud rate used by the device from now on, 0 if it did not answer.
+    """
+    response = send_command(port, BAUDRATE_CMD.encode('utf-8') + struct.pack('>I', int(baudrate)),
+                            b'\r\n', timeout)
+    return parse_value(response, BAUDRATE_RESPONSE)
+
+def switch_baudrate(port, baudrate, timeout=PROBE_TIMEOUT):
+    """
+    @brief Switch the UART of device and host to a new baud rate.
+
+    Requires protocol version 4. The device answers at the
+    current baud rate and then switches; the host follows and
+    checks that the device still answers.
+    @return Tuple (accepted, answered): baud rate the port was
+    switched to, 0 if the device kept the current one or did
+    not answer, and True if the device answered at it.
+    """
+    accepted = request_baudrate(port, baudrate, timeout)
+    if (accepted == 0 or accepted == port.baudrate):
+        return 0, False
+    port.baudrate = accepted
+    return accepted, query_sample_rate(port, timeout) > 0
+
+def configure_device(port, batch_size=1, sample_rate=None, timeout=PROBE_TIMEOUT):
+    """
+    @brief Set up a device just connected.
+
+    The protocol version advertised by the device in the
+    response to #CONNECTION_CMD selects the packet decoder.
+    Devices supporting it are then asked to send batch_size
+    samples in each packet, and set to sample_rate or queried
+    for their sample rate.
+    Args:
+        - port: open transport.
+        - batch_size: samples requested in each data packet, protocol version 3.
+        - sample_rate: sample rate to set (Hz), protocol version 4. The current one if None.
+        - timeout: maximum time to wait for each response (s).
+    @return Dictionary with the protocol_version, batch_size,
+    decoder and sample_rate of the device (0 if it did not
+    answer), None if the device did not answer the handshake.
+    """
+    version = handshake(port, timeout)
+    if (version == 0):
+        return None
+    accepted = negotiate_batch_size(port, batch_size, timeout) if version >= 3 else 0
+    batch_size = accepted if accepted > 0 else 1
+    if (version < 4):
+        obtained = DEFAULT_SAMPLE_RATE
+    elif (sample_rate is not None):
+        obtained = request_sample_rate(port, sample_rate, timeout)
+    else:
+        obtained = query_sample_rate(port, timeout)
+    return {
+        'protocol_version': version,
+        'batch_size': batch_size,
+        'decoder': make_decoder(version, batch_size),
+        'sample_rate': obtained,
+    }
+
+class StreamReader(object):
+    """
+    @brief Reader of the samples streamed by a device.
+
+    Reads all the bytes waiting on the port in a single call,
+    without blocking, and decodes the packets found as ADC
+    codes; bytes of incomplete packets are carried over to
+    the next read by the decoder. The samples of a read are
+    timestamped evenly between the previous read and this one.
+    """
+
+    def __init__(self, port, decoder, monitor):
+        """
+        @brief Initialize the reader, not streaming.
+
+        Args:
+            - port: open transport to the device.
+            - decoder: packet decoder of the protocol version of the device.
+            - monitor: PipelineMonitor recording the reads.
+        """
+        self.port = port
+        self.decoder = decoder
+        self.monitor = monitor
+        self.last_read_time = 0     # host time of the last read from the port
+
+    def start(self):
+        """
+        @brief Ask the device to start streaming, dropping the bytes received so far.
+        """
+        self.port.reset_input_buffer()
+        self.port.write(START_STREAMING_CMD.encode('utf-8'))
+        self.decoder.reset()
+        self.monitor.reset()
+        self.last_read_time = time.time()
+
+    def stop(self):
+        """
+        @brief Ask the device to stop streaming.
+        """
+        self.port.write(STOP_STREAMING_CMD.encode('utf-8'))
+
+    def read(self):
+        """
+        @brief Read and decode the bytes waiting on the port.
+
+        @return Tuple (n_bytes, codes, timestamps) with the number
+        of bytes read, and the ADC codes and host times of the
+        samples decoded, None if there are none.
+        """
+        in_waiting = self.port.in_waiting
+        if (in_waiting == 0):
+            return 0, None, None
+        data = self.port.read(in_waiting)
+        self.monitor.record_read(len(data), in_waiting)
+        if (len(data) == 0):
+            return 0, None, None
+        read_time = time.time()
+        codes = self.decoder.decode_codes(data)
+        if (len(codes) == 0):
+            return len(data), None, None
+        timestamps = np.linspace(self.last_read_time, read_time, len(codes) + 1)[1:]
+        self.last_read_time = read_time
+        return len(data), codes, timestamps
@@ -0,0 +1,359 @@
+import time
+import numpy as np
+from ring_buffer import SampleRingBuffer
+
+"""
+@brief Number of processed samples retained in the buffer of a #ProcessingStage.
+"""
+BUFFER_SIZE = 2 ** 20
+
+"""
+@brief Data type of the processed samples retained in the buffer of a #ProcessingStage.
+
+Single precision is far finer than the ADC resolution, and
+halves the memory of the buffer.
+"""
+BUFFER_DTYPE = np.float32
+
+"""
+@brief Smallest gain reached inside a block by the vectorized IIR recursion.
+
+Blocks are split so that the scaling factors used to
+vectorize the recursion stay well within double precision.
+"""
+MIN_IIR_GAIN = 1e-150
+
+"""
+@brief Filter presets selectable from the GUI, see #make_filters.
+"""
+FILTER_PRESETS = ['None', 'Moving average', 'Low-pass', 'DC removal', 'Decimate']
+
+"""
+@brief Length of the moving average preset (s).
+"""
+MOVING_AVERAGE_SECONDS = 0.01
+
+"""
+@brief Cutoff frequency of the low-pass preset (Hz), capped at a tenth of the sample rate.
+"""
+LOW_PASS_CUTOFF = 20.0
+
+"""
+@brief Cutoff frequency of the DC removal preset (Hz).
+"""
+DC_CUTOFF = 0.1
+
+"""
+@brief Factor of the decimation preset.
+"""
+DECIMATION_FACTOR = 10
+
+class BlockFilter(object):
+    """
+    @brief Filter processing a stream one block of samples at a time.
+
+    Filters carry their state from one block to the next, so
+    the output does not depend on how the stream is split in
+    blocks. Each block is processed with a few NumPy
+    operations, whatever its length.
+    """
+
+    """
+    @brief Number of input samples for each output sample.
+    """
+    decimation = 1
+
+    def reset(self):
+        """
+        @brief Forget the samples seen so far.
+        """
+        pass
+
+    def process(self, samples, timestamps):
+        """
+        @brief Filter a block of samples.
+
+        Args:
+            - samples: NumPy array of samples.
+            - timestamps: NumPy array with the time of each sample.
+        @return Tuple (samples, timestamps) with the output block.
+        """
+        return samples, timestamps
+
+class MovingAverage(BlockFilter):
+    """
+    @brief Mean of the last #length samples.
+
+    Before the first #length samples, the missing ones are
+    taken equal to the first sample.
+    """
+
+    def __init__(self, length):
+        """
+        @brief Initialize the filter.
+
+        Args:
+            - length: number of samples averaged.
+        """
+        self.length = max(1, int(length))
+        self.reset()
+
+    def reset(self):
+        self.history = None     # last length - 1 input samples
+
+    def process(self, samples, timestamps):
+        if (len(samples) == 0):
+            return samples, timestamps
+        if (self.history is None):
+            self.history = np.full(self.length - 1, samples[0], dtype=np.float64)
+        extended = np.concatenate((self.history, samples))
+        sums = np.empty(len(extended) + 1)
+        sums[0] = 0.0
+        np.cumsum(extended, out=sums[1:])
+        output = (sums[self.length:] - sums[:-self.length]) / self.length
+        self.history = extended[len(extended) - self.length + 1:]
+        return output, timestamps
+
+class LowPass(BlockFilter):
+    """
+    @brief First order IIR low-pass filter.
+
+    Computes y[n] = y[n-1] + alpha * (x[n] - y[n-1]). The
+    recursion is vectorized by scaling the samples with the
+    powers of (1 - alpha) and accumulating them with a
+    cumulative sum, over sub-blocks short enough for the
+    scaling factors to stay above #MIN_IIR_GAIN.
+    """
+
+    def __init__(self, cutoff, sample_rate):
+        """
+        @brief Initialize the filter.
+
+        Args:
+            - cutoff: -3 dB frequency (Hz).
+            - sample_rate: sample rate of the input (Hz).
+        """
+        self.alpha = 1.0 - np.exp(-2 * np.pi * cutoff / float(sample_rate))
+        decay = max(1.0 - self.alpha, np.finfo(np.float64).tiny)
+        chunk = max(1, int(np.log(MIN_IIR_GAIN) / np.log(decay)))
+        self.powers = decay ** np.arange(1, min(chunk, 2 ** 16) + 1)  # decay^(k+1)
+        self.reset()
+
+    def reset(self):
+        self.state = None       # last output sample
+
+    def process(self, samples, timestamps):
+        if (len(samples) == 0):
+            return samples, timestamps
+        if (self.state is None):
+            self.state = float(samples[0])
+        output = np.empty(len(samples))
+        step = len(self.powers)
+        for start in range(0, len(samples), step):
+            block = samples[start:start + step]
+            powers = self.powers[:len(block)]
+            # y[k] = g^(k+1) * (y[-1] + alpha * sum_j x[j] / g^(j+1))
+            acc = np.cumsum(block / powers) * self.alpha
+            acc += self.state
+            out = output[start:start + len(block)]
+            np.multiply(acc, powers, out=out)
+            self.state = float(out[-1])
+        return output, timestamps
+
+class DCRemoval(BlockFilter):
+    """
+    @brief Removal of the DC component, as the input minus its low-pass.
+    """
+
+    def __init__(self, cutoff, sample_rate):
+        """
+        @brief Initialize the filter.
+
+        Args:
+            - cutoff: frequency below which the signal is removed (Hz).
+            - sample_rate: sample rate of the input (Hz).
+        """
+        self.low_pass = LowPass(cutoff, sample_rate)
+
+    def reset(self):
+        self.low_pass.reset()
+
+    def process(self, samples, timestamps):
+        trend, timestamps = self.low_pass.process(samples, timestamps)
+        return samples - trend, timestamps
+
+class Decimate(BlockFilter):
+    """
+    @brief Mean of each group of #decimation consecutive samples.
+
+    Averaging the group acts as anti-aliasing filter. Each
+    output sample gets the timestamp of the last sample of its
+    group; the samples of an incomplete group are kept for the
+    next block.
+    """
+
+    def __init__(self, factor):
+        """
+        @brief Initialize the filter.
+
+        Args:
+            - factor: number of input samples for each output sample.
+        """
+        self.decimation = max(1, int(factor))
+        self.reset()
+
+    def reset(self):
+        self.pending = np.zeros(0)              # samples of the incomplete group
+        self.pending_timestamps = np.zeros(0)   # their timestamps
+
+    def process(self, samples, timestamps):
+        samples = np.concatenate((self.pending, samples))
+        timestamps = np.concatenate((self.pending_timestamps, timestamps))
+        n_output = len(samples) // self.decimation
+        used = n_output * self.decimation
+        self.pending = samples[used:]
+        self.pending_timestamps = timestamps[used:]
+        output = samples[:used].reshape(n_output, self.decimation).mean(axis=1)
+        return output, timestamps[self.decimation - 1:used:self.decimation]
+
+def make_filters(preset, sample_rate):
+    """
+    @brief Create the filters of a preset.
+
+    Args:
+        - preset: one of #FILTER_PRESETS.
+        - sample_rate: sample rate of the input (Hz).
+    @return List of filters, empty for 'None'.
+    """
+    if (preset == 'Moving average'):
+        return [MovingAverage(MOVING_AVERAGE_SECONDS * sample_rate)]
+    if (preset == 'Low-pass'):
+        return [LowPass(min(LOW_PASS_CUTOFF, sample_rate / 10.0), sample_rate)]
+    if (preset == 'DC removal'):
+        return [DCRemoval(DC_CUTOFF, sample_rate)]
+    if (preset == 'Decimate'):
+        return [Decimate(DECIMATION_FACTOR)]
+    if (preset == 'None'):
+        return []
+    raise ValueError(f'Unknown filter preset: {preset}')
+
+class ProcessingStage(object):
+    """
+    @brief Chain of filters applied to the stream of a source.
+
+    The stage registers a batch callback on its source (a
+    KivySerial), so it runs on the thread dispatching the
+    samples, block by block, never on the GUI thread. Processed
+    samples are written to #buffer and passed to the batch
+    callbacks of the stage, with the same signature as those
+    of KivySerial: consumers subscribe either to the raw stream
+    of the source or to the processed stream of the stage.
+    The buffer is only allocated when the stage is first
+    attached, as most stages are created for tabs without filters.
+    """
+
+    def __init__(self, source, filters=None, capacity=BUFFER_SIZE):
+        """
+        @brief Initialize the stage, not attached to the source.
+
+        Args:
+            - source: object with add/remove_batch_callback, e.g. KivySerial.
+            - filters: list of #BlockFilter applied in order.
+            - capacity: number of processed samples retained in #buffer.
+        """
+        self.source = source
+        self.filters = list(filters or [])
+        self.capacity = capacity
+        self.buffer = None              # buffer with the processed samples, once attached
+        self.batch_callbacks = ()       # callbacks called for each processed block
+        self.samples_counter = 0        # processed samples produced
+        self.input_samples = 0          # raw samples processed
+        self.processing_time = 0.0      # time spent filtering (s)
+        self.is_attached = False
+
+    def attach(self):
+        """
+        @brief Start processing the samples of the source.
+        """
+        if (not self.is_attached):
+            if (self.buffer is None):
+                self.buffer = SampleRingBuffer(self.capacity, dtype=BUFFER_DTYPE)
+            self.is_attached = True
+            self.source.add_batch_callback(self.process_block)
+
+    def detach(self):
+        """
+        @brief Stop processing the samples of the source.
+        """
+        if (self.is_attached):
+            self.source.remove_batch_callback(self.process_block)
+            self.is_attached = False
+
+    def set_filters(self, filters):
+        """
+        @brief Replace the filters of the chain.
+
+        Safe while the source is streaming: the new chain, starting
+        from a clean state, is used from the next block on.
+        """
+        for block_filter in filters:
+            block_filter.reset()
+        self.filters = list(filters)
+
+    def decimation(self):
+        """
+        @brief Number of input samples for each output sample.
+        """
+        return int(np.prod([block_filter.decimation for block_filter in self.filters]))
+
+    def add_batch_callback(self, callback):
+        """
+        @brief Add a callback for the processed samples.
+
+        Called as callback(samples, start_index, timestamps) on
+        the thread dispatching the samples of the source. As in
+        KivySerial, the callbacks are a tuple replaced on each
+        change, so this is safe while the source is streaming.
+        """
+        if (callback not in self.batch_callbacks):
+            self.batch_callbacks = self.batch_callbacks + (callback,)
+
+    def remove_batch_callback(self, callback):
+        """
+        @brief Remove a callback added with #add_batch_callback.
+        """
+        if (callback in self.batch_callbacks):
+            self.batch_callbacks = tuple(c for c in self.batch_callbacks if c != callback)
+
+    def process_block(self, samples, start_index, timestamps):
+        """
+        @brief Batch callback of the source: filter a block and forward it.
+        """
+        start = time.perf_counter()
+        batch_callbacks = self.batch_callbacks
+        self.input_samples += len(samples)
+        for block_filter in self.filters:
+            samples, timestamps = block_filter.process(samples, timestamps)
+        self.processing_time += time.perf_counter() - start
+        if (len(samples) == 0):
+            return
+        start_index = self.samples_counter
+        self.samples_counter += len(samples)
+        self.buffer.write(samples, timestamps)
+        for callback in batch_callbacks:
+            callback(samples, start_index, timestamps)
+
+    def get_stats(self):
+        """
+        @brief Get the counters of the stage.
+
+        processing_time_per_sample is the mean time spent
+        filtering each input sample (s).
+        """
+        return {
+            'input_samples': self.input_samples,
+            'processed_samples': self.samples_counter,
+            'processing_time': self.processing_time,
+            'processing_time_per_sample': (self.processing_time / self.input_samples
+                                           if self.input_samples > 0 else 0.0),
+        }
@@ -0,0 +1,274 @@
+#!/usr/bin/python3
+
+import argparse
+import collections
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import zlib
+import numpy as np
+from recorder import RecordingReader, DATA_TAG
+
+"""
+@brief Output formats: plain CSV, gzip compressed CSV and Parquet.
+"""
+EXPORT_FORMATS = ['csv', 'csv.gz', 'parquet']
+
+"""
+@brief Approximate number of samples converted at a time.
+
+Bounds the memory used by each worker, whatever the size
+of the recording.
+"""
+CHUNK_SAMPLES = 250000
+
+"""
+@brief Header of the CSV files.
+"""
+CSV_HEADER = 'index,timestamp,voltage\n'
+
+"""
+@brief Format of each CSV row: sample index, host time (s) and voltage (V).
+"""
+CSV_ROW = '%d,%.6f,%.5f\n'
+
+"""
+@brief Compression level of gzip compressed CSV files.
+"""
+GZIP_LEVEL = 6
+
+def export_format(path):
+    """
+    @brief Get the export format from the extension of the output file.
+
+    Raises ValueError if the extension is not one of #EXPORT_FORMATS.
+    """
+    for fmt in sorted(EXPORT_FORMATS, key=len, reverse=True):
+        if (path.lower().endswith('.' + fmt)):
+            return fmt
+    raise ValueError(f'Unknown export format: {path}')
+
+def export_path(path, fmt):
+    """
+    @brief Get the default output file of a recording, next to it.
+    """
+    return os.path.splitext(path)[0] + '.' + fmt
+
+def chunk_ranges(reader, chunk_samples=CHUNK_SAMPLES):
+    """
+    @brief Group the data blocks of a recording in chunks.
+
+    @return List of (first, end, n_samples) tuples, where first and
+    end delimit consecutive entries of reader.blocks.
+    """
+    ranges = []
+    first = None
+    n_samples = 0
+    for i, (tag, offset, length, start_index) in enumerate(reader.blocks):
+        if (tag != DATA_TAG):
+            continue
+        if (first is None):
+            first = i
+        n_samples += length // reader.sample_size
+        if (n_samples >= chunk_samples):
+            ranges.append((first, i + 1, n_samples))
+            first = None
+            n_samples = 0
+    if (first is not None):
+        ranges.append((first, len(reader.blocks), n_samples))
+    return ranges
+
+def read_chunk(reader, first, end):
+    """
+    @brief Read the samples of the data blocks in reader.blocks[first:end].
+
+    The stored samples, e.g. ADC codes, are converted to
+    voltages for the whole chunk at once.
+    @return Tuple (indices, timestamps, samples) of NumPy arrays, samples in volts.
+    """
+    indices = []
+    timestamps = []
+    samples = []
+    for tag, offset, length, start_index in reader.blocks[first:end]:
+        if (tag != DATA_TAG):
+            continue
+        n_samples = length // reader.sample_size
+        indices.append(start_index + np.arange(n_samples, dtype=np.int64))
+        timestamps.append(np.frombuffer(reader.map, dtype='<f8', count=n_samples, offset=offset))
+        samples.append(np.frombuffer(reader.map, dtype=reader.sample_dtype, count=n_samples,
+                                     offset=offset + 8 * n_samples))
+    if (len(indices) == 0):
+        return np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0, dtype=np.float32)
+    return np.concatenate(indices), np.concatenate(timestamps), reader.values(np.concatenate(samples))
+
+"""
+@brief Recordings opened by the current worker process, by path.
+"""
+_readers = {}
+
+def csv_chunk(path, first, end, compress):
+    """
+    @brief Convert a chunk of a recording to CSV rows.
+
+    Run in the worker processes: each one maps the recording
+    once, and only the bytes of the chunk are sent back.
+    Args:
+        - path: recording file.
+        - first, end: range of reader.blocks to convert.
+        - compress: return a gzip member instead of plain text.
+    @return Bytes of the rows.
+    """
+    if (path not in _readers):
+        _readers[path] = RecordingReader(path)
+    indices, timestamps, samples = read_chunk(_readers[path], first, end)
+    rows = np.empty((len(indices), 3))
+    rows[:, 0] = indices
+    rows[:, 1] = timestamps
+    rows[:, 2] = samples
+    data = ((CSV_ROW * len(indices)) % tuple(rows.ravel().tolist())).encode('ascii')
+    if (compress):
+        return gzip_member(data)
+    return data
+
+def gzip_member(data):
+    """
+    @brief Compress data as a complete gzip member.
+
+    Concatenated gzip members form a valid gzip file, so the
+    chunks can be compressed independently and in parallel.
+    """
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+def export_csv(path, output, ranges, compress, workers, progress):
+    """
+    @brief Write a recording as CSV, converting the chunks in worker processes.
+
+    At most twice as many chunks as workers are in flight, and
+    they are written in order as soon as they are ready. The
+    workers are spawned rather than forked: exports run on a
+    background thread of the GUI, and a forked child would
+    inherit the locks and the SDL/GL state held by other threads.
+    """
+    total = sum(n_samples for first, end, n_samples in ranges)
+    done = 0
+    header = CSV_HEADER.encode('ascii')
+    with open(output, 'wb') as f, \
+            concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        f.write(gzip_member(header) if compress else header)
+        pending = collections.deque()
+        for first, end, n_samples in ranges:
+            pending.append((executor.submit(csv_chunk, path, first, end, compress), n_samples))
+            if (len(pending) >= 2 * workers):
+                done += write_chunk(f, *pending.popleft())
+                if (progress is not None):
+                    progress(done, total)
+        while (len(pending) > 0):
+            done += write_chunk(f, *pending.popleft())
+            if (progress is not None):
+                progress(done, total)
+
+def write_chunk(f, future, n_samples):
+    """
+    @brief Write the result of a chunk conversion.
+
+    @return Number of samples written.
+    """
+    f.write(future.result())
+    return n_samples
+
+def export_parquet(reader, output, ranges, progress):
+    """
+    @brief Write a recording as a Parquet file, one row group per chunk.
+
+    Requires pyarrow, which compresses the columns with zstd.
+    Raises ImportError if it is not installed.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError('Parquet export requires pyarrow (pip install pyarrow)')
+    schema = pa.schema([('index', pa.int64()), ('timestamp', pa.float64()),
+                        ('voltage', pa.float32())],
+                       metadata={b'psockivy': json.dumps(recording_info(reader)).encode('utf-8')})
+    total = sum(n_samples for first, end, n_samples in ranges)
+    done = 0
+    with pq.ParquetWriter(output, schema, compression='zstd') as writer:
+        for first, end, n_samples in ranges:
+            indices, timestamps, samples = read_chunk(reader, first, end)
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(indices), pa.array(timestamps), pa.array(samples.astype(np.float32))], schema=schema))
+            done += n_samples
+            if (progress is not None):
+                progress(done, total)
+
+def recording_info(reader):
+    """
+    @brief Get the metadata and the settings changes of a recording.
+    """
+    return {
+        'metadata': reader.metadata,
+        'settings': [{'index': index, 'settings': settings}
+                     for index, settings in reader.settings()],
+    }
+
+def export_recording(path, output=None, fmt=None, workers=None,
+                     chunk_samples=CHUNK_SAMPLES, progress=None):
+    """
+    @brief Export a recording to CSV or Parquet.
+
+    The recording is memory mapped and converted one chunk of
+    about chunk_samples samples at a time, so recordings of any
+    size can be exported. CSV chunks are formatted and
+    compressed in parallel by worker processes. The metadata
+    and the settings changes of the recording are written to
+    a JSON file next to CSV files, and in the schema metadata
+    of Parquet files.
+    Args:
+        - path: recording file.
+        - output: output file, the recording path with the format extension by default.
+        - fmt: one of #EXPORT_FORMATS, from the output extension by default, else csv.
+        - workers: number of worker processes, the number of CPUs by default.
+        - chunk_samples: approximate number of samples converted at a time.
+        - progress: function called as progress(samples_done, total_samples).
+    @return Path of the output file.
+    """
+    if (fmt is None):
+        fmt = export_format(output) if output is not None else 'csv'
+    if (fmt not in EXPORT_FORMATS):
+        raise ValueError(f'Unknown export format: {fmt}')
+    if (output is None):
+        output = export_path(path, fmt)
+    reader = RecordingReader(path)
+    try:
+        ranges = chunk_ranges(reader, chunk_samples)
+        if (fmt == 'parquet'):
+            export_parquet(reader, output, ranges, progress)
+        else:
+            with open(output + '.json', 'w') as f:
+                json.dump(recording_info(reader), f, indent=2)
+            export_csv(path, output, ranges, fmt == 'csv.gz', workers or os.cpu_count(), progress)
+    finally:
+        reader.close()
+    return output
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export a recording to CSV or Parquet.')
+    parser.add_argument('path', help='recording file')
+    parser.add_argument('-o', '--output', help='output file (default: recording name with the format extension)')
+    parser.add_argument('--format', choices=EXPORT_FORMATS,
+                        help='output format (default: from the output extension, else csv)')
+    parser.add_argument('--workers', type=int, help='worker processes (default: number of CPUs)')
+    parser.add_argument('--chunk-samples', type=int, default=CHUNK_SAMPLES,
+                        help='samples converted at a time by each worker')
+    args = parser.parse_args()
+
+    def show_progress(done, total):
+        print(f'\r{done}/{total} samples', end='', flush=True)
+
+    output = export_recording(args.path, args.output, args.format, args.workers,
+                              args.chunk_samples, show_progress)
+    print(f'\nExported to {output}')
@@ -3,10 +3,47 @@ from kivy.uix.textinput import TextInput
 from kivy.uix.tabbedpanel import TabbedPanel, TabbedPanelItem
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.label import Label
-from kivy.properties import BooleanProperty, ObjectProperty, NumericProperty
+from kivy.properties import BooleanProperty, ObjectProperty, NumericProperty, OptionProperty, StringProperty
 import re
-from kivy.garden.graph import MeshLinePlot, LinePlot
+import time
+import numpy as np
 from kivy.graphics import Color, Rectangle
+from kivy.clock import Clock
+from kivy.factory import Factory
+from ring_buffer import encode_samples
+from time_base import get_time_base
+from scheduler import RedrawScheduler
+from plot_window import PlotWindow
+
+# The graph of a tab is only needed once the tab is shown: loaded by the first GraphPanelContent
+Factory.register('Graph', module='kivy.garden.graph')
+
+"""
+@brief Candidate spacings of the major ticks on the time axis (s).
+"""
+TIME_TICKS = [0.25, 0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600, 900, 1800]
+
+"""
+@brief Range of power spectral density shown below the highest peak (dB).
+"""
+SPECTRUM_RANGE_DB = 100
+
+"""
+@brief Time between two updates of the statistics panel (s).
+"""
+STATS_REFRESH_INTERVAL = 0.25
+
+"""
+@brief Margin added above and below the signal by the y auto-scale, as a fraction of its range.
+"""
+AUTO_SCALE_MARGIN = 0.1
+
+def frequency_ticks(max_frequency):
+    """
+    @brief Spacing of at most 8 major ticks up to max_frequency, 1, 2 or 5 times a power of 10 (Hz).
+    """
+    magnitude = 10 ** np.floor(np.log10(max(max_frequency, 1e-3) / 8.0))
+    return float(next(magnitude * m for m in [1, 2, 5, 10] if max_frequency / (magnitude * m) <= 8))
 
 class GraphTabs(TabbedPanel):
     """
@@ -17,18 +54,91 @@ class GraphTabs(TabbedPanel):
     @brief Wav dac plot tabbed panel.
     """
     wave_dac_tab = ObjectProperty(None)
+
+    """
+    @brief Spectrum of the wav dac signal tabbed panel.
+    """
+    spectrum_tab = ObjectProperty(None)
     def __init__(self, **kwargs):
         super(GraphTabs, self).__init__(**kwargs)
 
+    def add_device(self, device):
+        """
+        @brief Show the samples of a device in its own tabs.
+
+        The first device uses the WaveDAC and Spectrum tabs, new
+        tabs are added for each other device. Devices already
+        shown are ignored.
+        @return List with the tabs of the device.
+        """
+        tabs = [tab for tab in self.tab_list if getattr(tab, 'device', None) is device]
+        if (len(tabs) > 0):
+            return tabs
+        if (self.wave_dac_tab.device is None):
+            tabs = [self.wave_dac_tab, self.spectrum_tab]
+        else:
+            tabs = [WaveDACPlot(), SpectrumPlot()]
+            for tab in tabs:
+                self.add_widget(tab)
+        for tab in tabs:
+            tab.set_device(device)
+        return tabs
+
+    def switch_to(self, header, do_scroll=False):
+        """
+        @brief Show a tab, building its content the first time it is shown.
+        """
+        if (isinstance(header, GraphPanelItem)):
+            header.build_content()
+        super(GraphTabs, self).switch_to(header, do_scroll=do_scroll)
+
     def update_plot(self, value):
         """
         @brief Function called to update the plots in the tabbed panel.
         """
         self.wave_dac_tab.update_plot(value)
 
+    def set_source(self, buffer):
+        """
+        @brief Set the sample buffer drained by the plots in the tabbed panel.
+        """
+        self.wave_dac_tab.set_source(buffer)
+
+    def get_frame_stats(self):
+        """
+        @brief Get the frame time statistics of the plot in the current tab.
+        """
+        tab = self.current_tab if isinstance(self.current_tab, GraphPanelItem) else self.wave_dac_tab
+        return tab.get_frame_stats()
+
+    def set_sample_rate(self, sample_rate):
+        """
+        @brief Set the sample rate of the data shown in the tabbed panel.
+        """
+        self.wave_dac_tab.set_sample_rate(sample_rate)
+
+class GraphPanelContent(BoxLayout):
+    """
+    @brief Content of a #GraphPanelItem: the graph and its settings.
+    """
+
+    """
+    @brief Graph widget.
+    """
+    graph = ObjectProperty(None)
+
+    """
+    @brief Plot settings widget.
+    """
+    plot_settings = ObjectProperty(None)
+
 class GraphPanelItem(TabbedPanelItem):
     """
     @brief Item for a tabbed panel in which a graph is shown.
+
+    The graph and its settings are built by #build_content
+    when the tab is first shown, so only the selected tab is
+    built at startup and hidden tabs cost nothing until used.
     """
 
     """
@@ -42,40 +152,86 @@ class GraphPanelItem(TabbedPanelItem):
     plot_settings = ObjectProperty(None)
 
     """
-    @brief Refresh rate: ~ 50 fps (100 Hz/2)
+    @brief Target refresh rate of the plot (fps).
+    """
+    target_fps = NumericProperty(50)
+
+    """
+    @brief Decimation applied before drawing: min/max per pixel column, LTTB or none.
     """
-    n_points_per_update = NumericProperty(2)
+    decimation = OptionProperty('minmax', options=['minmax', 'lttb', 'none'])
 
     def __init__(self, **kwargs):
-        super(GraphPanelItem, self).__init__(**kwargs)
+        # Set before building the content, which calls on_graph
         self.n_seconds = 20          # Initial number of samples to be shown
-        self.n_points_collected = [] # Number of new collected points
         self.sample_rate = 100       # Sample rate for data streaming
+        self.reader = None           # Reader of the sample buffer
+        self.device = None           # Device whose samples are shown
+        self.processing = None       # Filters applied to the samples of the device
+        self.filter_preset = 'None'  # Filters selected, see dsp.FILTER_PRESETS
+        self.device_sample_rate = 100  # Sample rate of the device
+        self.sample_dtype = np.dtype(np.float64)  # Data type of the samples of the source, e.g. ADC codes
+        self.sample_scale = 1.0      # Value of one unit of the samples of the source (V)
+        self.window = PlotWindow(get_time_base(self.sample_rate, self.n_seconds))  # Samples shown, also before the tab is built
+        self.stats_time = 0          # Time of the last update of the statistics panel
+        self.plot = None             # Plot showing the samples
+        self.scheduler = RedrawScheduler(self.redraw, self.target_fps)
+        super(GraphPanelItem, self).__init__(**kwargs)
+
+    def build_content(self):
+        """
+        @brief Create the graph and the plot settings, if not done yet.
+        """
+        if (self.graph is not None):
+            return
+        # Shown by GraphTabs.switch_to, add_widget would switch to the tab again
+        content = GraphPanelContent()
+        self.content = content
+        self.graph = content.graph
+        self.plot_settings = content.plot_settings
 
     def on_graph(self, instance, value):
         """
         @brief Callback called when graph widget is ready.
         """
-        self.graph.xmin = -self.n_seconds
         self.graph.xmax = 0
         self.graph.xlabel = 'Time (s)'
         self.graph.x_ticks_minor = 1
-        self.graph.x_ticks_major = 5
         self.graph.y_ticks_minor = 1
         self.graph.y_ticks_major = 1
         self.graph.x_grid_label = True
         self.graph.ymin = 0
         self.graph.ymax = 5
         self.graph.y_grid_label = True
-        # Compute number of points to show
-        self.n_points = self.n_seconds * self.sample_rate  # Number of points to plot
-        # Compute time between points on x-axis
-        self.time_between_points = (self.n_seconds)/float(self.n_points)
-        # Initialize x and y points list
-        self.x_points = [x for x in range(-self.n_points, 0)]
-        for j in range(self.n_points):
-            self.x_points[j] = -self.n_seconds + j * self.time_between_points
-        self.y_points = [0 for y in range(-self.n_points, 0)]
+        self.set_window(self.n_seconds)
+        self.scheduler.start()
+
+    def set_window(self, n_seconds):
+        """
+        @brief Set the number of seconds shown on the plot.
+
+        The times of the points drawn come from the shared time
+        base of the sample rate and window length. The window
+        stores the samples as the source does, e.g. as ADC
+        codes, and keeps the most recent ones when resized.
+        """
+        self.n_seconds = n_seconds
+        self.graph.xmin = -self.n_seconds
+        self.graph.x_ticks_major = next((t for t in TIME_TICKS if self.n_seconds / t <= 8),
+                                        TIME_TICKS[-1])
+        time_base = get_time_base(self.sample_rate, self.n_seconds)
+        self.window.set_time_base(time_base)
+        self.scheduler.request_redraw()
+
+    def set_sample_rate(self, sample_rate):
+        """
+        @brief Set the sample rate of the data, rebuilding the time base of the plot.
+        """
+        if (sample_rate <= 0 or sample_rate == self.sample_rate):
+            return
+        self.sample_rate = sample_rate
+        if (self.graph is not None):
+            self.set_window(self.n_seconds)
 
     def on_plot_settings(self, instance, value):
         """
@@ -83,21 +239,210 @@ class GraphPanelItem(TabbedPanelItem):
 
         Bint several properties together.
         """
-        self.plot_settings.bind(n_seconds=self.graph.setter('xmin'))
+        self.plot_settings.bind(n_seconds=self.seconds_changed)
+        self.plot_settings.bind(filter_preset=self.filter_changed)
+        self.plot_settings.bind(auto_scale=self.auto_scale_changed)
         self.plot_settings.bind(ymin=self.graph.setter('ymin'))
         self.plot_settings.bind(ymax=self.graph.setter('ymax'))
 
+    def seconds_changed(self, instance, value):
+        """
+        @brief Callback called when a new number of seconds is selected.
+        """
+        self.set_window(abs(value))
+
+    def filter_changed(self, instance, value):
+        """
+        @brief Callback called when new filters are selected.
+        """
+        self.set_filter(value)
+
+    def auto_scale_changed(self, instance, value):
+        """
+        @brief Callback called when the y auto-scale is enabled or disabled.
+        """
+        if (value):
+            self.update_stats()
+
+    def on_target_fps(self, instance, value):
+        """
+        @brief Callback called when the target refresh rate changes.
+        """
+        self.scheduler.set_target_fps(value)
+
+    def on_decimation(self, instance, value):
+        """
+        @brief Callback called when the decimation changes.
+        """
+        self.scheduler.request_redraw()
+
+    def set_device(self, device):
+        """
+        @brief Show the samples of a device.
+
+        The tab is named after the device and follows the
+        changes of its sample rate.
+        """
+        self.device = device
+        self.text = device.name
+        self.processing = None
+        self.device_sample_rate = device.sample_rate
+        self.set_filter(self.filter_preset)
+        device.bind(sample_rate=self.sample_rate_changed)
+
+    def set_filter(self, preset):
+        """
+        @brief Select the filters applied to the samples shown.
+
+        Filtering runs in the processing stage, on the thread
+        reading the device, and the plot reads the processed
+        samples. With no filters the stage is detached and the
+        plot reads the raw samples of the device. The stage, and
+        the filters, are only loaded once filters are selected.
+        Args:
+            - preset: one of dsp.FILTER_PRESETS.
+        """
+        self.filter_preset = preset
+        if (self.device is None):
+            return
+        if (self.processing is None):
+            if (preset == 'None'):
+                self.set_source(self.device.buffer)
+                self.set_sample_rate(self.device_sample_rate)
+                return
+            from dsp import ProcessingStage
+            self.processing = ProcessingStage(self.device)
+        from dsp import make_filters
+        filters = make_filters(preset, self.device_sample_rate)
+        self.processing.set_filters(filters)
+        if (len(filters) > 0):
+            self.processing.attach()
+            self.set_source(self.processing.buffer)
+        else:
+            self.processing.detach()
+            self.set_source(self.device.buffer)
+        self.set_sample_rate(self.device_sample_rate / self.processing.decimation())
+
+    def device_sample_rate_changed(self, sample_rate):
+        """
+        @brief Rebuild the filters and the time base for a new sample rate of the device.
+        """
+        if (sample_rate <= 0 or sample_rate == self.device_sample_rate):
+            return
+        self.device_sample_rate = sample_rate
+        self.set_filter(self.filter_preset)
+
+    def sample_rate_changed(self, instance, value):
+        """
+        @brief Callback for change in the sample rate of the device.
+
+        The sample rate may change on the I/O engine or replay
+        threads, the plot is updated on the main thread.
+        """
+        Clock.schedule_once(lambda dt: self.device_sample_rate_changed(value))
+
+    def set_source(self, buffer):
+        """
+        @brief Start reading new samples from a sample buffer.
+
+        The buffer is written by the serial reader thread, while
+        it is read here on the Kivy main thread at each frame.
+        Samples are kept in the format of the buffer, e.g. as ADC
+        codes, and only converted to voltages to be drawn. The
+        running statistics restart from the new source.
+        """
+        self.reader = buffer.reader()
+        self.sample_dtype = buffer.samples.dtype
+        self.sample_scale = buffer.scale
+        self.window.set_format(self.sample_dtype, self.sample_scale)
+
     def update_plot(self, value):
         """
-        @brief Update plot based on value and refresh rate.
+        @brief Add a value to the plot, shown at the next frame.
+        """
+        self.update_plot_batch([value])
+
+    def update_plot_batch(self, values):
+        """
+        @brief Add a block of voltages to the plot, shown at the next frame.
+        """
+        self.push_samples(encode_samples(values, self.sample_dtype, self.sample_scale))
+        self.scheduler.request_redraw()
+
+    def push_samples(self, values):
+        """
+        @brief Add a block of samples, in the format of the source, to the window and to the statistics.
+        """
+        self.window.push(values)
+
+    def redraw(self, force):
+        """
+        @brief Called by the redraw scheduler at each frame.
+
+        Reads the new samples from the buffer and redraws the
+        plot if any arrived or if a redraw was requested.
+        @return True if the plot was redrawn.
+        """
+        if (self.plot is None):
+            return False
+        if (self.reader is not None):
+            samples, timestamps = self.reader.read_raw()
+            if (len(samples) > 0):
+                self.push_samples(samples)
+                force = True
+        if (force):
+            now = time.monotonic()
+            if (now - self.stats_time >= STATS_REFRESH_INTERVAL):
+                self.stats_time = now
+                self.update_stats()
+            self.refresh_plot()
+        return force
+
+    def get_signal_stats(self):
+        """
+        @brief Get the statistics of the signal.
+
+        @return Tuple (window, total) with the statistics of the
+        samples in the plot window (see WindowedStats.get_stats)
+        and of all the samples since the source was set (see
+        RunningStats.get_stats).
+        """
+        return (self.window.window_stats.get_stats(self.sample_rate),
+                self.window.running_stats.get_stats())
+
+    def update_stats(self):
+        """
+        @brief Show the statistics of the signal, and auto-scale the y axis if enabled.
+        """
+        if (self.plot_settings is None):
+            return
+        window, total = self.get_signal_stats()
+        self.plot_settings.show_stats(window, total)
+        if (self.plot_settings.auto_scale and window is not None):
+            margin = max(window['peak_to_peak'] * AUTO_SCALE_MARGIN, 1e-3)
+            self.plot_settings.set_range(window['min'] - margin, window['max'] + margin)
+
+    def get_frame_stats(self):
         """
-        self.n_points_collected.append(value)
-        if (len(self.n_points_collected) == self.n_points_per_update):
-            for val in self.n_points_collected:
-                self.y_points.append(self.y_points.pop(0))
-                self.y_points[-1] = val
-            self.plot.points = zip(self.x_points, self.y_points)
-            self.n_points_collected = []
+        @brief Get the frame time statistics of the plot.
+
+        Also reports the samples overwritten in the buffer
+        before the plot could read them.
+        """
+        stats = self.scheduler.get_stats()
+        stats['samples_lost'] = self.reader.lost if self.reader is not None else 0
+        return stats
+
+    def refresh_plot(self):
+        """
+        @brief Send the points of the window to the plot.
+
+        The window is decimated to the width of the plot, see
+        PlotWindow.points.
+        """
+        size = self.plot.params['size']
+        n_columns = int(size[2] - size[0]) or int(self.graph.width)
+        self.plot.set_data(*self.window.points(n_columns, self.decimation))
 
 class WaveDACPlot(GraphPanelItem):
     """
@@ -105,11 +450,115 @@ class WaveDACPlot(GraphPanelItem):
     """
     def on_graph(self, instance, value):
         super(WaveDACPlot, self).on_graph(instance, value)
+        from line_plot import ArrayLinePlot
         self.graph.ylabel = 'Amplitude (V)'
-        self.plot = LinePlot(color=(0.75, 0.4, 0.4, 1.0))
+        self.plot = ArrayLinePlot(color=(0.75, 0.4, 0.4, 1.0))
         self.plot.line_width = 2
-        self.plot.points = zip(self.x_points, self.y_points)
         self.graph.add_plot(self.plot)
+        self.refresh_plot()
+
+class SpectrumPlot(GraphPanelItem):
+    """
+    @brief Tabbed panel item to show the power spectrum of wave dac data.
+
+    The spectrum is estimated with Welch's method by a
+    SpectrumWorker thread, from the same samples shown in the
+    time domain: raw, or processed by the selected filters.
+    The Seconds setting selects the duration of the stream
+    averaged, and the y axis follows the highest peak. The
+    worker is created and started when the tab is first shown.
+    """
+
+    def __init__(self, **kwargs):
+        # Set before building the content, which calls on_graph
+        self.worker = None           # spectrum estimator thread, once the tab is shown
+        self.source = None           # sample buffer of the spectrum
+        self.result_version = -1     # version of the estimate shown
+        super(SpectrumPlot, self).__init__(**kwargs)
+
+    def build_content(self):
+        """
+        @brief Create the spectrum worker, then the graph and the plot settings, if not done yet.
+        """
+        if (self.worker is None):
+            from spectrum import SpectrumWorker
+            self.worker = SpectrumWorker()
+            if (self.source is not None):
+                self.worker.set_source(self.source)
+        super(SpectrumPlot, self).build_content()
+
+    def on_graph(self, instance, value):
+        super(SpectrumPlot, self).on_graph(instance, value)
+        from line_plot import ArrayLinePlot
+        self.graph.xlabel = 'Frequency (Hz)'
+        self.graph.ylabel = 'PSD (dB V^2/Hz)'
+        self.graph.y_ticks_major = 20
+        self.graph.y_ticks_minor = 2
+        self.graph.ymin = -SPECTRUM_RANGE_DB
+        self.graph.ymax = 0
+        self.plot = ArrayLinePlot(color=(0.4, 0.6, 0.8, 1.0))
+        self.plot.line_width = 1.5
+        self.graph.add_plot(self.plot)
+        self.worker.start()
+
+    def on_plot_settings(self, instance, value):
+        """
+        @brief Bind the settings used by the spectrum; the y axis is automatic.
+        """
+        self.plot_settings.bind(n_seconds=self.seconds_changed)
+        self.plot_settings.bind(filter_preset=self.filter_changed)
+
+    def set_device(self, device):
+        super(SpectrumPlot, self).set_device(device)
+        self.text = f'{device.name} spectrum'
+
+    def set_window(self, n_seconds):
+        """
+        @brief Set the duration of the stream averaged, restarting the estimate.
+        """
+        self.n_seconds = n_seconds
+        self.graph.xmin = 0
+        self.graph.xmax = self.sample_rate / 2.0
+        self.graph.x_ticks_major = frequency_ticks(self.graph.xmax)
+        self.worker.configure(self.sample_rate, self.n_seconds)
+
+    def set_source(self, buffer):
+        """
+        @brief Start estimating the spectrum of the samples of a sample buffer.
+        """
+        self.source = buffer
+        if (self.worker is not None):
+            self.worker.set_source(buffer)
+
+    def update_plot_batch(self, values):
+        """
+        @brief Samples are read by the worker from the buffer only.
+        """
+        pass
+
+    def redraw(self, force):
+        """
+        @brief Show the last estimate of the worker, if new.
+        """
+        if (self.plot is None):
+            return False
+        version, result = self.worker.get_result()
+        if (version == self.result_version or result is None):
+            return False
+        self.result_version = version
+        frequencies, psd = result
+        ymax = 10 * float(np.ceil(psd.max() / 10.0))
+        if (ymax != self.graph.ymax):
+            self.graph.ymax = ymax
+            self.graph.ymin = ymax - SPECTRUM_RANGE_DB
+        self.plot.set_data(frequencies, psd)
+        return True
+
+    def get_frame_stats(self):
+        stats = self.scheduler.get_stats()
+        reader = self.worker.reader if self.worker is not None else None
+        stats['samples_lost'] = reader.lost if reader is not None else 0
+        return stats
 
 class PlotSettings(BoxLayout):
     """
@@ -131,6 +580,16 @@ class PlotSettings(BoxLayout):
     """
     ymax_input = ObjectProperty(None)
 
+    """
+    @brief Filter selection spinner.
+    """
+    filter_spinner = ObjectProperty(None)
+
+    """
+    @brief Label showing the statistics of the signal.
+    """
+    stats_label = ObjectProperty(None)
+
     """
     @brief Current number of seconds shown.
     """
@@ -146,6 +605,16 @@ class PlotSettings(BoxLayout):
     """
     ymax = NumericProperty(5)
 
+    """
+    @brief Filters applied to the samples shown, see dsp.FILTER_PRESETS.
+    """
+    filter_preset = StringProperty('None')
+
+    """
+    @brief Set the y axis range from the statistics of the signal.
+    """
+    auto_scale = BooleanProperty(False)
+
     def __init__(self, **kwargs):
         super(PlotSettings, self).__init__(**kwargs)
         self.n_seconds = 20
@@ -156,6 +625,21 @@ class PlotSettings(BoxLayout):
         """
         self.seconds_spinner.bind(text=self.spinner_updated)
 
+    def on_filter_spinner(self, instance, value):
+        """
+        @brief Bind change on filter spinner to filter_preset.
+        """
+        self.filter_spinner.bind(text=self.setter('filter_preset'))
+        self.filter_spinner.bind(is_open=self.filter_spinner_opened)
+
+    def filter_spinner_opened(self, instance, value):
+        """
+        @brief Fill the filter spinner the first time it is opened, loading the filters.
+        """
+        if (value and len(instance.values) == 0):
+            from dsp import FILTER_PRESETS
+            instance.values = FILTER_PRESETS
+
     def on_ymin_input(self, instance, value):
         """
         @brief Bind enter pressed on ymin text input to callback.
@@ -174,6 +658,37 @@ class PlotSettings(BoxLayout):
         """
         self.n_seconds = -int(self.seconds_spinner.text)
 
+    def show_stats(self, window, total):
+        """
+        @brief Show the statistics of the samples in the window and of all the samples.
+
+        Args:
+            - window: dictionary returned by WindowedStats.get_stats, or None.
+            - total: dictionary returned by RunningStats.get_stats, or None.
+        """
+        if (window is None or total is None):
+            self.stats_label.text = ''
+            return
+        lines = ['{:<5}{:>9}{:>9}'.format('', 'Window', 'Total')]
+        for key, name in [('min', 'Min'), ('max', 'Max'), ('mean', 'Mean'),
+                          ('rms', 'RMS'), ('peak_to_peak', 'P-P')]:
+            lines.append('{:<5}{:>9.3f}{:>9.3f}'.format(name, window[key], total[key]))
+        frequency = window['frequency']
+        lines.append('{:<5}{:>9}'.format('Freq', '-' if frequency is None else f'{frequency:.2f} Hz'))
+        self.stats_label.text = '\n'.join(lines)
+
+    def set_range(self, y_min, y_max):
+        """
+        @brief Set the y axis range, if it changed by more than 5% of its span.
+        """
+        span = max(self.ymax - self.ymin, 1e-9)
+        if (abs(y_min - self.ymin) < 0.05 * span and abs(y_max - self.ymax) < 0.05 * span):
+            return
+        self.ymin = y_min
+        self.ymax = y_max
+        self.ymin_input.text = f"{self.ymin:.2f}"
+        self.ymax_input.text = f"{self.ymax:.2f}"
+
     def axis_changed(self, instance, focused):
         """
         @brief Called when a new value of ymin or ymax is entered on the GUI.
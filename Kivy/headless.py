@@ -0,0 +1,235 @@
+#!/usr/bin/python3
+
+import argparse
+import os
+import sys
+import time
+import numpy as np
+from protocol import DEFAULT_BATCH_SIZE, DEFAULT_SAMPLE_RATE
+from decoder import codes_to_volts
+from discovery import (discover_ports, configure_device, switch_baudrate, save_cached_port,
+                       StreamReader)
+from transport import open_transport
+from instrumentation import PipelineMonitor
+from recorder import Recorder
+from export import CSV_HEADER, CSV_ROW
+
+"""
+@brief Time waited when no data are waiting on the port (s).
+"""
+READ_INTERVAL = 0.002
+
+class HeadlessAcquisition(object):
+    """
+    @brief Acquisition from the board without the Kivy GUI.
+
+    Uses the same discovery, device setup, stream reader and
+    recording format as KivySerial, but does not import Kivy,
+    so it runs on machines without a display and starts in
+    a fraction of the time. Samples are passed to sinks, which
+    have the signature of the batch callbacks of KivySerial:
+    sink(samples, start_index, timestamps), and their ADC codes
+    to the recorder.
+    """
+
+    def __init__(self, port_name=None, baudrate=115200, batch_size=DEFAULT_BATCH_SIZE,
+                 sample_rate=None, link_baudrate=None):
+        """
+        @brief Initialize the acquisition, not connected.
+
+        Args:
+            - port_name: port to connect to, discovered if None.
+            - baudrate: baudrate for discovery and handshake.
+            - batch_size: samples requested in each data packet.
+            - sample_rate: sample rate to set (Hz), the current one if None.
+            - link_baudrate: baud rate to switch to after connecting.
+        """
+        self.port_name = port_name
+        self.baudrate = baudrate
+        self.batch_size = batch_size
+        self.requested_sample_rate = sample_rate
+        self.link_baudrate = link_baudrate
+        self.port = None
+        self.protocol_version = 0
+        self.sample_rate = DEFAULT_SAMPLE_RATE
+        self.decoder = None
+        self.monitor = PipelineMonitor()
+        self.samples_counter = 0
+
+    def log(self, message):
+        """
+        @brief Print a message on stderr, leaving stdout to the samples.
+        """
+        print(message, file=sys.stderr)
+
+    def connect(self):
+        """
+        @brief Find the board if needed, connect and set it up.
+
+        @return True if the board answered.
+        """
+        if (self.port_name is None):
+            ports = discover_ports(self.baudrate)
+            if (len(ports) == 0):
+                self.log('Device not found')
+                return False
+            self.port_name = ports[0].device
+            save_cached_port(ports[0])
+        self.port = open_transport(self.port_name, self.baudrate, 0)
+        device = configure_device(self.port, self.batch_size, self.requested_sample_rate)
+        if (device is None):
+            self.log(f'Device not responding at {self.port_name}')
+            self.port.close()
+            return False
+        self.protocol_version = device['protocol_version']
+        self.decoder = device['decoder']
+        self.sample_rate = device['sample_rate'] or self.sample_rate
+        if (self.protocol_version >= 4 and self.link_baudrate is not None):
+            self.switch_baudrate(self.link_baudrate)
+        self.log(f'Device connected at {self.port_name}: protocol v{self.protocol_version}, '
+                 f'{self.sample_rate} Hz, {self.baudrate} baud')
+        return True
+
+    def switch_baudrate(self, baudrate):
+        """
+        @brief Switch the UART of device and host to a new baud rate, see discovery.switch_baudrate.
+        """
+        accepted, answered = switch_baudrate(self.port, baudrate)
+        if (accepted == 0):
+            self.log(f'Baud rate {baudrate} not available, using {self.baudrate}')
+            return
+        if (not answered):
+            self.log(f'Device not responding at {accepted} baud')
+            return
+        self.baudrate = accepted
+
+    def stream(self, sinks, duration=None, max_samples=None, recorder=None):
+        """
+        @brief Stream samples to the sinks until a limit is reached or Ctrl-C is pressed.
+
+        Samples are converted to voltages only if there are sinks.
+        Args:
+            - sinks: list of functions called with each block of samples.
+            - duration: maximum streaming time (s).
+            - max_samples: maximum number of samples.
+            - recorder: recorder.Recorder receiving the ADC codes, if any.
+        @return Number of samples streamed.
+        """
+        reader = StreamReader(self.port, self.decoder, self.monitor)
+        reader.start()
+        self.samples_counter = 0
+        end = time.monotonic() + duration if duration is not None else None
+        try:
+            while ((end is None or time.monotonic() < end) and
+                   (max_samples is None or self.samples_counter < max_samples)):
+                n_bytes, codes, timestamps = reader.read()
+                if (n_bytes == 0):
+                    time.sleep(READ_INTERVAL)
+                    continue
+                if (codes is None):
+                    continue
+                if (max_samples is not None):
+                    codes = codes[:max_samples - self.samples_counter]
+                    timestamps = timestamps[:len(codes)]
+                start = time.perf_counter()
+                if (recorder is not None):
+                    recorder.write(codes, self.samples_counter, timestamps)
+                if (len(sinks) > 0):
+                    samples = codes_to_volts(codes)
+                    for sink in sinks:
+                        sink(samples, self.samples_counter, timestamps)
+                self.monitor.record_dispatch(len(codes), time.perf_counter() - start)
+                self.samples_counter += len(codes)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            reader.stop()
+        return self.samples_counter
+
+    def get_stats(self):
+        """
+        @brief Get the pipeline statistics (see PipelineMonitor.get_totals).
+        """
+        return self.monitor.get_totals(self.decoder)
+
+    def close(self):
+        """
+        @brief Close the port.
+        """
+        if (self.port is not None):
+            self.port.close()
+
+class CsvSink(object):
+    """
+    @brief Sink writing the samples as CSV rows, e.g. on stdout.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.stream.write(CSV_HEADER)
+
+    def __call__(self, samples, start_index, timestamps):
+        rows = np.empty((len(samples), 3))
+        rows[:, 0] = np.arange(start_index, start_index + len(samples))
+        rows[:, 1] = timestamps
+        rows[:, 2] = samples
+        self.stream.write((CSV_ROW * len(samples)) % tuple(rows.ravel().tolist()))
+
+class RawSink(object):
+    """
+    @brief Sink writing the samples as little-endian float32 values, e.g. on stdout.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def __call__(self, samples, start_index, timestamps):
+        self.stream.write(samples.astype('<f4').tobytes())
+        self.stream.flush()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Acquire samples from the board without the GUI.')
+    parser.add_argument('-p', '--port', help='port to use (default: discovery), e.g. sim://?rate=1000')
+    parser.add_argument('-o', '--output', default='-',
+                        help='recording file (.pskv, see export.py), or - for stdout (default)')
+    parser.add_argument('--stdout-format', choices=['csv', 'raw'], default='csv',
+                        help='format on stdout: CSV rows or little-endian float32 samples')
+    parser.add_argument('--duration', type=float, help='streaming time (s), default until Ctrl-C')
+    parser.add_argument('--samples', type=int, help='number of samples to acquire')
+    parser.add_argument('--rate', type=int, help='sample rate to set (Hz), protocol v4')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help='samples in each data packet, protocol v3')
+    parser.add_argument('--baudrate', type=int, help='baud rate to switch to after connecting, protocol v4')
+    args = parser.parse_args()
+
+    acquisition = HeadlessAcquisition(args.port, batch_size=args.batch_size,
+                                      sample_rate=args.rate, link_baudrate=args.baudrate)
+    if (not acquisition.connect()):
+        sys.exit(1)
+    recorder = None
+    sinks = []
+    if (args.output == '-'):
+        if (args.stdout_format == 'raw'):
+            sinks = [RawSink(sys.stdout.buffer)]
+        else:
+            sinks = [CsvSink(sys.stdout)]
+    else:
+        recorder = Recorder(args.output, {'port': acquisition.port_name,
+                                          'baudrate': acquisition.baudrate,
+                                          'sample_rate': acquisition.sample_rate})
+        recorder.start()
+    try:
+        acquisition.stream(sinks, args.duration, args.samples, recorder)
+    except BrokenPipeError:
+        # Reader of stdout closed, e.g. head: silence the final flush
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    finally:
+        acquisition.close()
+        if (recorder is not None):
+            recorder.stop()
+    stats = acquisition.get_stats()
+    acquisition.log(f"{stats['samples']} samples, {stats['lost_samples']} lost, "
+                    f"{stats['invalid_packets']} invalid packets in {stats['time']:.1f} s")
+    if (recorder is not None):
+        acquisition.log(f'Recorded to {args.output} ({recorder.dropped_samples} samples dropped)')
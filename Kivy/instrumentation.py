@@ -0,0 +1,115 @@
+import time
+
+class PipelineMonitor(object):
+    """
+    @brief Counters of the acquisition pipeline.
+
+    The counters are updated by the reader thread and read
+    by any other thread: they are plain numbers written by a
+    single thread, so no lock is needed. #get_stats combines
+    them with the counters of the packet decoder and computes
+    the rates since the previous call.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """
+        @brief Reset all the counters.
+        """
+        self.start_time = time.monotonic()
+        self.reads = 0              # number of reads from the port
+        self.bytes_read = 0         # bytes read from the port
+        self.in_waiting = 0         # bytes waiting in the input buffer at the last read
+        self.max_in_waiting = 0     # maximum bytes waiting in the input buffer
+        self.samples = 0            # samples dispatched
+        self.dispatches = 0         # blocks of samples dispatched
+        self.callback_time = 0.0    # time spent dispatching samples (s)
+        self.previous = None        # totals at the previous call of #get_stats
+
+    def record_read(self, n_bytes, in_waiting):
+        """
+        @brief Account for a read from the port.
+
+        Args:
+            - n_bytes: bytes read.
+            - in_waiting: bytes waiting in the input buffer before the read.
+        """
+        self.reads += 1
+        self.bytes_read += n_bytes
+        self.in_waiting = in_waiting
+        self.max_in_waiting = max(self.max_in_waiting, in_waiting)
+
+    def record_dispatch(self, n_samples, duration):
+        """
+        @brief Account for a block of samples dispatched to the callbacks.
+
+        Args:
+            - n_samples: samples in the block.
+            - duration: time spent in the callbacks (s).
+        """
+        self.samples += n_samples
+        self.dispatches += 1
+        self.callback_time += duration
+
+    def get_totals(self, decoder=None):
+        """
+        @brief Get the counters accumulated since the last reset.
+
+        Args:
+            - decoder: FrameDecoder whose counters are included.
+        """
+        totals = {
+            'time': time.monotonic() - self.start_time,
+            'reads': self.reads,
+            'bytes_read': self.bytes_read,
+            'in_waiting': self.in_waiting,
+            'max_in_waiting': self.max_in_waiting,
+            'samples': self.samples,
+            'dispatches': self.dispatches,
+            'callback_time': self.callback_time,
+            'skipped_bytes': 0,
+            'invalid_packets': 0,
+            'lost_samples': 0,
+            'sequence_gaps': 0,
+        }
+        if (decoder is not None):
+            totals['skipped_bytes'] = decoder.skipped_bytes
+            totals['invalid_packets'] = decoder.invalid_packets
+            totals['lost_samples'] = decoder.lost_samples
+            totals['sequence_gaps'] = decoder.sequence_gaps
+        return totals
+
+    def get_stats(self, decoder=None):
+        """
+        @brief Get the totals and the rates since the previous call.
+
+        Rates are per second; callback_time_per_dispatch is the
+        mean duration of a dispatch, callback_load the fraction
+        of time spent in the callbacks.
+        """
+        totals = self.get_totals(decoder)
+        previous = self.previous
+        if (previous is None or previous['time'] > totals['time']):
+            previous = dict((key, 0) for key in totals)
+        self.previous = totals
+        stats = dict(totals)
+        elapsed = totals['time'] - previous['time']
+        if (elapsed <= 0):
+            elapsed = 1e-9
+
+        def rate(key):
+            return (totals[key] - previous[key]) / elapsed
+
+        stats['samples_per_second'] = rate('samples')
+        stats['bytes_per_second'] = rate('bytes_read')
+        stats['skipped_bytes_per_second'] = rate('skipped_bytes')
+        stats['invalid_packets_per_second'] = rate('invalid_packets')
+        stats['lost_samples_per_second'] = rate('lost_samples')
+        stats['callback_load'] = rate('callback_time')
+        dispatches = totals['dispatches'] - previous['dispatches']
+        stats['callback_time_per_dispatch'] = (
+            (totals['callback_time'] - previous['callback_time']) / dispatches
+            if dispatches > 0 else 0.0)
+        return stats
@@ -0,0 +1,183 @@
+import concurrent.futures
+import queue
+import threading
+
+"""
+@brief Maximum time the engine waits for commands while streaming and no data arrived (s).
+"""
+POLL_INTERVAL = 0.002
+
+class IOEngine(object):
+    """
+    @brief Single long-lived thread owning the ports of the devices.
+
+    The engine runs, on its own thread, both the readers of the
+    ports being streamed and the commands submitted by other
+    threads, one at a time, so a port is never used by two
+    threads at once. Readers are called in turn and read only
+    the bytes already waiting, so they never block: when none
+    of them found data, the engine waits for commands for at
+    most #POLL_INTERVAL. Adding or removing a reader is itself
+    a command, so once #remove_reader returns the reader is not
+    running and will not be called again.
+    """
+
+    def __init__(self, poll_interval=POLL_INTERVAL):
+        """
+        @brief Initialize the engine.
+
+        Args:
+            - poll_interval: maximum wait for commands while streaming (s).
+        """
+        self.poll_interval = poll_interval
+        self.commands = queue.Queue()   # commands waiting to be executed
+        self.readers = {}               # reader -> function called if it fails
+        self.thread = None
+        self.is_running = False
+        self.lock = threading.Lock()
+
+    def start(self):
+        """
+        @brief Start the engine thread, if not running.
+        """
+        with self.lock:
+            if (self.is_running):
+                return
+            self.is_running = True
+            self.thread = threading.Thread(target=self.run, name='IOEngine', daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """
+        @brief Stop the engine and wait for its thread to end.
+
+        Readers are removed and commands submitted after this
+        call fail with RuntimeError.
+        """
+        with self.lock:
+            if (not self.is_running):
+                return
+            self.is_running = False
+            thread = self.thread
+        self.commands.put(None)
+        if (thread is not threading.current_thread()):
+            thread.join()
+
+    def in_engine_thread(self):
+        """
+        @brief Check if the caller is running on the engine thread.
+        """
+        return self.thread is threading.current_thread()
+
+    def submit(self, function, *args, **kwargs):
+        """
+        @brief Run a function on the engine thread.
+
+        @return concurrent.futures.Future with the result of the function.
+        """
+        future = concurrent.futures.Future()
+        if (not self.is_running):
+            future.set_exception(RuntimeError('I/O engine is not running'))
+            return future
+        self.commands.put((future, function, args, kwargs))
+        return future
+
+    def call(self, function, *args, **kwargs):
+        """
+        @brief Run a function on the engine thread and wait for its result.
+
+        Called from the engine thread, e.g. by a reader or a
+        command, the function is run immediately.
+        @return Result of the function, whose exceptions are raised here.
+        """
+        if (self.in_engine_thread()):
+            return function(*args, **kwargs)
+        return self.submit(function, *args, **kwargs).result()
+
+    def add_reader(self, reader, on_error=None):
+        """
+        @brief Start calling a reader at each cycle of the engine.
+
+        Args:
+            - reader: function reading the bytes waiting on a port,
+              returning the number of bytes read.
+            - on_error: function called as on_error(exception) on the
+              engine thread if the reader raises, after removing it.
+        """
+        self.call(self.readers.__setitem__, reader, on_error)
+
+    def remove_reader(self, reader):
+        """
+        @brief Stop calling a reader.
+        """
+        self.call(self.readers.pop, reader, None)
+
+    def run(self):
+        """
+        @brief Loop of the engine thread.
+        """
+        while (self.is_running):
+            busy = False
+            for reader, on_error in list(self.readers.items()):
+                try:
+                    if (reader() > 0):
+                        busy = True
+                except Exception as e:
+                    self.readers.pop(reader, None)
+                    if (on_error is not None):
+                        on_error(e)
+            if (busy):
+                self.run_commands(block=False)
+            else:
+                self.run_commands(block=True)
+        self.readers.clear()
+        # Fail the commands that will not be executed
+        while (True):
+            try:
+                command = self.commands.get_nowait()
+            except queue.Empty:
+                break
+            if (command is not None):
+                command[0].set_exception(RuntimeError('I/O engine stopped'))
+
+    def run_commands(self, block):
+        """
+        @brief Execute the commands waiting.
+
+        Args:
+            - block: wait for a command, for at most #poll_interval
+              if there are readers.
+        """
+        timeout = self.poll_interval if len(self.readers) > 0 else None
+        while (self.is_running):
+            try:
+                command = self.commands.get(block=block, timeout=timeout if block else None)
+            except queue.Empty:
+                return
+            block = False
+            if (command is None):
+                return
+            future, function, args, kwargs = command
+            if (not future.set_running_or_notify_cancel()):
+                continue
+            try:
+                future.set_result(function(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+
+"""
+@brief Engine shared by all the devices.
+"""
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_engine():
+    """
+    @brief Get the engine shared by all the devices, started on first use.
+    """
+    global _engine
+    with _engine_lock:
+        if (_engine is None or not _engine.is_running):
+            _engine = IOEngine()
+            _engine.start()
+        return _engine
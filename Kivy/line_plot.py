@@ -0,0 +1,140 @@
+import numpy as np
+from kivy.garden.graph import Plot
+from kivy.graphics import Color, Mesh, RenderContext
+from kivy.properties import NumericProperty
+
+"""
+@brief Maximum number of line segments drawn by each Mesh of an #ArrayLinePlot.
+
+Each segment is drawn as 2 triangles, i.e. 6 indices, and a
+Mesh takes at most 65535 indices.
+"""
+MESH_SEGMENTS = 10922
+
+class ArrayLinePlot(Plot):
+    """
+    @brief Line plot fed with NumPy arrays.
+
+    LinePlot converts its points to pixel coordinates one at
+    a time in Python, and its Line instruction copies them to
+    a list. Here the x and y arrays are scaled with NumPy, and
+    each segment of the line is written as a quad into a
+    preallocated float32 vertex array. The Mesh instructions
+    drawing the quads read this array in place, through the
+    buffer interface, so the points are never converted to
+    Python floats.
+    """
+
+    """
+    @brief Width of the line (pixels), as for LinePlot.
+    """
+    line_width = NumericProperty(1)
+
+    def __init__(self, **kwargs):
+        self.x_data = np.zeros(0)   # x values of the points
+        self.y_data = np.zeros(0)   # y values of the points
+        self.pixels = np.zeros((0, 2))  # pixel coordinates of the points
+        self.vertices = np.zeros((0, 4, 4), dtype=np.float32)  # x, y, u, v of the corners of each segment
+        self.indices = (np.arange(MESH_SEGMENTS, dtype=np.uint16)[:, None] * 4
+                        + np.array([0, 1, 2, 0, 2, 3], dtype=np.uint16)).ravel()  # triangles of the quads
+        self.meshes = []            # Mesh instructions, each drawing up to MESH_SEGMENTS segments
+        super(ArrayLinePlot, self).__init__(**kwargs)
+
+    def create_drawings(self):
+        """
+        @brief Create the instructions of the plot, the meshes being added by #draw.
+        """
+        self._grc = RenderContext(use_parent_modelview=True, use_parent_projection=True)
+        with self._grc:
+            self._gcolor = Color(*self.color)
+        self.meshes = []
+        return [self._grc]
+
+    def on_color(self, instance, value):
+        """
+        @brief Callback called when the color of the plot changes.
+        """
+        if (hasattr(self, '_gcolor')):
+            self._gcolor.rgba = value
+
+    def on_line_width(self, instance, value):
+        """
+        @brief Callback called when the width of the line changes.
+        """
+        self.draw()
+
+    def set_data(self, x_data, y_data):
+        """
+        @brief Set the points to be drawn and redraw.
+
+        The plot is redrawn immediately, as callers are expected
+        to be paced by a #RedrawScheduler.
+
+        Args:
+            - x_data: array of x values.
+            - y_data: array of y values, same length as x_data.
+        """
+        self.x_data = x_data
+        self.y_data = y_data
+        self.draw()
+
+    def draw(self, *args):
+        """
+        @brief Draw the points according to the graph params.
+        """
+        Plot.draw(self, *args)
+        params = self.params
+        size = params['size']
+        funcx = np.log10 if params['xlog'] else np.asarray
+        funcy = np.log10 if params['ylog'] else np.asarray
+        xmin = funcx(params['xmin'])
+        ymin = funcy(params['ymin'])
+        ratiox = (size[2] - size[0]) / float(funcx(params['xmax']) - xmin)
+        ratioy = (size[3] - size[1]) / float(funcy(params['ymax']) - ymin)
+        n_points = min(len(self.x_data), len(self.y_data))
+        if (len(self.pixels) != n_points):
+            self.pixels = np.empty((n_points, 2))
+            self.vertices = np.zeros((max(0, n_points - 1), 4, 4), dtype=np.float32)
+        x_px = self.pixels[:, 0]
+        y_px = self.pixels[:, 1]
+        np.subtract(funcx(self.x_data[:n_points]), xmin, out=x_px)
+        x_px *= ratiox
+        x_px += size[0]
+        np.subtract(funcy(self.y_data[:n_points]), ymin, out=y_px)
+        y_px *= ratioy
+        y_px += size[1]
+        if (n_points > 1):
+            # Same half width as Line, segments extended by it to cover the joints
+            half_width = self.line_width if self.line_width > 1 else 0.5
+            directions = np.diff(self.pixels, axis=0)
+            lengths = np.hypot(directions[:, 0], directions[:, 1])
+            lengths[lengths == 0] = np.inf
+            directions *= (half_width / lengths)[:, None]
+            normals = directions[:, ::-1] * (-1, 1)
+            vertices = self.vertices
+            vertices[:, 0, :2] = self.pixels[:-1] - directions + normals
+            vertices[:, 1, :2] = self.pixels[:-1] - directions - normals
+            vertices[:, 2, :2] = self.pixels[1:] + directions - normals
+            vertices[:, 3, :2] = self.pixels[1:] + directions + normals
+        self.update_meshes()
+
+    def update_meshes(self):
+        """
+        @brief Hand the vertex array to the Mesh instructions, adding or removing meshes as needed.
+        """
+        if (not hasattr(self, '_grc')):
+            return
+        n_segments = len(self.vertices)
+        n_meshes = -(-n_segments // MESH_SEGMENTS)
+        while (len(self.meshes) < n_meshes):
+            mesh = Mesh(mode='triangles')
+            self._grc.add(mesh)
+            self.meshes.append(mesh)
+        while (len(self.meshes) > n_meshes):
+            self._grc.remove(self.meshes.pop())
+        vertices = self.vertices.reshape(-1)
+        for i, mesh in enumerate(self.meshes):
+            start = i * MESH_SEGMENTS
+            end = min(start + MESH_SEGMENTS, n_segments)
+            mesh.vertices = vertices[16 * start:16 * end]
+            mesh.indices = self.indices[:6 * (end - start)]
@@ -1,18 +1,43 @@
 #!/usr/bin/python3
 
+import time
+
+"""
+@brief Time at which the application started loading (s, see time.perf_counter).
+
+Taken before importing Kivy, to measure the time to first frame.
+"""
+LAUNCH_TIME = time.perf_counter()
+
 from kivy.app import App
 from kivy.uix.boxlayout import BoxLayout
 from kivy.lang import Builder
+from kivy.logger import Logger
 from kivy.properties import ObjectProperty
-from communication import KivySerial
+from kivy.clock import Clock
+from communication import STATS_INTERVAL
+from devices import DeviceManager
 from random import randint
+import os
 
-# Load all required kv files
+# Load the kv files needed by the first frame, dialogs.kv is loaded by the toolbar when needed
 Builder.load_file('toolbar.kv')
 Builder.load_file('bottom_bar.kv')
-Builder.load_file('dialogs.kv')
 Builder.load_file('graph_tabs.kv')
 
+"""
+@brief Environment variable with the ports to use instead of discovery.
+
+Set it to e.g. sim://?rate=1000 to use the simulated device.
+Several ports are separated by commas, one device each.
+"""
+PORT_ENV_VAR = 'PSOCKIVY_PORT'
+
+"""
+@brief Environment variable with the baud rate to switch to after connecting.
+"""
+BAUDRATE_ENV_VAR = 'PSOCKIVY_BAUDRATE'
+
 class ContainerLayout(BoxLayout):
     """
     @brief Root widget of the PSoC-Kivy app.
@@ -36,9 +61,27 @@ class ContainerLayout(BoxLayout):
     def __init__(self, **kwargs):
         """
         @brief Initialize class.
+
+        The devices are created, but connected only after the
+        first frame (see #first_frame).
         """
-        self.serial = KivySerial()
+        link_baudrate = os.environ.get(BAUDRATE_ENV_VAR)
+        port_names = os.environ.get(PORT_ENV_VAR)
+        self.devices = DeviceManager(port_names=port_names.split(',') if port_names else None,
+                                     link_baudrate=int(link_baudrate) if link_baudrate else None,
+                                     auto_connect=False)
         super(ContainerLayout, self).__init__(**kwargs)
+        Clock.schedule_interval(self.update_stats, STATS_INTERVAL)
+
+    def first_frame(self, startup_time):
+        """
+        @brief Called once the first frame is shown: start connecting to the boards.
+
+        Args:
+            - startup_time: time from launch to the first frame (s).
+        """
+        self.devices.message_string = 'Started in {:.2f} s'.format(startup_time)
+        self.devices.start_discovery()
 
     def on_toolbar(self, instance, value):
         """
@@ -57,17 +100,46 @@ class ContainerLayout(BoxLayout):
         """
         try:
             self.toolbar.bind(message_string=self.bottom_bar.update_text)
-            self.serial.bind(message_string=self.bottom_bar.update_text)
-            self.serial.bind(connected=self.bottom_bar.connection_event)
-            self.serial.bind(connected=self.connection_event)
+            self.devices.bind(message_string=self.bottom_bar.update_text)
+            self.devices.bind(connected=self.bottom_bar.connection_event)
+            self.devices.bind(connected=self.connection_event)
         except:
             raise
 
     def on_graph_w(self, instance, value):
         """
         @brief Callback for graph widget.
+
+        Each device gets its own tab, including the devices
+        found later by discovery.
+        """
+        self.devices.bind(on_device_added=self.device_added)
+        for device in self.devices.devices:
+            self.graph_w.add_device(device)
+        self.graph_w.bind(current_tab=self.tab_changed)
+
+    def device_added(self, instance, device):
+        """
+        @brief Callback for a new device.
+
+        Devices are added on the discovery thread, the tab
+        is added on the main thread.
         """
-        self.serial.add_callback(self.graph_w.update_plot)
+        Clock.schedule_once(lambda dt: self.graph_w.add_device(device))
+
+    def tab_changed(self, instance, value):
+        """
+        @brief Make the device of the selected tab the active one.
+        """
+        if (getattr(value, 'device', None) is not None):
+            self.devices.active = value.device
+
+    def update_stats(self, dt):
+        """
+        @brief Show the pipeline statistics of the active device in the bottom bar.
+        """
+        if (self.bottom_bar is not None and self.graph_w is not None):
+            self.bottom_bar.update_stats(self.devices.active.get_stats(), self.graph_w.get_frame_stats())
 
     def connection_event(self, instance, value):
         """
@@ -75,7 +147,7 @@ class ContainerLayout(BoxLayout):
 
         Enable/Disable widget based on connection status.
         """
-        if (self.serial.is_connected()):
+        if (len(self.devices.connected_devices()) > 0):
             self.start_streaming_button.disabled = False
             self.stop_streaming_button.disabled = False
         else:
@@ -84,18 +156,44 @@ class ContainerLayout(BoxLayout):
 
     def start_streaming(self):
         """
-        @brief Start streaming from the serial port.
+        @brief Start streaming from all the devices connected.
         """
-        self.serial.start_streaming()
+        self.devices.start_streaming()
 
     def stop_streaming(self):
         """
-        @brief Stop streaming from the serial port.
+        @brief Stop streaming from all the devices.
         """
-        self.serial.stop_streaming()
+        self.devices.stop_streaming()
 
 class PSoCKivy(App):
+    """
+    @brief PSoC-Kivy app.
+
+    The time from launch to the first frame is logged and
+    kept in #startup_time.
+    """
+
     def build(self):
+        self.startup_time = None    # time from launch to the first frame (s)
         return ContainerLayout()
 
-PSoCKivy().run()
+    def on_start(self):
+        """
+        @brief Wait for the first frame to be shown.
+        """
+        from kivy.core.window import Window
+        Window.bind(on_flip=self.first_frame)
+
+    def first_frame(self, window):
+        """
+        @brief Callback called after each frame, until the first one.
+        """
+        window.unbind(on_flip=self.first_frame)
+        self.startup_time = time.perf_counter() - LAUNCH_TIME
+        Logger.info('PSoCKivy: First frame shown after {:.3f} s'.format(self.startup_time))
+        # Let the frame reach the screen before starting the discovery threads
+        Clock.schedule_once(lambda dt: self.root.first_frame(self.startup_time))
+
+if __name__ == '__main__':
+    PSoCKivy().run()
@@ -0,0 +1,119 @@
+import numpy as np
+from ring_buffer import RollingWindow
+from decimation import RollingMinMax, lttb_decimate
+from running_stats import RunningStats, WindowedStats
+
+class PlotWindow(object):
+    """
+    @brief Samples of a plot window and the points drawn from them.
+
+    Keeps the most recent samples of a source, in its format,
+    e.g. as ADC codes, with their statistics, and computes the
+    points to draw at each frame. It does not depend on Kivy,
+    so the plots of the GUI and the benchmarks run the same
+    code.
+    """
+
+    def __init__(self, time_base, dtype=np.float64, scale=1.0):
+        """
+        @brief Create an empty window.
+
+        Args:
+            - time_base: time base of the window, see time_base.get_time_base.
+            - dtype: data type of the samples of the source.
+            - scale: value of one unit of the samples of the source (V).
+        """
+        self.time_base = time_base          # Shared time base of the window
+        self.dtype = np.dtype(dtype)        # Data type of the samples
+        self.scale = scale                  # Value of one unit of the samples (V)
+        self.window_stats = WindowedStats(RollingWindow(time_base.n_points, dtype=self.dtype), scale)
+        self.running_stats = RunningStats(scale)  # Statistics of all the samples pushed
+        self.y_ordered = None               # Samples of the window in chronological order
+        self.columns = None                 # Min/max of each pixel column of the window, when decimating
+
+    @property
+    def y_points(self):
+        """
+        @brief Rolling window of the samples.
+        """
+        return self.window_stats.window
+
+    def set_time_base(self, time_base):
+        """
+        @brief Change the time base, keeping the most recent samples that fit the new window.
+        """
+        self.time_base = time_base
+        self.update_window()
+
+    def set_format(self, dtype, scale):
+        """
+        @brief Change the format of the samples, e.g. for a new source.
+
+        The running statistics restart, the samples of the
+        window are converted to the new format.
+        """
+        self.dtype = np.dtype(dtype)
+        self.scale = scale
+        self.running_stats = RunningStats(scale)
+        self.update_window()
+
+    def update_window(self):
+        """
+        @brief Resize the rolling window to the time base and to the format of the samples.
+
+        The most recent samples are kept, in O(new size); the
+        min/max columns are rebuilt from them at the next call
+        to #points.
+        """
+        if (self.window_stats.size != self.time_base.n_points or self.y_points.data.dtype != self.dtype
+                or self.window_stats.scale != self.scale):
+            self.window_stats = self.window_stats.resized(self.time_base.n_points, self.dtype, self.scale)
+        self.y_ordered = None
+        self.columns = None
+
+    def push(self, values):
+        """
+        @brief Add a block of samples, in the format of the source, to the window and to the statistics.
+
+        The samples, e.g. ADC codes, are pushed as they are:
+        the statistics only widen them where needed.
+        """
+        self.window_stats.push(values)
+        self.running_stats.push(values)
+        if (self.columns is not None):
+            self.columns.push(values)
+
+    def points(self, n_columns, decimation='minmax'):
+        """
+        @brief Get the points of the window to draw.
+
+        Long windows are decimated down to about two points
+        per pixel column, so the number of vertices sent to the
+        GPU does not depend on the window length. With min/max
+        decimation the columns are updated as samples are
+        pushed, so a call costs O(columns) whatever the window
+        length; LTTB and no decimation read the whole window.
+        Only the points drawn are converted to voltages.
+        Args:
+            - n_columns: number of pixel columns of the plot.
+            - decimation: 'minmax', 'lttb' or 'none'.
+        @return Tuple (x, y) with the times (s) and voltages of the points.
+        """
+        n_points = self.time_base.n_points
+        if (decimation == 'minmax' and 0 < n_columns and 2 * n_columns < n_points):
+            if (self.columns is None or self.columns.n_columns != n_columns):
+                # Rebuilt when the window or the plot width change, then updated by push
+                self.columns = RollingMinMax(self.y_points.ordered(), n_columns)
+            positions, y_points = self.columns.points()
+            x_points = self.time_base.times(positions)
+        else:
+            self.columns = None
+            if (self.y_ordered is None):
+                self.y_ordered = np.empty(n_points, dtype=self.dtype)
+            y_points = self.y_points.ordered(out=self.y_ordered)
+            x_points = self.time_base.x_points()
+            if (decimation == 'lttb'):
+                x_points, y_points = lttb_decimate(x_points, y_points, 2 * n_columns)
+        if (self.scale != 1.0):
+            y_points = y_points * self.scale
+        return x_points, y_points
@@ -0,0 +1,155 @@
+import re
+
+"""
+@brief Connection command.
+"""
+CONNECTION_CMD = 'v'
+
+"""
+@brief Start streaming command.
+"""
+START_STREAMING_CMD = 'b'
+
+"""
+@brief Stop streaming command.
+"""
+STOP_STREAMING_CMD = 's'
+
+"""
+@brief Select wave as sine.
+"""
+WAVE_SINE_CMD = 'e'
+
+"""
+@brief Select wave as triangle.
+"""
+WAVE_TRIANGLE_CMD = 'f'
+
+"""
+@brief Select range as small.
+"""
+RANGE_SMALL_CMD = 't'
+
+"""
+@brief Select range as large.
+"""
+RANGE_LARGE_CMD = 'y'
+
+"""
+@brief Set the number of samples in each data packet.
+
+Followed by one byte with the number of samples, answered
+with #BATCH_SIZE_RESPONSE and the number accepted.
+Available from protocol version 3.
+"""
+BATCH_SIZE_CMD = 'n'
+
+"""
+@brief Query the sample rate.
+
+Answered with #SAMPLE_RATE_RESPONSE and the sample rate in Hz.
+Available from protocol version 4.
+"""
+GET_SAMPLE_RATE_CMD = 'q'
+
+"""
+@brief Set the sample rate.
+
+Followed by two bytes with the sample rate in Hz, most
+significant first, answered as #GET_SAMPLE_RATE_CMD with
+the sample rate obtained. Available from protocol version 4.
+"""
+SAMPLE_RATE_CMD = 'r'
+
+"""
+@brief Set the baud rate of the UART.
+
+Followed by four bytes with the baud rate, most significant
+first, answered with #BAUDRATE_RESPONSE and the baud rate
+used from then on, at the previous baud rate.
+Available from protocol version 4.
+"""
+BAUDRATE_CMD = 'u'
+
+"""
+@brief String contained in the response to #CONNECTION_CMD.
+"""
+CONNECTION_RESPONSE = '$$$'
+
+"""
+@brief String preceding the batch size in the response to #BATCH_SIZE_CMD.
+"""
+BATCH_SIZE_RESPONSE = 'Batch size '
+
+"""
+@brief String preceding the sample rate in the response to #GET_SAMPLE_RATE_CMD.
+"""
+SAMPLE_RATE_RESPONSE = 'Sample rate '
+
+"""
+@brief String preceding the baud rate in the response to #BAUDRATE_CMD.
+"""
+BAUDRATE_RESPONSE = 'Baud rate '
+
+"""
+@brief Maximum sample rate, limited by the conversion rate of the ADC (Hz).
+"""
+MAX_SAMPLE_RATE = 10000
+
+"""
+@brief Number of samples requested in each data packet.
+
+Batching amortizes the framing bytes and the per-packet work
+of the host, at the cost of a latency of #DEFAULT_BATCH_SIZE
+sample periods.
+"""
+DEFAULT_BATCH_SIZE = 10
+
+"""
+@brief Sample rate of devices that cannot be queried for it (Hz).
+"""
+DEFAULT_SAMPLE_RATE = 100
+
+
+"""
+@brief Most recent protocol version supported by the host.
+"""
+PROTOCOL_VERSION = 4
+
+def parse_protocol_version(response):
+    """
+    @brief Get the protocol version from the response to #CONNECTION_CMD.
+
+    Firmware supporting several protocol versions advertises
+    the one it uses before #CONNECTION_RESPONSE, e.g.
+    'Wave Kivy v2 $$$'. Older firmware, which sends
+    'Wave Kivy $$$', uses version 1.
+    Args:
+        - response: bytes received, up to #CONNECTION_RESPONSE.
+    @return Protocol version, or 0 if #CONNECTION_RESPONSE was not received.
+    """
+    if (isinstance(response, bytes)):
+        response = response.decode('utf-8', errors='replace')
+    if (CONNECTION_RESPONSE not in response):
+        return 0
+    match = re.search(r'v(\d+) ' + re.escape(CONNECTION_RESPONSE), response)
+    return int(match.group(1)) if match else 1
+
+def parse_value(response, prefix):
+    """
+    @brief Get the integer following prefix in a response of the device.
+
+    @return The value, or 0 if not found.
+    """
+    if (isinstance(response, bytes)):
+        response = response.decode('utf-8', errors='replace')
+    match = re.search(re.escape(prefix) + r'(\d+)', response)
+    return int(match.group(1)) if match else 0
+
+def parse_batch_size(response):
+    """
+    @brief Get the batch size accepted by the device from the response to #BATCH_SIZE_CMD.
+
+    @return Number of samples in each packet, or 0 if not found.
+    """
+    return parse_value(response, BATCH_SIZE_RESPONSE)
@@ -0,0 +1,314 @@
+import json
+import mmap
+import queue
+import struct
+import threading
+import time
+import numpy as np
+from decoder import VOLTS_PER_CODE
+
+"""
+@brief Magic bytes at the beginning of a recording file.
+"""
+RECORDING_MAGIC = b'PSKVREC1'
+
+"""
+@brief Version of the recording file format.
+
+Version 2 stores the samples as ADC codes, version 1 stored
+them as voltages.
+"""
+RECORDING_VERSION = 2
+
+"""
+@brief Data type of the samples stored in data blocks: little-endian uint16 ADC codes.
+
+The voltage of one code is stored in the metadata, under
+volts_per_code.
+"""
+SAMPLE_FORMAT = '<u2'
+
+"""
+@brief Data type of the samples stored by version 1 recordings: little-endian float32 voltages.
+"""
+LEGACY_SAMPLE_FORMAT = '<f4'
+
+"""
+@brief File header: magic bytes and length of the JSON metadata.
+"""
+FILE_HEADER = struct.Struct('<8sI')
+
+"""
+@brief Block header: tag, payload length in bytes, index of the first sample.
+
+All blocks start at offsets multiple of 8, so that their arrays
+can be mapped in memory without copies.
+"""
+BLOCK_HEADER = struct.Struct('<4sIQ')
+
+"""
+@brief Tag of data blocks: float64 timestamps followed by the samples, see #SAMPLE_FORMAT.
+"""
+DATA_TAG = b'DATA'
+
+"""
+@brief Tag of settings blocks: JSON encoded settings.
+"""
+SETTINGS_TAG = b'SETT'
+
+"""
+@brief Tag used internally to stop the writer thread, never written to file.
+"""
+_STOP_TAG = b'STOP'
+
+def _padding(n_bytes):
+    """
+    @brief Number of bytes needed to reach a multiple of 8.
+    """
+    return -n_bytes % 8
+
+class Recorder(object):
+    """
+    @brief Binary recorder of the sample stream.
+
+    Samples are handed to the recorder from the reader thread
+    with #write, which has the signature of a batch callback of
+    KivySerial and never blocks: blocks are put in a bounded
+    queue, and if the queue is full they are dropped and counted
+    in #dropped_samples. A dedicated writer thread merges
+    contiguous blocks in chunks of up to #chunk_size samples and
+    appends them to the file. Samples are stored as received
+    from the board, as uint16 ADC codes, and converted to
+    voltages by #RecordingReader.
+    File structure:
+    FILE_HEADER | JSON metadata | padding | block | block | ...
+    where each block is BLOCK_HEADER | payload | padding.
+    """
+
+    def __init__(self, path, metadata=None, queue_size=256, chunk_size=65536, volts_per_code=VOLTS_PER_CODE):
+        """
+        @brief Initialize the recorder.
+
+        Args:
+            - path: path of the file to be written.
+            - metadata: dictionary stored in the file header.
+            - queue_size: maximum number of blocks waiting to be written.
+            - chunk_size: maximum number of samples per data block.
+            - volts_per_code: voltage of one ADC code, stored in the metadata.
+        """
+        self.path = path
+        self.metadata = dict(metadata or {})
+        self.metadata['sample_format'] = SAMPLE_FORMAT
+        self.metadata['volts_per_code'] = volts_per_code
+        self.chunk_size = chunk_size
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped_samples = 0    # samples dropped because the queue was full
+        self.written_samples = 0    # samples written to the file
+        self.is_recording = False
+        self.writer_thread = None
+
+    def start(self):
+        """
+        @brief Create the file and start the writer thread.
+        """
+        self.metadata.setdefault('created', time.time())
+        self.metadata['version'] = RECORDING_VERSION
+        self.file = open(self.path, 'wb')
+        header = json.dumps(self.metadata).encode('utf-8')
+        self.file.write(FILE_HEADER.pack(RECORDING_MAGIC, len(header)))
+        self.file.write(header)
+        self.file.write(b'\0' * _padding(FILE_HEADER.size + len(header)))
+        self.is_recording = True
+        self.writer_thread = threading.Thread(target=self.write_loop, daemon=True)
+        self.writer_thread.start()
+
+    def write(self, codes, start_index, timestamps):
+        """
+        @brief Queue a block of samples to be written.
+
+        Args:
+            - codes: NumPy array with the ADC codes of the samples.
+            - start_index: index of the first sample of the block in the stream.
+            - timestamps: NumPy array with the host time of each sample.
+        """
+        if (not self.is_recording):
+            return
+        try:
+            self.queue.put_nowait((DATA_TAG, start_index, codes, timestamps))
+        except queue.Full:
+            self.dropped_samples += len(codes)
+
+    def set_settings(self, sample_index, **settings):
+        """
+        @brief Record a change of the acquisition settings.
+
+        Args:
+            - sample_index: index of the first sample acquired with the new settings.
+            - settings: settings to be stored, e.g. wave and range.
+        """
+        if (not self.is_recording):
+            return
+        try:
+            self.queue.put_nowait((SETTINGS_TAG, sample_index, settings, None))
+        except queue.Full:
+            pass
+
+    def stop(self):
+        """
+        @brief Write the pending blocks and close the file.
+        """
+        if (not self.is_recording):
+            return
+        self.is_recording = False
+        self.queue.put((_STOP_TAG, 0, None, None))
+        self.writer_thread.join()
+        self.file.close()
+
+    def write_loop(self):
+        """
+        @brief Writer thread: merge the queued blocks and write them.
+        """
+        chunk = []          # list of (samples, timestamps) to be merged
+        chunk_start = 0     # index of the first sample of the chunk
+        chunk_len = 0       # number of samples in the chunk
+        while True:
+            try:
+                tag, index, data, timestamps = self.queue.get(timeout=1)
+            except queue.Empty:
+                tag, index, data = None, None, None
+            # Flush the chunk if it cannot be extended
+            if (chunk_len > 0 and (tag != DATA_TAG or index != chunk_start + chunk_len
+                                   or chunk_len + len(data) > self.chunk_size)):
+                self.write_data_block(chunk_start, chunk)
+                chunk, chunk_len = [], 0
+            if (tag == DATA_TAG):
+                if (chunk_len == 0):
+                    chunk_start = index
+                chunk.append((data, timestamps))
+                chunk_len += len(data)
+            elif (tag == SETTINGS_TAG):
+                self.write_block(SETTINGS_TAG, index, json.dumps(data).encode('utf-8'))
+            elif (tag == _STOP_TAG):
+                self.file.flush()
+                return
+            else:
+                # Idle: make sure data reach the disk
+                self.file.flush()
+
+    def write_data_block(self, start_index, chunk):
+        """
+        @brief Write a data block with the samples of a chunk.
+        """
+        timestamps = np.concatenate([t for _, t in chunk]).astype('<f8')
+        samples = np.concatenate([s for s, _ in chunk]).astype(SAMPLE_FORMAT)
+        self.write_block(DATA_TAG, start_index, timestamps.tobytes() + samples.tobytes())
+        self.written_samples += len(samples)
+
+    def write_block(self, tag, start_index, payload):
+        """
+        @brief Append a block to the file.
+        """
+        self.file.write(BLOCK_HEADER.pack(tag, len(payload), start_index))
+        self.file.write(payload)
+        self.file.write(b'\0' * _padding(len(payload)))
+
+class RecordingReader(object):
+    """
+    @brief Memory mapped reader of a recording file.
+
+    The file is mapped in memory and indexed by jumping from
+    one block header to the next, so opening even very large
+    recordings is fast. The arrays returned by #data_blocks are
+    views on the mapped file: no data are copied until they
+    are used. Samples are stored as ADC codes, or as voltages
+    in version 1 recordings; #values converts them to voltages,
+    a block at a time.
+    """
+
+    def __init__(self, path):
+        """
+        @brief Open and index a recording.
+
+        Raises ValueError if the file is not a recording.
+        """
+        self.path = path
+        self.file = open(path, 'rb')
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self.file.close()
+            raise ValueError(f'{path} is empty')
+        if (len(self.map) < FILE_HEADER.size):
+            self.close()
+            raise ValueError(f'{path} is not a recording')
+        magic, header_len = FILE_HEADER.unpack_from(self.map, 0)
+        if (magic != RECORDING_MAGIC):
+            self.close()
+            raise ValueError(f'{path} is not a recording')
+        offset = FILE_HEADER.size
+        self.metadata = json.loads(bytes(self.map[offset:offset + header_len]).decode('utf-8'))
+        offset += header_len
+        offset += _padding(offset)
+        self.sample_dtype = np.dtype(self.metadata.get('sample_format', LEGACY_SAMPLE_FORMAT))
+        self.scale = self.metadata.get('volts_per_code', 1.0)  # voltage of one unit of the stored samples
+        self.sample_size = 8 + self.sample_dtype.itemsize       # bytes of each sample and its timestamp
+        # Index of the blocks: (tag, payload offset, payload length, start index)
+        self.blocks = []
+        while (offset + BLOCK_HEADER.size <= len(self.map)):
+            tag, length, start_index = BLOCK_HEADER.unpack_from(self.map, offset)
+            offset += BLOCK_HEADER.size
+            if (offset + length > len(self.map)):
+                # Truncated block, e.g. recording interrupted
+                break
+            self.blocks.append((tag, offset, length, start_index))
+            offset += length + _padding(length)
+        self.n_samples = sum(length // self.sample_size for tag, _, length, _ in self.blocks
+                             if tag == DATA_TAG)
+
+    def data_blocks(self, raw=False):
+        """
+        @brief Iterate over the data blocks.
+
+        Args:
+            - raw: give the samples as stored, e.g. as ADC codes, instead of voltages.
+        @return Generator of (start_index, samples, timestamps) tuples,
+        with timestamps, and raw samples, being read-only views on the file.
+        """
+        for tag, offset, length, start_index in self.blocks:
+            if (tag != DATA_TAG):
+                continue
+            n_samples = length // self.sample_size
+            timestamps = np.frombuffer(self.map, dtype='<f8', count=n_samples, offset=offset)
+            samples = np.frombuffer(self.map, dtype=self.sample_dtype, count=n_samples,
+                                    offset=offset + 8 * n_samples)
+            yield start_index, samples if raw else self.values(samples), timestamps
+
+    def values(self, samples):
+        """
+        @brief Convert samples as stored to voltages.
+        """
+        if (self.sample_dtype.kind == 'f' and self.scale == 1.0):
+            return samples
+        return samples * self.scale
+
+    def settings(self):
+        """
+        @brief Get the settings changes stored in the recording.
+
+        @return List of (sample_index, settings) tuples.
+        """
+        return [(start_index, json.loads(bytes(self.map[offset:offset + length]).decode('utf-8')))
+                for tag, offset, length, start_index in self.blocks if tag == SETTINGS_TAG]
+
+    def close(self):
+        """
+        @brief Unmap and close the file.
+
+        If arrays returned by #data_blocks are still referenced,
+        the memory map is released when they are garbage collected.
+        """
+        try:
+            self.map.close()
+        except (BufferError, AttributeError):
+            pass
+        self.file.close()
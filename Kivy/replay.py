@@ -0,0 +1,138 @@
+#!/usr/bin/python3
+
+import argparse
+import os
+import threading
+import time
+from recorder import RecordingReader
+
+class ReplaySource(object):
+    """
+    @brief Source replaying a recording through KivySerial.
+
+    The recording is memory mapped and its samples are pushed
+    to KivySerial.dispatch_samples, i.e. through the same path
+    followed by the samples read from the board: the sample
+    buffer drained by the GUI and all the registered callbacks.
+    Samples are paced according to their recorded timestamps,
+    sped up by #speed. A speed of 0 replays the recording as
+    fast as possible, which measures the throughput of all the
+    processing downstream of the serial reader. Recorded ADC
+    codes are dispatched along with their voltages, so the
+    buffer gets them as they were acquired.
+    """
+
+    def __init__(self, serial, path, speed=1.0, block_duration=0.02):
+        """
+        @brief Initialize the replay.
+
+        Args:
+            - serial: KivySerial instance receiving the samples.
+            - path: path of the recording.
+            - speed: replay speed, 1 for real time, 0 for as fast as possible.
+            - block_duration: duration of the blocks dispatched in paced modes (s).
+        """
+        self.serial = serial
+        self.reader = RecordingReader(path)
+        self.speed = speed
+        self.block_duration = block_duration
+        self.is_running = False
+        self.thread = None
+        self.replayed_samples = 0   # samples dispatched so far
+        self.elapsed = 0.0          # duration of the replay (s)
+        self.on_finished = None     # function called when the replay ends
+
+    def start(self):
+        """
+        @brief Start replaying in a background thread.
+        """
+        self.is_running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        @brief Stop replaying and wait for the thread to end.
+        """
+        self.is_running = False
+        if (self.thread is not None and self.thread is not threading.current_thread()):
+            self.thread.join()
+
+    def run(self):
+        """
+        @brief Dispatch all the samples of the recording.
+        """
+        settings = self.reader.settings()
+        self.apply_settings(self.reader.metadata)
+        start_time = time.perf_counter()
+        first_timestamp = None
+        # ADC codes are passed on as they are, version 1 voltages are encoded by dispatch_samples
+        has_codes = self.reader.sample_dtype.kind == 'u'
+        for start_index, samples, timestamps in self.reader.data_blocks(raw=True):
+            if (first_timestamp is None and len(timestamps) > 0):
+                first_timestamp = timestamps[0]
+            if (self.speed > 0):
+                # Dispatch in small blocks, each one at its time
+                block_len = max(1, int(self.block_duration * len(samples)
+                                       / max(timestamps[-1] - timestamps[0], 1e-9)))
+            else:
+                block_len = len(samples)
+            for first in range(0, len(samples), block_len):
+                if (not self.is_running):
+                    break
+                block = samples[first:first + block_len]
+                block_timestamps = timestamps[first:first + block_len]
+                while (settings and settings[0][0] <= start_index + first + len(block)):
+                    self.apply_settings(settings.pop(0)[1])
+                if (self.speed > 0):
+                    delay = ((block_timestamps[-1] - first_timestamp) / self.speed
+                             - (time.perf_counter() - start_time))
+                    if (delay > 0):
+                        time.sleep(delay)
+                self.serial.dispatch_samples(self.reader.values(block), block_timestamps,
+                                             block if has_codes else None)
+                self.replayed_samples += len(block)
+            if (not self.is_running):
+                break
+        self.elapsed = time.perf_counter() - start_time
+        self.is_running = False
+        if (self.on_finished is not None):
+            self.on_finished(self)
+
+    def apply_settings(self, settings):
+        """
+        @brief Reflect recorded settings changes on KivySerial.
+        """
+        self.serial.wave = settings.get('wave', self.serial.wave)
+        self.serial.range = settings.get('range', self.serial.range)
+        self.serial.sample_rate = settings.get('sample_rate', self.serial.sample_rate)
+
+    def get_stats(self):
+        """
+        @brief Get the replay statistics.
+        """
+        elapsed = self.elapsed if self.elapsed > 0 else 1e-9
+        return {
+            'samples': self.replayed_samples,
+            'elapsed': self.elapsed,
+            'samples_per_second': self.replayed_samples / elapsed,
+        }
+
+if __name__ == '__main__':
+    # Leave the command line to argparse: Kivy parses sys.argv when imported
+    os.environ.setdefault('KIVY_NO_ARGS', '1')
+    from communication import KivySerial
+
+    parser = argparse.ArgumentParser(description='Replay a recording through KivySerial.')
+    parser.add_argument('path', help='recording file')
+    parser.add_argument('--speed', type=float, default=0,
+                        help='replay speed, 1 for real time, 0 (default) for as fast as possible')
+    args = parser.parse_args()
+
+    serial = KivySerial(auto_connect=False)
+    replay = ReplaySource(serial, args.path, speed=args.speed)
+    replay.start()
+    replay.thread.join()
+    stats = replay.get_stats()
+    print(f"Replayed {stats['samples']} samples in {stats['elapsed']:.3f} s "
+          f"({stats['samples_per_second']:.0f} samples/s)")
@@ -0,0 +1,243 @@
+import numpy as np
+
+def encode_samples(values, dtype, scale=1.0):
+    """
+    @brief Convert values, e.g. voltages, to samples stored with a data type and scale.
+
+    Integer samples are rounded and clipped to the range of
+    the data type, e.g. voltages to uint16 ADC codes.
+    Args:
+        - values: array of values.
+        - dtype: NumPy data type of the samples.
+        - scale: value of one unit of the samples, e.g. volts per ADC code.
+    @return Array of samples, such that samples * scale ~ values.
+    """
+    dtype = np.dtype(dtype)
+    samples = np.asarray(values, dtype=np.float64)
+    if (scale != 1.0):
+        samples = samples / scale
+    if (dtype.kind in 'iu'):
+        info = np.iinfo(dtype)
+        samples = np.clip(np.rint(samples), info.min, info.max)
+    return samples.astype(dtype, copy=False)
+
+class SampleRingBuffer(object):
+    """
+    @brief Preallocated ring buffer for streamed samples.
+
+    The buffer is written by a single producer (the serial
+    reader thread) and read by any number of consumers, each
+    one through its own #RingReader. No lock is used: the
+    producer announces the slots it is about to overwrite in
+    #reserve_index, copies the data and then publishes them by
+    advancing #write_index, while readers check after copying
+    that the data they read were not overwritten meanwhile.
+    Samples can be stored in a compact form, e.g. as uint16
+    ADC codes with #scale volts per code: readers get them
+    either as stored, or converted to values in bulk.
+    """
+
+    def __init__(self, capacity, dtype=np.float64, scale=1.0):
+        """
+        @brief Initialize the buffer.
+
+        Args:
+            - capacity: maximum number of samples retained.
+            - dtype: NumPy data type of the samples.
+            - scale: value of one unit of the samples, e.g. volts per ADC code.
+        """
+        self.capacity = capacity
+        self.scale = scale
+        self.samples = np.zeros(capacity, dtype=dtype)
+        self.timestamps = np.zeros(capacity, dtype=np.float64)
+        self.write_index = 0    # total number of samples written so far
+        self.reserve_index = 0  # write index once the current write completes
+
+    def write(self, samples, timestamps):
+        """
+        @brief Append a block of samples.
+
+        Only the producer thread is allowed to call this method.
+        Args:
+            - samples: array of samples.
+            - timestamps: array with the host time of each sample.
+        """
+        n_samples = len(samples)
+        self.reserve_index = self.write_index + n_samples
+        if (n_samples > self.capacity):
+            samples = samples[-self.capacity:]
+            timestamps = timestamps[-self.capacity:]
+        n_copy = len(samples)
+        start = (self.write_index + n_samples - n_copy) % self.capacity
+        first = min(n_copy, self.capacity - start)
+        self.samples[start:start + first] = samples[:first]
+        self.timestamps[start:start + first] = timestamps[:first]
+        if (first < n_copy):
+            self.samples[:n_copy - first] = samples[first:]
+            self.timestamps[:n_copy - first] = timestamps[first:]
+        # Publish the new samples only when they are in place
+        self.write_index += n_samples
+
+    def read_from(self, index, max_samples=None):
+        """
+        @brief Copy the samples written from a given index on.
+
+        If the requested samples were already overwritten,
+        reading starts from the oldest sample still available.
+        Args:
+            - index: index of the first sample to read.
+            - max_samples: maximum number of samples to read.
+        @return Tuple (samples, timestamps, start_index).
+        """
+        end = self.write_index
+        start = max(index, self.reserve_index - self.capacity)
+        end = max(start, end)
+        if (max_samples is not None):
+            end = min(end, start + max_samples)
+        positions = np.arange(start, end) % self.capacity
+        samples = self.samples[positions]
+        timestamps = self.timestamps[positions]
+        # Drop what the producer overwrote while copying
+        oldest = self.reserve_index - self.capacity
+        if (oldest > start):
+            samples = samples[oldest - start:]
+            timestamps = timestamps[oldest - start:]
+            start = oldest
+        return samples, timestamps, start
+
+    def values(self, samples):
+        """
+        @brief Convert samples as stored to their values, e.g. ADC codes to voltages.
+        """
+        if (self.scale == 1.0):
+            return samples
+        return samples * self.scale
+
+    def reader(self):
+        """
+        @brief Create a new consumer starting from the newest sample.
+        """
+        return RingReader(self)
+
+class RingReader(object):
+    """
+    @brief Consumer of a #SampleRingBuffer.
+
+    Each reader keeps its own position in the buffer, so
+    several consumers can drain the same buffer at their
+    own pace. Samples overwritten before being read are
+    counted in #lost.
+    """
+    __slots__ = ('ring', 'index', 'lost')
+
+    def __init__(self, ring):
+        """
+        @brief Initialize the reader at the current end of the buffer.
+        """
+        self.ring = ring
+        self.index = ring.write_index   # index of the next sample to read
+        self.lost = 0                   # samples overwritten before being read
+
+    def available(self):
+        """
+        @brief Number of samples waiting to be read.
+        """
+        return self.ring.write_index - self.index
+
+    def read(self, max_samples=None):
+        """
+        @brief Read the new samples, converted to their values (see SampleRingBuffer.values).
+
+        @return Tuple (samples, timestamps) with copies of the data.
+        """
+        samples, timestamps = self.read_raw(max_samples)
+        return self.ring.values(samples), timestamps
+
+    def read_raw(self, max_samples=None):
+        """
+        @brief Read the new samples as stored, e.g. as ADC codes.
+
+        @return Tuple (samples, timestamps) with copies of the data.
+        """
+        samples, timestamps, start = self.ring.read_from(self.index, max_samples)
+        self.lost += start - self.index
+        self.index = start + len(samples)
+        return samples, timestamps
+
+class RollingWindow(object):
+    """
+    @brief Fixed size window over the most recent samples.
+
+    Samples are stored in a circular NumPy buffer, so pushing
+    a block of samples costs O(block size) regardless of the
+    window size. The samples are put back in chronological
+    order only when they are needed, e.g. to draw them.
+    Unlike #SampleRingBuffer, it is meant to be used from a
+    single thread.
+    """
+    __slots__ = ('data', 'head')
+
+    def __init__(self, size, fill=0.0, dtype=np.float64):
+        """
+        @brief Initialize the window.
+
+        Args:
+            - size: number of samples in the window.
+            - fill: initial value of the samples.
+            - dtype: NumPy data type of the samples, e.g. uint16 for ADC codes.
+        """
+        self.data = np.full(size, fill, dtype=dtype)
+        self.head = 0   # position of the oldest sample
+
+    def __len__(self):
+        return self.data.size
+
+    def push(self, values):
+        """
+        @brief Append a block of samples, dropping the oldest ones.
+        """
+        size = self.data.size
+        values = np.asarray(values)
+        n_values = values.size
+        if (n_values >= size):
+            self.data[:] = values[-size:]
+            self.head = 0
+            return
+        first = min(n_values, size - self.head)
+        self.data[self.head:self.head + first] = values[:first]
+        self.data[:n_values - first] = values[first:]
+        self.head = (self.head + n_values) % size
+
+    def ordered(self, out=None):
+        """
+        @brief Get the samples from the oldest to the newest.
+
+        Args:
+            - out: optional array of the window size to copy the samples into.
+        @return Array with the samples in chronological order.
+        """
+        if (out is None):
+            out = np.empty_like(self.data)
+        tail = self.data.size - self.head
+        out[:tail] = self.data[self.head:]
+        out[tail:] = self.data[:self.head]
+        return out
+
+    def latest(self, n_samples, out=None):
+        """
+        @brief Get the n_samples most recent samples, from the oldest to the newest.
+
+        Only those samples are copied, so the cost does not
+        depend on the window size.
+        Args:
+            - n_samples: number of samples, at most the window size.
+            - out: optional array of n_samples samples to copy the samples into.
+        @return Array with the samples in chronological order.
+        """
+        if (out is None):
+            out = np.empty(n_samples, dtype=self.data.dtype)
+        start = (self.head - n_samples) % self.data.size
+        first = min(n_samples, self.data.size - start)
+        out[:first] = self.data[start:start + first]
+        out[first:] = self.data[:n_samples - first]
+        return out
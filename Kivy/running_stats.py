@@ -0,0 +1,327 @@
+import collections
+import numpy as np
+from ring_buffer import RollingWindow, encode_samples
+
+"""
+@brief Hysteresis of the frequency estimator, as a fraction of the peak-to-peak amplitude.
+"""
+HYSTERESIS = 0.1
+
+def sum_squares(values):
+    """
+    @brief Sum of the squares of a block of samples, accumulated in float64.
+
+    Integer samples, e.g. uint16 ADC codes, are cast by einsum
+    as they are read, instead of being copied to a float64
+    array first: np.dot would overflow in their own type.
+    """
+    return float(np.einsum('i,i->', values, values, dtype=np.float64))
+
+class RunningStats(object):
+    """
+    @brief Statistics of all the samples pushed since the last reset.
+
+    Only running sums and extrema are kept, so each block
+    costs O(block size) and no sample is stored. Samples are
+    used in their own type, e.g. as ADC codes, and converted
+    to values only when the statistics are read.
+    """
+
+    def __init__(self, scale=1.0):
+        """
+        @brief Initialize the statistics.
+
+        Args:
+            - scale: value of one unit of the samples pushed, e.g.
+              volts per ADC code; statistics are given in values.
+        """
+        self.scale = scale
+        self.reset()
+
+    def reset(self):
+        """
+        @brief Forget the samples pushed so far.
+        """
+        self.count = 0
+        self.sum = 0.0
+        self.sum_squares = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def push(self, values):
+        """
+        @brief Add a block of samples.
+        """
+        if (len(values) == 0):
+            return
+        values = np.asarray(values)
+        self.count += len(values)
+        self.sum += float(np.sum(values, dtype=np.float64))
+        self.sum_squares += sum_squares(values)
+        self.min = min(self.min, float(np.min(values)))
+        self.max = max(self.max, float(np.max(values)))
+
+    def get_stats(self):
+        """
+        @brief Get min, max, mean, rms and peak_to_peak, None if no sample was pushed.
+        """
+        if (self.count == 0):
+            return None
+        mean = self.sum / self.count
+        return {
+            'count': self.count,
+            'min': self.min * self.scale,
+            'max': self.max * self.scale,
+            'mean': mean * self.scale,
+            'rms': np.sqrt(max(self.sum_squares / self.count, 0.0)) * self.scale,
+            'peak_to_peak': (self.max - self.min) * self.scale,
+        }
+
+class MonotonicExtremum(object):
+    """
+    @brief Maximum, or minimum, of a sliding window, from a monotonic deque.
+
+    For the maximum, the deque holds (index, value) pairs with
+    decreasing values: the samples that may still become the
+    maximum once the older ones leave the window. Each block
+    is first reduced with NumPy to the samples greater than all
+    the following ones in the block, the only ones that can
+    enter the deque, so the work is O(1) amortized per sample.
+    The minimum is tracked in the same way with the opposite
+    comparisons, so unsigned samples are never negated.
+    """
+
+    def __init__(self, minimum=False):
+        """
+        @brief Initialize an empty window.
+
+        Args:
+            - minimum: track the minimum instead of the maximum.
+        """
+        self.is_minimum = minimum
+        self.deque = collections.deque()
+
+    def push(self, values, start_index):
+        """
+        @brief Add a block of samples, the first one with index start_index.
+        """
+        if (len(values) == 0):
+            return
+        # Extremum of the samples following each sample of the block
+        following = np.empty(len(values))
+        if (self.is_minimum):
+            following[-1] = np.inf
+            following[:-1] = np.minimum.accumulate(values[:0:-1])[::-1]
+            candidates = np.flatnonzero(values < following)
+        else:
+            following[-1] = -np.inf
+            following[:-1] = np.maximum.accumulate(values[:0:-1])[::-1]
+            candidates = np.flatnonzero(values > following)
+        block_extremum = values[candidates[0]]
+        if (self.is_minimum):
+            while (len(self.deque) > 0 and self.deque[-1][1] >= block_extremum):
+                self.deque.pop()
+        else:
+            while (len(self.deque) > 0 and self.deque[-1][1] <= block_extremum):
+                self.deque.pop()
+        self.deque.extend(zip((candidates + start_index).tolist(), values[candidates].tolist()))
+
+    def expire(self, oldest_index):
+        """
+        @brief Drop the samples older than oldest_index.
+        """
+        while (len(self.deque) > 0 and self.deque[0][0] < oldest_index):
+            self.deque.popleft()
+
+    def value(self):
+        """
+        @brief Extremum of the window, None if empty.
+        """
+        return self.deque[0][1] if len(self.deque) > 0 else None
+
+class FrequencyEstimator(object):
+    """
+    @brief Fundamental frequency from the rising crossings of a level.
+
+    A Schmitt trigger around the level, with a given hysteresis,
+    makes the estimate robust to noise. The indices of the
+    rising crossings in the window are kept in a deque, and the
+    frequency is the number of periods between the first and
+    the last one divided by their distance.
+    """
+
+    def __init__(self):
+        self.crossings = collections.deque()
+        self.state = False      # output of the trigger after the last sample
+
+    def push(self, values, start_index, level, hysteresis):
+        """
+        @brief Add a block of samples, the first one with index start_index.
+
+        Args:
+            - level: level whose crossings are counted.
+            - hysteresis: half width of the dead band around the level.
+        """
+        if (len(values) == 0):
+            return
+        above = values > level + hysteresis
+        decided = above | (values < level - hysteresis)
+        # Last sample outside of the dead band, for each sample
+        last = np.maximum.accumulate(np.where(decided, np.arange(len(values)), -1))
+        state = np.where(last >= 0, above[np.maximum(last, 0)], self.state)
+        previous = np.empty(len(values), dtype=bool)
+        previous[0] = self.state
+        previous[1:] = state[:-1]
+        self.crossings.extend((np.flatnonzero(state & ~previous) + start_index).tolist())
+        self.state = bool(state[-1])
+
+    def expire(self, oldest_index):
+        """
+        @brief Drop the crossings older than oldest_index.
+        """
+        while (len(self.crossings) > 0 and self.crossings[0] < oldest_index):
+            self.crossings.popleft()
+
+    def frequency(self, sample_rate):
+        """
+        @brief Estimated frequency (Hz), None if less than a period was seen.
+        """
+        if (len(self.crossings) < 2):
+            return None
+        return (len(self.crossings) - 1) * sample_rate / float(self.crossings[-1] - self.crossings[0])
+
+class WindowedStats(object):
+    """
+    @brief Statistics of the samples in a RollingWindow.
+
+    Samples are pushed to the window through #push, which
+    updates running sums with the samples entering and leaving
+    the window, monotonic deques for its extrema and the
+    crossings for the frequency estimate: the window is never
+    rescanned, except to refresh the sums against rounding
+    errors once every window length.
+    """
+
+    def __init__(self, window, scale=1.0):
+        """
+        @brief Initialize the statistics of an empty window.
+
+        Args:
+            - window: RollingWindow receiving the samples. Its
+              current content is not taken into account.
+            - scale: value of one unit of the samples, e.g. volts
+              per ADC code; statistics are given in values.
+        """
+        self.window = window
+        self.scale = scale
+        self.size = len(window)
+        self.count = 0          # samples pushed so far
+        self.sum = 0.0
+        self.sum_squares = 0.0
+        self.since_refresh = 0  # samples pushed since the sums were recomputed
+        self.maximum = MonotonicExtremum()
+        self.minimum = MonotonicExtremum(minimum=True)
+        self.crossings = FrequencyEstimator()
+
+    def push(self, values):
+        """
+        @brief Push a block of samples to the window and update the statistics.
+
+        The samples are expected in the data type of the window,
+        e.g. as ADC codes, and are used as they are: only the
+        sums are accumulated in float64.
+        """
+        values = np.asarray(values)
+        n_values = len(values)
+        if (n_values == 0):
+            return
+        # Level and amplitude before the block, for the frequency estimate
+        if (self.count > 0):
+            level = self.sum / min(self.count, self.size)
+            peak_to_peak = float(self.maximum.value() - self.minimum.value())
+        else:
+            level = float(np.mean(values))
+            peak_to_peak = float(np.max(values)) - float(np.min(values))
+        n_stored = min(self.count, self.size)
+        n_leaving = n_stored + n_values - self.size
+        if (n_values >= self.size):
+            self.since_refresh = self.size
+        elif (n_leaving > 0):
+            oldest = self.window.head - n_stored
+            leaving = self.window.data[(oldest + np.arange(n_leaving)) % self.size]
+            self.sum -= float(np.sum(leaving, dtype=np.float64))
+            self.sum_squares -= sum_squares(leaving)
+        self.sum += float(np.sum(values, dtype=np.float64))
+        self.sum_squares += sum_squares(values)
+        start_index = self.count
+        self.window.push(values)
+        self.count += n_values
+        self.since_refresh += n_values
+        if (self.since_refresh >= self.size):
+            self.refresh()
+        oldest_index = self.count - self.size
+        self.maximum.push(values, start_index)
+        self.maximum.expire(oldest_index)
+        self.minimum.push(values, start_index)
+        self.minimum.expire(oldest_index)
+        self.crossings.push(values, start_index, level, HYSTERESIS * peak_to_peak / 2)
+        self.crossings.expire(oldest_index)
+
+    def refresh(self):
+        """
+        @brief Recompute the sums from the samples in the window.
+        """
+        samples = self.samples()
+        self.sum = float(np.sum(samples, dtype=np.float64))
+        self.sum_squares = sum_squares(samples)
+        self.since_refresh = 0
+
+    def samples(self):
+        """
+        @brief Get the samples pushed that are still in the window, oldest first.
+        """
+        return self.window.latest(min(self.count, self.size))
+
+    def get_stats(self, sample_rate):
+        """
+        @brief Get the statistics of the window.
+
+        @return Dictionary with min, max, mean, rms, peak_to_peak and
+        frequency (None if not available), None if the window is empty.
+        """
+        count = min(self.count, self.size)
+        if (count == 0):
+            return None
+        maximum = self.maximum.value()
+        minimum = self.minimum.value()
+        mean = self.sum / count
+        return {
+            'count': count,
+            'min': float(minimum) * self.scale,
+            'max': float(maximum) * self.scale,
+            'mean': mean * self.scale,
+            'rms': np.sqrt(max(self.sum_squares / count, 0.0)) * self.scale,
+            'peak_to_peak': float(maximum - minimum) * self.scale,
+            'frequency': self.crossings.frequency(sample_rate) if sample_rate > 0 else None,
+        }
+
+    def resized(self, size, dtype=None, scale=None):
+        """
+        @brief Create the statistics of a new window with the most recent samples.
+
+        Only the samples that fit in the new window are copied,
+        so the cost is O(size) whatever the size of the old one.
+        Args:
+            - size: number of samples of the new window.
+            - dtype: data type of the samples of the new window, the current one by default.
+            - scale: value of one unit of the samples of the new window, the current one by default.
+        @return WindowedStats of a new RollingWindow of the given size.
+        """
+        dtype = self.window.data.dtype if dtype is None else np.dtype(dtype)
+        scale = self.scale if scale is None else scale
+        samples = self.window.latest(min(self.count, self.size, size))
+        if (dtype != samples.dtype or scale != self.scale):
+            samples = encode_samples(samples * self.scale, dtype, scale)
+        stats = WindowedStats(RollingWindow(size, dtype=dtype), scale)
+        stats.push(samples)
+        return stats
@@ -0,0 +1,171 @@
+from kivy.clock import Clock
+import time
+
+class FrameStats(object):
+    """
+    @brief Frame time statistics of a #RedrawScheduler.
+    """
+
+    """
+    @brief Weight of the newest frame in the moving averages.
+    """
+    SMOOTHING = 0.1
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """
+        @brief Reset all the statistics.
+        """
+        self.frames = 0             # number of redraws performed
+        self.skipped = 0            # number of ticks without anything to redraw
+        self.throttled = 0          # number of times the frame rate was lowered
+        self.last_time = 0.0        # duration of the last redraw (s)
+        self.mean_time = 0.0        # moving average of the redraw duration (s)
+        self.max_time = 0.0         # longest redraw (s)
+        self.tick_rate = 0.0        # moving average of the measured tick rate (Hz)
+
+    def add_frame(self, duration):
+        """
+        @brief Account for a redraw that took duration seconds.
+        """
+        if (self.frames == 0):
+            self.mean_time = duration
+        else:
+            self.mean_time += self.SMOOTHING * (duration - self.mean_time)
+        self.frames += 1
+        self.last_time = duration
+        self.max_time = max(self.max_time, duration)
+
+    def add_tick(self, dt):
+        """
+        @brief Account for the time elapsed between two ticks.
+        """
+        if (dt > 0):
+            rate = 1.0 / dt
+            if (self.tick_rate == 0):
+                self.tick_rate = rate
+            else:
+                self.tick_rate += self.SMOOTHING * (rate - self.tick_rate)
+
+    def as_dict(self):
+        """
+        @brief Get the statistics as a dictionary.
+        """
+        return {
+            'frames': self.frames,
+            'skipped': self.skipped,
+            'throttled': self.throttled,
+            'last_time': self.last_time,
+            'mean_time': self.mean_time,
+            'max_time': self.max_time,
+            'tick_rate': self.tick_rate,
+        }
+
+class RedrawScheduler(object):
+    """
+    @brief Display rate driven redraw scheduler.
+
+    Calls a redraw function from the Kivy Clock at a target
+    frame rate, independently from the rate at which samples
+    arrive. The redraw function is called as redraw(force) and
+    returns True if it drew something: force is True when a
+    redraw was explicitly requested with #request_redraw, so
+    that the function can skip the frame when nothing changed.
+    When redraws take more than #load_limit of the frame
+    interval, or ticks arrive late, the frame rate is lowered
+    down to #min_fps, and it is raised back towards
+    #target_fps when frames are fast again.
+    """
+
+    def __init__(self, redraw, target_fps=50, min_fps=5, load_limit=0.5):
+        """
+        @brief Initialize the scheduler.
+
+        Args:
+            - redraw: function called at each frame.
+            - target_fps: desired frame rate (Hz).
+            - min_fps: minimum frame rate when throttling (Hz).
+            - load_limit: maximum fraction of the frame interval spent redrawing.
+        """
+        self.redraw = redraw
+        self.target_fps = target_fps
+        self.min_fps = min_fps
+        self.load_limit = load_limit
+        self.fps = target_fps       # current frame rate
+        self.dirty = False          # redraw requested
+        self.event = None           # Clock event
+        self.stats = FrameStats()
+
+    def start(self):
+        """
+        @brief Start calling the redraw function.
+        """
+        self.schedule(self.target_fps)
+
+    def stop(self):
+        """
+        @brief Stop calling the redraw function.
+        """
+        if (self.event is not None):
+            self.event.cancel()
+            self.event = None
+
+    def is_running(self):
+        """
+        @brief Check if the scheduler is running.
+        """
+        return self.event is not None
+
+    def set_target_fps(self, fps):
+        """
+        @brief Change the target frame rate.
+        """
+        self.target_fps = fps
+        if (self.is_running()):
+            self.schedule(fps)
+
+    def request_redraw(self):
+        """
+        @brief Force a redraw at the next frame.
+        """
+        self.dirty = True
+
+    def schedule(self, fps):
+        """
+        @brief (Re)schedule the Clock event at a given frame rate.
+        """
+        self.fps = min(max(fps, self.min_fps), self.target_fps)
+        self.stop()
+        self.event = Clock.schedule_interval(self.tick, 1.0 / self.fps)
+
+    def tick(self, dt):
+        """
+        @brief Clock callback: redraw and adapt the frame rate.
+        """
+        self.stats.add_tick(dt)
+        force = self.dirty
+        self.dirty = False
+        start = time.perf_counter()
+        if (not self.redraw(force)):
+            self.stats.skipped += 1
+            return
+        self.stats.add_frame(time.perf_counter() - start)
+
+        interval = 1.0 / self.fps
+        load = self.stats.mean_time / interval
+        if ((load > self.load_limit or dt > 2 * interval) and self.fps > self.min_fps):
+            self.stats.throttled += 1
+            self.schedule(self.fps * 0.8)
+        elif (load < self.load_limit / 2 and dt < 1.2 * interval and self.fps < self.target_fps):
+            self.schedule(self.fps * 1.1)
+
+    def get_stats(self):
+        """
+        @brief Get the frame statistics, including the current frame rate.
+        """
+        stats = self.stats.as_dict()
+        stats['fps'] = self.fps
+        stats['target_fps'] = self.target_fps
+        return stats
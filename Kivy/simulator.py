@@ -0,0 +1,452 @@
+#!/usr/bin/python3
+
+import argparse
+import threading
+import time
+import urllib.parse
+import numpy as np
+from decoder import (START_BYTE, END_BYTE, PACKET_SIZE, SEQ_START_BYTE, SEQ_PACKET_SIZE,
+                     BATCH_START_BYTE, MAX_BATCH_SIZE, CRC8_TABLE, FULL_SCALE_VOLTAGE, MAX_CODE)
+from protocol import (CONNECTION_CMD, START_STREAMING_CMD, STOP_STREAMING_CMD, WAVE_SINE_CMD,
+                      WAVE_TRIANGLE_CMD, RANGE_SMALL_CMD, RANGE_LARGE_CMD, BATCH_SIZE_CMD,
+                      GET_SAMPLE_RATE_CMD, SAMPLE_RATE_CMD, BAUDRATE_CMD, BATCH_SIZE_RESPONSE,
+                      SAMPLE_RATE_RESPONSE, BAUDRATE_RESPONSE, MAX_SAMPLE_RATE, PROTOCOL_VERSION)
+from transport import Transport, SIMULATOR_PREFIX
+
+"""
+@brief Message sent by the firmware in response to #CONNECTION_CMD, for each protocol version.
+"""
+CONNECTION_MESSAGES = {1: b'Wave Kivy $$$', 2: b'Wave Kivy v2 $$$', 3: b'Wave Kivy v3 $$$',
+                       4: b'Wave Kivy v4 $$$'}
+
+"""
+@brief Number of argument bytes and minimum protocol version of the commands with an argument.
+"""
+COMMAND_ARGUMENTS = {BATCH_SIZE_CMD: (1, 3), SAMPLE_RATE_CMD: (2, 4), BAUDRATE_CMD: (4, 4)}
+
+"""
+@brief Bus clock of the simulated PSoC, from which sample rate and baud rate are derived (Hz).
+"""
+BUS_CLOCK = 24000000
+
+"""
+@brief Maximum period of the 8-bit timer triggering the samples.
+"""
+TIMER_MAX_PERIOD = 255
+
+"""
+@brief Peak-to-peak amplitude of the wave for each range (V).
+"""
+RANGE_AMPLITUDE = {'SMALL': 1.0, 'LARGE': 4.0}
+
+class SimulatedWaveDAC(object):
+    """
+    @brief Software model of the WaveDAC firmware.
+
+    Answers the same commands as the firmware and, while
+    streaming, produces the same data packets with a sine or
+    triangle wave sampled at #sample_rate. A fraction of the
+    packets can be corrupted, by changing or dropping one of
+    their bytes, to exercise the resynchronization of the host.
+    """
+
+    def __init__(self, sample_rate=100, wave_frequency=1.0, corruption=0.0, seed=None,
+                 protocol_version=PROTOCOL_VERSION):
+        """
+        @brief Initialize the device.
+
+        Args:
+            - sample_rate: packets sent per second while streaming.
+            - wave_frequency: frequency of the generated wave (Hz).
+            - corruption: probability of corrupting each packet.
+            - seed: seed of the random generator used for corruption.
+            - protocol_version: packet format, 1 for the firmware without
+              sequence numbers, 2 for the one without batch packets.
+        """
+        self.sample_rate = sample_rate
+        self.wave_frequency = wave_frequency
+        self.corruption = corruption
+        self.protocol_version = protocol_version
+        self.sequence = 0           # sequence number of the next packet
+        self.batch_size = 1         # samples in each packet
+        self.pending_command = None # command waiting for its argument
+        self.argument = bytearray() # argument bytes received so far
+        self.baudrate = 115200      # baud rate of the UART
+        self.rng = np.random.default_rng(seed)
+        self.sample_index = 0       # index of the next sample of the wave
+        self.lock = threading.Lock()
+        self.reset()
+
+    @property
+    def packet_size(self):
+        """
+        @brief Size of each data packet in bytes.
+        """
+        if (self.batch_size > 1):
+            return 2 * self.batch_size + 5
+        return SEQ_PACKET_SIZE if self.protocol_version >= 2 else PACKET_SIZE
+
+    def reset(self):
+        """
+        @brief Reset the settings, as done by the firmware on connection.
+        """
+        self.is_streaming = False
+        self.wave = 'SINE'
+        self.range = 'LARGE'
+
+    def handle_command(self, command):
+        """
+        @brief Execute a command received from the host.
+
+        Args:
+            - command: command character.
+        @return Bytes sent back to the host.
+        """
+        with self.lock:
+            if (self.pending_command is not None):
+                self.argument.append(ord(command) & 0xFF)
+                if (len(self.argument) < COMMAND_ARGUMENTS[self.pending_command][0]):
+                    return b''
+                command, self.pending_command = self.pending_command, None
+                return self.handle_argument(command, int.from_bytes(self.argument, 'big'))
+            if (command in COMMAND_ARGUMENTS
+                    and self.protocol_version >= COMMAND_ARGUMENTS[command][1]):
+                self.pending_command = command
+                self.argument = bytearray()
+                return b''
+            if (command == GET_SAMPLE_RATE_CMD and self.protocol_version >= 4):
+                return self.sample_rate_response()
+            if (command == CONNECTION_CMD):
+                self.reset()
+                self.batch_size = 1
+                return CONNECTION_MESSAGES[self.protocol_version]
+            elif (command == START_STREAMING_CMD):
+                if (not self.is_streaming):
+                    self.is_streaming = True
+                    self.stream_start = time.monotonic()
+                    self.streamed_samples = 0
+                    self.sequence = 0
+            elif (command == STOP_STREAMING_CMD):
+                self.is_streaming = False
+            elif (command == WAVE_SINE_CMD):
+                self.wave = 'SINE'
+            elif (command == WAVE_TRIANGLE_CMD):
+                self.wave = 'TRIANGLE'
+            elif (command == RANGE_SMALL_CMD):
+                self.range = 'SMALL'
+            elif (command == RANGE_LARGE_CMD):
+                self.range = 'LARGE'
+            else:
+                return 'Unknown command {}\r\n'.format(command).encode('utf-8', errors='replace')
+        return b''
+
+    def handle_argument(self, command, value):
+        """
+        @brief Execute a command once its argument has been received.
+
+        @return Bytes sent back to the host.
+        """
+        if (command == BATCH_SIZE_CMD):
+            self.batch_size = min(max(value, 1), MAX_BATCH_SIZE)
+            return '{}{}\r\n'.format(BATCH_SIZE_RESPONSE, self.batch_size).encode('utf-8')
+        elif (command == SAMPLE_RATE_CMD):
+            self.set_sample_rate(value)
+            return self.sample_rate_response()
+        elif (command == BAUDRATE_CMD):
+            # Closest divider of the UART clock, oversampling by 8
+            divider = int(round(BUS_CLOCK / (8.0 * value))) if value > 0 else 0
+            if (1 <= divider <= 65536
+                    and abs(BUS_CLOCK / (8.0 * divider) - value) * 50 <= value):
+                response = '{}{}\r\n'.format(BAUDRATE_RESPONSE, value).encode('utf-8')
+                self.baudrate = value
+                return response
+            return '{}{}\r\n'.format(BAUDRATE_RESPONSE, self.baudrate).encode('utf-8')
+        return b''
+
+    def set_sample_rate(self, rate):
+        """
+        @brief Set the sample rate as the firmware does.
+
+        The rate obtained is quantized by the clock divider and
+        the period of the 8-bit timer.
+        """
+        rate = min(max(rate, 1), MAX_SAMPLE_RATE)
+        divider = min(-(-BUS_CLOCK // (rate * (TIMER_MAX_PERIOD + 1))), 65536)
+        period = min((BUS_CLOCK // divider + rate // 2) // rate, TIMER_MAX_PERIOD + 1)
+        self.sample_rate = BUS_CLOCK / float(divider * period)
+        if (self.is_streaming):
+            # Samples due are counted from now at the new rate
+            self.stream_start = time.monotonic()
+            self.streamed_samples = 0
+
+    def sample_rate_response(self):
+        """
+        @brief Response to #GET_SAMPLE_RATE_CMD.
+        """
+        return '{}{}\r\n'.format(SAMPLE_RATE_RESPONSE, int(round(self.sample_rate))).encode('utf-8')
+
+    def samples_due(self):
+        """
+        @brief Number of samples to be sent to keep up with #sample_rate.
+        """
+        if (not self.is_streaming):
+            return 0
+        elapsed = time.monotonic() - self.stream_start
+        return max(int(elapsed * self.sample_rate) - self.streamed_samples, 0)
+
+    def poll(self, max_samples=None):
+        """
+        @brief Get the packets due since the last poll.
+
+        Only whole packets are returned: samples due that do not
+        fill a packet yet are returned at a later poll.
+        Args:
+            - max_samples: maximum number of samples returned. Packets
+              due and not returned are lost, as when the output buffer
+              of the firmware overflows.
+        @return Bytes of the packets.
+        """
+        with self.lock:
+            if (not self.is_streaming):
+                return b''
+            n_due = self.samples_due()
+            n_due -= n_due % self.batch_size
+            n_samples = n_due if max_samples is None else min(n_due, max_samples)
+            n_samples -= n_samples % self.batch_size
+            self.streamed_samples += n_due
+            data = self.generate(n_samples)
+            self.sample_index += n_due - n_samples
+            self.sequence += n_due - n_samples
+            return data
+
+    def generate(self, n_samples):
+        """
+        @brief Generate the packets of the next n_samples samples.
+
+        With batch packets, n_samples must be a multiple of #batch_size.
+        """
+        t = (self.sample_index + np.arange(n_samples)) / float(self.sample_rate)
+        self.sample_index += n_samples
+        phase = (t * self.wave_frequency) % 1.0
+        if (self.wave == 'SINE'):
+            wave = (1 - np.cos(2 * np.pi * phase)) / 2
+        else:
+            wave = 1 - np.abs(2 * phase - 1)
+        voltage = wave * RANGE_AMPLITUDE[self.range]
+        codes = np.round(voltage / FULL_SCALE_VOLTAGE * MAX_CODE).astype(np.uint16)
+        if (self.batch_size > 1):
+            packets = self.batch_packets(codes)
+        else:
+            packets = self.single_packets(codes)
+        if (self.corruption > 0 and n_samples > 0):
+            return self.corrupt(packets)
+        return packets.tobytes()
+
+    def single_packets(self, codes):
+        """
+        @brief Build a packet for each ADC code.
+        """
+        n_samples = codes.size
+        packets = np.empty((n_samples, self.packet_size), dtype=np.uint8)
+        if (self.protocol_version >= 2):
+            sequence = ((self.sequence + np.arange(n_samples)) & 0xFF).astype(np.uint8)
+            self.sequence += n_samples
+            packets[:, 0] = SEQ_START_BYTE
+            packets[:, 1] = sequence
+            packets[:, 2] = codes >> 8
+            packets[:, 3] = codes & 0xFF
+            crc = CRC8_TABLE[sequence]
+            crc = CRC8_TABLE[crc ^ packets[:, 2]]
+            packets[:, 4] = CRC8_TABLE[crc ^ packets[:, 3]]
+        else:
+            packets[:, 0] = START_BYTE
+            packets[:, 1] = codes >> 8
+            packets[:, 2] = codes & 0xFF
+        packets[:, -1] = END_BYTE
+        return packets
+
+    def batch_packets(self, codes):
+        """
+        @brief Build the packets for a number of ADC codes multiple of #batch_size.
+        """
+        n_packets = codes.size // self.batch_size
+        packets = np.empty((n_packets, self.packet_size), dtype=np.uint8)
+        packets[:, 0] = BATCH_START_BYTE
+        packets[:, 1] = self.batch_size
+        packets[:, 2] = (self.sequence + self.batch_size * np.arange(n_packets)) & 0xFF
+        self.sequence += codes.size
+        payload = codes.reshape(n_packets, self.batch_size)
+        packets[:, 3:-2:2] = payload >> 8
+        packets[:, 4:-2:2] = payload & 0xFF
+        crc = np.zeros(n_packets, dtype=np.uint8)
+        for offset in range(1, self.packet_size - 2):
+            crc = CRC8_TABLE[crc ^ packets[:, offset]]
+        packets[:, -2] = crc
+        packets[:, -1] = END_BYTE
+        return packets
+
+    def corrupt(self, packets):
+        """
+        @brief Change or drop one byte in a random fraction of the packets.
+        """
+        n_samples, packet_size = packets.shape
+        corrupted = np.flatnonzero(self.rng.random(n_samples) < self.corruption)
+        positions = self.rng.integers(0, packet_size, corrupted.size)
+        dropped = self.rng.random(corrupted.size) < 0.5
+        packets[corrupted[~dropped], positions[~dropped]] = self.rng.integers(
+            0, 256, np.count_nonzero(~dropped), dtype=np.uint8)
+        data = packets.reshape(-1)
+        keep = np.ones(data.size, dtype=bool)
+        keep[corrupted[dropped] * packet_size + positions[dropped]] = False
+        return data[keep].tobytes()
+
+class SimulatedTransport(Transport):
+    """
+    @brief In-memory transport connected to a #SimulatedWaveDAC.
+
+    Packets are generated lazily, when the host checks or reads
+    the input buffer, according to the time elapsed since
+    streaming started. The input buffer has a limited size,
+    like the one of the operating system: packets that do not
+    fit are lost and counted in #overflowed_bytes.
+    """
+
+    def __init__(self, device=None, timeout=1, buffer_size=2 ** 16, baudrate=115200):
+        """
+        @brief Initialize the transport.
+
+        Args:
+            - device: simulated device, a new one if None.
+            - timeout: read timeout (s).
+            - buffer_size: size of the input buffer (bytes).
+            - baudrate: baud rate of the port. Bytes are exchanged only
+              while it matches the one of the device; the simulated
+              link has no bandwidth limit.
+        """
+        self.device = device if device is not None else SimulatedWaveDAC()
+        self.timeout = timeout
+        self.baudrate = baudrate
+        self.buffer_size = buffer_size
+        self.buffer = bytearray()
+        self.lock = threading.Lock()
+        self.overflowed_bytes = 0
+        self.port = SIMULATOR_PREFIX
+        self.is_open = True
+
+    @classmethod
+    def from_url(cls, url, baudrate=115200, timeout=1):
+        """
+        @brief Create a transport from a sim:// url.
+
+        Supported options: rate (Hz), freq (Hz), corruption,
+        seed, buffer (bytes) and version (protocol version), e.g.
+        sim://?rate=1000&freq=5&corruption=0.001
+        """
+        options = dict(urllib.parse.parse_qsl(urllib.parse.urlparse(url).query))
+        device = SimulatedWaveDAC(
+            sample_rate=float(options.get('rate', 100)),
+            wave_frequency=float(options.get('freq', 1)),
+            corruption=float(options.get('corruption', 0)),
+            seed=int(options['seed']) if 'seed' in options else None,
+            protocol_version=int(options.get('version', PROTOCOL_VERSION)))
+        transport = cls(device, timeout=timeout, baudrate=baudrate,
+                        buffer_size=int(options.get('buffer', 2 ** 16)))
+        transport.port = url
+        return transport
+
+    def produce(self):
+        """
+        @brief Move the packets due from the device to the input buffer.
+        """
+        with self.lock:
+            packet_size = self.device.packet_size
+            batch_size = self.device.batch_size
+            free_samples = (self.buffer_size - len(self.buffer)) // packet_size * batch_size
+            n_due = self.device.samples_due()
+            if (n_due > free_samples):
+                self.overflowed_bytes += (n_due - free_samples) // batch_size * packet_size
+            data = self.device.poll(max_samples=free_samples)
+            if (self.baudrate == self.device.baudrate):
+                self.buffer += data
+
+    @property
+    def in_waiting(self):
+        self.produce()
+        return len(self.buffer)
+
+    def read(self, size=1):
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while (True):
+            self.produce()
+            if (len(self.buffer) > 0):
+                break
+            now = time.monotonic()
+            if (deadline is not None and now >= deadline):
+                return b''
+            # Wait for the next packet, or poll for commands when idle
+            wait = 1.0 / self.device.sample_rate if self.device.is_streaming else 0.01
+            if (deadline is not None):
+                wait = min(wait, deadline - now)
+            time.sleep(wait)
+        with self.lock:
+            data = bytes(self.buffer[:size])
+            del self.buffer[:size]
+        return data
+
+    def write(self, data):
+        if (self.baudrate != self.device.baudrate):
+            # The device cannot decode bytes sent at another baud rate
+            return len(data)
+        for command in data.decode('latin-1'):
+            response = self.device.handle_command(command)
+            if (len(response) > 0):
+                with self.lock:
+                    self.buffer += response
+        return len(data)
+
+    def reset_input_buffer(self):
+        self.produce()
+        with self.lock:
+            self.buffer.clear()
+
+def serve_pty(device, poll_interval=0.005):
+    """
+    @brief Expose a simulated device on a pseudo terminal.
+
+    Prints the name of the terminal, which can be opened as a
+    serial port by any program, and serves it until interrupted.
+    Only available on POSIX systems.
+    """
+    import os
+    import pty
+    import select
+    import tty
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    print('Simulated WaveDAC on {}'.format(os.ttyname(slave)), flush=True)
+    while (True):
+        readable, _, _ = select.select([master], [], [], poll_interval)
+        if (readable):
+            for command in os.read(master, 64).decode('latin-1'):
+                response = device.handle_command(command)
+                if (len(response) > 0):
+                    os.write(master, response)
+        data = device.poll()
+        if (len(data) > 0):
+            os.write(master, data)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulated WaveDAC device on a pseudo terminal.')
+    parser.add_argument('--rate', type=float, default=100, help='sample rate (Hz)')
+    parser.add_argument('--freq', type=float, default=1, help='wave frequency (Hz)')
+    parser.add_argument('--corruption', type=float, default=0,
+                        help='probability of corrupting each packet')
+    parser.add_argument('--seed', type=int, default=None, help='random seed')
+    parser.add_argument('--version', type=int, default=PROTOCOL_VERSION,
+                        help='protocol version of the packets')
+    args = parser.parse_args()
+    try:
+        serve_pty(SimulatedWaveDAC(args.rate, args.freq, args.corruption, args.seed,
+                                   args.version))
+    except KeyboardInterrupt:
+        pass
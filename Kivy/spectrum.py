@@ -0,0 +1,227 @@
+import threading
+import numpy as np
+
+"""
+@brief Duration of the segments transformed by the spectrum estimator (s).
+
+Rounded to a power of two number of samples, between
+#MIN_SEGMENT_LENGTH and #MAX_SEGMENT_LENGTH.
+"""
+SEGMENT_SECONDS = 1.0
+
+"""
+@brief Minimum number of samples in each segment.
+"""
+MIN_SEGMENT_LENGTH = 64
+
+"""
+@brief Maximum number of samples in each segment.
+"""
+MAX_SEGMENT_LENGTH = 8192
+
+"""
+@brief Time between two checks for new samples by the spectrum worker (s).
+"""
+SPECTRUM_INTERVAL = 0.05
+
+"""
+@brief Maximum number of segments averaged by the spectrum estimator.
+
+Bounds the memory of the stored periodograms, e.g. 4 MB with
+#MAX_SEGMENT_LENGTH samples per segment: longer averaging times
+average the last #MAX_AVERAGES segments only.
+"""
+MAX_AVERAGES = 128
+
+def segment_length(sample_rate, seconds=SEGMENT_SECONDS):
+    """
+    @brief Number of samples of the segments for a sample rate.
+    """
+    n_samples = max(1.0, sample_rate * seconds)
+    length = 2 ** int(round(np.log2(n_samples)))
+    return int(min(max(length, MIN_SEGMENT_LENGTH), MAX_SEGMENT_LENGTH))
+
+class WelchSpectrum(object):
+    """
+    @brief Power spectral density estimated with Welch's method.
+
+    The stream is split in overlapping segments, each multiplied
+    by a Hann window and transformed. The estimate is the mean
+    of the periodograms of the last #n_averages segments. It is
+    updated incrementally: pushed samples are only transformed
+    once a whole new segment is available, i.e. every #hop
+    samples, and a running sum of the periodograms is updated
+    with the new segments and the ones they replace.
+    """
+
+    def __init__(self, sample_rate, length=None, overlap=0.5, n_averages=8):
+        """
+        @brief Initialize the estimator.
+
+        Args:
+            - sample_rate: sample rate of the stream (Hz).
+            - length: samples in each segment, see #segment_length by default.
+            - overlap: fraction of each segment shared with the next one.
+            - n_averages: number of segments averaged, up to #MAX_AVERAGES.
+        """
+        self.sample_rate = float(sample_rate)
+        self.length = length or segment_length(sample_rate)
+        self.hop = max(1, self.length - int(self.length * overlap))
+        self.n_averages = min(max(1, int(n_averages)), MAX_AVERAGES)
+        self.window = np.hanning(self.length)
+        # One-sided density: bins other than DC and Nyquist are doubled
+        self.scale = np.full(self.length // 2 + 1, 2.0 / (self.sample_rate * np.sum(self.window ** 2)))
+        self.scale[0] /= 2
+        if (self.length % 2 == 0):
+            self.scale[-1] /= 2
+        self.frequencies = np.fft.rfftfreq(self.length, 1.0 / self.sample_rate)
+        self.reset()
+
+    def reset(self):
+        """
+        @brief Forget the samples and the segments seen so far.
+        """
+        self.data = np.zeros(0)     # samples not yet part of a complete segment, plus overlap
+        self.periodograms = np.zeros((self.n_averages, len(self.frequencies)))
+        self.total = np.zeros(len(self.frequencies))  # sum of the rows of periodograms
+        self.n_segments = 0         # segments transformed so far
+
+    def push(self, samples):
+        """
+        @brief Add a block of samples.
+
+        All the segments completed by the block are transformed
+        at once.
+        @return Number of new segments.
+        """
+        data = np.concatenate((self.data, samples))
+        n_new = 0 if len(data) < self.length else (len(data) - self.length) // self.hop + 1
+        if (n_new > 0):
+            # Only the last n_averages segments contribute to the estimate
+            skip = max(0, n_new - self.n_averages)
+            segments = np.lib.stride_tricks.sliding_window_view(data, self.length)[skip * self.hop::self.hop][:n_new - skip]
+            spectra = np.fft.rfft((segments - segments.mean(axis=1, keepdims=True)) * self.window, axis=1)
+            rows = (self.n_segments + skip + np.arange(len(segments))) % self.n_averages
+            periodograms = (spectra.real ** 2 + spectra.imag ** 2) * self.scale
+            turns = self.n_segments // self.n_averages
+            self.n_segments += n_new
+            if (self.n_segments // self.n_averages == turns):
+                # Replace the contribution of the evicted segments
+                self.total += periodograms.sum(axis=0) - self.periodograms[rows].sum(axis=0)
+                self.periodograms[rows] = periodograms
+            else:
+                # Once per turn of the rows, sum again to drop the rounding errors
+                self.periodograms[rows] = periodograms
+                self.total = self.periodograms.sum(axis=0)
+            data = data[n_new * self.hop:]
+        self.data = data
+        return n_new
+
+    def density(self):
+        """
+        @brief Get the current estimate.
+
+        @return Tuple (frequencies, psd) in Hz and V^2/Hz, None before the first segment.
+        """
+        if (self.n_segments == 0):
+            return None
+        count = min(self.n_segments, self.n_averages)
+        return self.frequencies, np.maximum(self.total, 0) / count
+
+class SpectrumWorker(object):
+    """
+    @brief Thread updating a #WelchSpectrum from a sample buffer.
+
+    The worker reads the new samples of a SampleRingBuffer
+    every #SPECTRUM_INTERVAL, and recomputes the estimate when
+    a new segment is complete. The GUI gets the last estimate
+    with #get_result, so the FFTs never run on its thread.
+    """
+
+    def __init__(self, interval=SPECTRUM_INTERVAL):
+        """
+        @brief Initialize the worker, not started.
+        """
+        self.interval = interval
+        self.reader = None          # reader of the sample buffer
+        self.estimator = None       # spectrum estimator
+        self.parameters = None      # arguments of the estimator set by #configure
+        self.result = None          # (frequencies, psd in dB) of the last estimate
+        self.version = 0            # incremented at each new estimate
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def set_source(self, buffer):
+        """
+        @brief Start reading new samples from a sample buffer.
+        """
+        with self.lock:
+            self.reader = buffer.reader()
+            if (self.parameters is not None):
+                # A new estimator, as the worker may be pushing to the current one
+                self.estimator = WelchSpectrum(*self.parameters)
+
+    def configure(self, sample_rate, seconds):
+        """
+        @brief Restart the estimate for a sample rate and averaging time.
+
+        Args:
+            - sample_rate: sample rate of the samples in the buffer (Hz).
+            - seconds: duration of the stream averaged (s).
+        """
+        length = segment_length(sample_rate)
+        hop = length - length // 2
+        with self.lock:
+            self.parameters = (sample_rate, length, 0.5, max(1, int(seconds * sample_rate / hop)))
+            self.estimator = WelchSpectrum(*self.parameters)
+            self.result = None
+            self.version += 1
+
+    def start(self):
+        """
+        @brief Start the worker thread, if not running.
+        """
+        if (self.thread is None):
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """
+        @brief Stop the worker thread and wait for it to end.
+        """
+        if (self.thread is not None):
+            self.stop_event.set()
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        """
+        @brief Loop of the worker thread.
+        """
+        while (not self.stop_event.wait(self.interval)):
+            with self.lock:
+                reader, estimator = self.reader, self.estimator
+                if (reader is None or estimator is None):
+                    continue
+                samples, timestamps = reader.read()
+            # Transform without the lock, so #configure and #set_source do not wait for the FFTs
+            if (estimator.push(samples) == 0):
+                continue
+            frequencies, psd = estimator.density()
+            result = (frequencies, 10 * np.log10(psd + 1e-20))
+            with self.lock:
+                # Drop the estimate if the estimator was replaced meanwhile
+                if (estimator is self.estimator):
+                    self.result = result
+                    self.version += 1
+
+    def get_result(self):
+        """
+        @brief Get the last estimate.
+
+        @return Tuple (version, result), where result is
+        (frequencies, psd in dB V^2/Hz) or None.
+        """
+        return self.version, self.result
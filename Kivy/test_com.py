@@ -1,10 +1,15 @@
 #!/usr/bin/python3
 
 from communication import *
+from decoder import crc8, SEQ_START_BYTE, END_BYTE
+import struct
+import sys
 
-ks = KivySerial()
+# Port name from command line, e.g. /dev/ttyACM1 or sim://?rate=1000
+# One sample per packet: the packets are parsed below as 0xA1 packets
+ks = KivySerial(auto_connect=False, batch_size=1)
 #ks.find_port()
-ks.port_name = '/dev/ttyACM1'
+ks.port_name = sys.argv[1] if len(sys.argv) > 1 else '/dev/ttyACM1'
 if ks.connect() == 0:
     print("Connected")
 
@@ -24,24 +29,24 @@ b = 0
 
 while ks.is_streaming:
 
-    while b != 160:
+    while b != SEQ_START_BYTE:
         skipped_bytes += 1
         b = ks.port.read(1)
         if len(b) > 0:
             b = struct.unpack('B', b)[0]
         #print(b)
 
-    print(f"Skipped {skipped_bytes} bytes before 0xA0")
+    print(f"Skipped {skipped_bytes} bytes before 0xA1")
     skipped_bytes = 0
 
-    data = ks.port.read(3)
-    data = struct.unpack('3B', data)
-    print(f"raw data = {data[0]} {data[1]}")
-    sensor_data = (((data[0] << 8) & 0xFFFF) | data[1])
+    data = ks.port.read(5)
+    data = struct.unpack('5B', data)
+    print(f"raw data = {data[0]} {data[1]} {data[2]}")
+    sensor_data = (((data[1] << 8) & 0xFFFF) | data[2])
     sensor_data = sensor_data/65535*5
-    if data[2] == 192:
+    if data[4] == END_BYTE and data[3] == crc8(data[:3]):
         # valid sample
-        print(f"Sample {ks.samples_counter}: {sensor_data}")
+        print(f"Sample {ks.samples_counter} (seq {data[0]}): {sensor_data}")
         ks.samples_counter += 1
         b = ks.port.read(1)
         b = struct.unpack('B', b)[0]
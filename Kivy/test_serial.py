@@ -1,12 +1,16 @@
 #!/usr/bin/python3
 
-import serial
 import struct
+import sys
+from transport import open_transport
+from decoder import SEQ_START_BYTE, END_BYTE, crc8
 
-s = serial.Serial('/dev/ttyACM1', baudrate=115200, timeout=1)
+# Port name from command line, e.g. /dev/ttyACM1 or sim://?rate=1000
+port_name = sys.argv[1] if len(sys.argv) > 1 else '/dev/ttyACM1'
+s = open_transport(port_name, baudrate=115200, timeout=1)
 
 if s.is_open:
-    print("Connected to /dev/ttyACM1")
+    print(f"Connected to {port_name}")
 
 s.flush()
 while len(s.read(1)) > 0:
@@ -22,24 +26,24 @@ b = 0
 samples_counter = 0
 
 while streaming:
-    while b != 160:
+    while b != SEQ_START_BYTE:
         skipped_bytes += 1
         b = s.read(1)
         if len(b) > 0:
             b = struct.unpack('B', b)[0]
         #print(b)
 
-    print(f"Skipped {skipped_bytes} bytes before 0xA0")
+    print(f"Skipped {skipped_bytes} bytes before 0xA1")
     skipped_bytes = 0
 
-    data = s.read(3)
-    data = struct.unpack('3B', data)
-    print(f"raw data = {data[0]} {data[1]}")
-    sensor_data = (((data[0] << 8) & 0xFFFF) | data[1])
+    data = s.read(5)
+    data = struct.unpack('5B', data)
+    print(f"raw data = {data[0]} {data[1]} {data[2]}")
+    sensor_data = (((data[1] << 8) & 0xFFFF) | data[2])
     sensor_data = sensor_data/65535*5
-    if data[2] == 192:
+    if data[4] == END_BYTE and data[3] == crc8(data[:3]):
         # valid sample
-        print(f"Sample {samples_counter}: {sensor_data}")
+        print(f"Sample {samples_counter} (seq {data[0]}): {sensor_data}")
         samples_counter += 1
         b = s.read(1)
         b = struct.unpack('B', b)[0]
@@ -0,0 +1,69 @@
+import functools
+import numpy as np
+
+"""
+@brief Number of time bases kept by #get_time_base.
+
+Covers the window lengths of the Seconds spinner at a few
+sample rates, e.g. raw and decimated. Time bases hold no
+array, so the cache takes a few kilobytes whatever the
+window lengths.
+"""
+TIME_BASE_CACHE_SIZE = 32
+
+class TimeBase(object):
+    """
+    @brief x axis of a plot window of the most recent samples.
+
+    Maps the position of each point of the window, 0 for the
+    oldest sample, to its time relative to the end of the
+    window. The axis is uniform, so times are computed for the
+    points drawn only (see #times) instead of being stored for
+    the whole window. Time bases are immutable, so they can be
+    shared by all the plots with the same sample rate and
+    window length: get them from #get_time_base rather than
+    creating them.
+    """
+    __slots__ = ('sample_rate', 'n_seconds', 'n_points', 'time_between_points')
+
+    def __init__(self, sample_rate, n_seconds):
+        """
+        @brief Compute the time base.
+
+        Args:
+            - sample_rate: sample rate of the samples shown (Hz).
+            - n_seconds: length of the window (s).
+        """
+        self.sample_rate = sample_rate
+        self.n_seconds = n_seconds
+        self.n_points = max(1, int(n_seconds * sample_rate))        # Number of points to plot
+        self.time_between_points = n_seconds / float(self.n_points)  # Time between points on x-axis
+
+    def times(self, positions):
+        """
+        @brief Get the times of points of the window (s).
+
+        Args:
+            - positions: array of positions in the window, 0 for the oldest sample.
+        @return Array of times relative to the end of the window.
+        """
+        return positions * self.time_between_points - self.n_seconds
+
+    def x_points(self):
+        """
+        @brief Get the times of all the points of the window, oldest first (s).
+
+        Computed at each call, in O(window): only meant for
+        drawing windows that are not decimated.
+        """
+        return self.times(np.arange(self.n_points))
+
+@functools.lru_cache(maxsize=TIME_BASE_CACHE_SIZE)
+def get_time_base(sample_rate, n_seconds):
+    """
+    @brief Get the shared #TimeBase of a sample rate and window length.
+
+    Time bases are created once and cached, so showing several
+    devices at the same sample rate shares them.
+    """
+    return TimeBase(sample_rate, n_seconds)
@@ -1,7 +1,28 @@
+from kivy.clock import Clock
+from kivy.lang import Builder
+from kivy.resources import resource_find
 from kivy.properties import NumericProperty, ObjectProperty, StringProperty
 from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.popup import Popup
-from communication import KivySerial
+from communication import RECORDINGS_FOLDER
+from devices import DeviceManager
+import os
+import threading
+
+"""
+@brief kv file with the rules of the dialogs, loaded by #load_dialogs.
+"""
+DIALOGS_KV = 'dialogs.kv'
+
+def load_dialogs():
+    """
+    @brief Load the rules of the dialogs, the first time a dialog is opened.
+
+    Dialogs are not needed for the first frame, so their
+    widgets and the modules they import are only loaded on use.
+    """
+    if (resource_find(DIALOGS_KV) not in Builder.files):
+        Builder.load_file(DIALOGS_KV)
 
 class Toolbar(BoxLayout):
     """
@@ -24,6 +45,7 @@ class Toolbar(BoxLayout):
         @brief Open popup for wave selection.
         """
         self.message_string = "Wave Select Dialog"
+        load_dialogs()
         popup = WaveSelectDialog()
         popup.open()
 
@@ -32,9 +54,81 @@ class Toolbar(BoxLayout):
         @brief Open popup for range selection.
         """
         self.message_string = "Range Select Dialog"
+        load_dialogs()
         popup = RangeSelectDialog()
         popup.open()
 
+    def sample_rate_dialog(self):
+        """
+        @brief Open popup for sample rate and baud rate selection.
+        """
+        self.message_string = "Sample Rate Dialog"
+        load_dialogs()
+        popup = SampleRateDialog()
+        popup.open()
+
+    def toggle_recording(self):
+        """
+        @brief Start or stop recording the sample streams of all the devices connected.
+        """
+        devices = DeviceManager()
+        if (devices.is_recording()):
+            devices.stop_recording()
+            self.record_button.text = 'Record'
+        elif (len(devices.start_recording()) > 0):
+            self.record_button.text = 'Stop Recording'
+
+    def replay_dialog(self):
+        """
+        @brief Open popup for replay selection, or stop the current replay.
+        """
+        board = DeviceManager().active
+        if (board.is_replaying()):
+            board.stop_replay()
+            return
+        self.message_string = "Replay Dialog"
+        load_dialogs()
+        popup = ReplayDialog()
+        popup.open()
+
+    def export_dialog(self):
+        """
+        @brief Open popup for recording export.
+        """
+        self.message_string = "Export Dialog"
+        load_dialogs()
+        popup = ExportDialog(toolbar=self)
+        popup.open()
+
+    def export(self, path, fmt):
+        """
+        @brief Export a recording in a background thread, showing the progress.
+
+        Args:
+            - path: recording to be exported.
+            - fmt: one of export.EXPORT_FORMATS.
+        """
+        thread = threading.Thread(target=self.run_export, args=(path, fmt), daemon=True)
+        thread.start()
+
+    def run_export(self, path, fmt):
+        """
+        @brief Export a recording, called on the export thread.
+        """
+        def show(message):
+            Clock.schedule_once(lambda dt: setattr(self, 'message_string', message))
+
+        def progress(done, total):
+            show(f'Exporting {os.path.basename(path)}: {100 * done // max(total, 1)}%')
+
+        from export import export_recording
+        try:
+            output = export_recording(path, fmt=fmt, progress=progress)
+        except (OSError, ValueError, ImportError) as e:
+            show(f'Cannot export: {e}')
+            return
+        show(f'Exported to {output}')
+
 
 class WaveSelectDialog(Popup):
     """
@@ -44,7 +138,7 @@ class WaveSelectDialog(Popup):
 
     def __init__(self, **kwargs):
         super(WaveSelectDialog, self).__init__(**kwargs)
-        self.board = KivySerial()
+        self.board = DeviceManager().active
 
     def update_pressed(self):
         """
@@ -64,7 +158,7 @@ class RangeSelectDialog(Popup):
 
     def __init__(self, **kwargs):
         super(RangeSelectDialog, self).__init__(**kwargs)
-        self.board = KivySerial()
+        self.board = DeviceManager().active
 
     def update_pressed(self):
         """
@@ -74,4 +168,93 @@ class RangeSelectDialog(Popup):
         """
         if (self.board.is_connected()):
             self.board.select_range(self.range_spinner.text)
+        self.dismiss()
+
+class SampleRateDialog(Popup):
+    """
+    @brief Popup to allow sample rate and baud rate selection.
+    """
+    sample_rate_spinner = ObjectProperty(None)
+    baudrate_spinner = ObjectProperty(None)
+
+    def __init__(self, **kwargs):
+        super(SampleRateDialog, self).__init__(**kwargs)
+        self.board = DeviceManager().active
+
+    def on_sample_rate_spinner(self, instance, value):
+        """
+        @brief Show the current sample rate.
+        """
+        self.sample_rate_spinner.text = str(int(self.board.sample_rate))
+
+    def on_baudrate_spinner(self, instance, value):
+        """
+        @brief Show the current baud rate.
+        """
+        self.baudrate_spinner.text = str(self.board.baudrate)
+
+    def update_pressed(self):
+        """
+        @brief Callback called when update button is pressed.
+
+        If the board is connected, update baud rate and sample rate.
+        """
+        if (self.board.is_connected()):
+            baudrate = int(self.baudrate_spinner.text)
+            if (baudrate != self.board.baudrate):
+                self.board.set_baudrate(baudrate)
+            self.board.set_sample_rate(int(self.sample_rate_spinner.text))
+        self.dismiss()
+
+class ExportDialog(Popup):
+    """
+    @brief Popup to select a recording to be exported, and the format.
+    """
+    file_chooser = ObjectProperty(None)
+    format_spinner = ObjectProperty(None)
+    toolbar = ObjectProperty(None)
+
+    def on_file_chooser(self, instance, value):
+        """
+        @brief Show the recordings folder when available.
+        """
+        if (os.path.isdir(RECORDINGS_FOLDER)):
+            self.file_chooser.path = os.path.abspath(RECORDINGS_FOLDER)
+
+    def export_pressed(self):
+        """
+        @brief Callback called when export button is pressed.
+        """
+        if (len(self.file_chooser.selection) > 0):
+            self.toolbar.export(self.file_chooser.selection[0], self.format_spinner.text)
+        self.dismiss()
+
+class ReplayDialog(Popup):
+    """
+    @brief Popup to select a recording to be replayed.
+    """
+    file_chooser = ObjectProperty(None)
+    speed_spinner = ObjectProperty(None)
+
+    def __init__(self, **kwargs):
+        super(ReplayDialog, self).__init__(**kwargs)
+        self.board = DeviceManager().active
+
+    def on_file_chooser(self, instance, value):
+        """
+        @brief Show the recordings folder when available.
+        """
+        if (os.path.isdir(RECORDINGS_FOLDER)):
+            self.file_chooser.path = os.path.abspath(RECORDINGS_FOLDER)
+
+    def replay_pressed(self):
+        """
+        @brief Callback called when replay button is pressed.
+
+        Replay the selected recording at the selected speed.
+        """
+        if (len(self.file_chooser.selection) > 0):
+            speed = self.speed_spinner.text.rstrip('x')
+            speed = 0 if speed == 'Max' else float(speed)
+            self.board.start_replay(self.file_chooser.selection[0], speed)
         self.dismiss()
\ No newline at end of file
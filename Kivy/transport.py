@@ -0,0 +1,84 @@
+import abc
+import serial
+
+"""
+@brief Prefix of the port names served by the simulated device.
+
+Options can be given as a query string, e.g.
+sim://?rate=1000&corruption=0.001 (see #SimulatedTransport).
+"""
+SIMULATOR_PREFIX = 'sim://'
+
+class Transport(abc.ABC):
+    """
+    @brief Byte stream used to talk to the device.
+
+    This is the subset of the serial.Serial interface used by
+    the application, so a serial.Serial instance can be used
+    wherever a Transport is expected. Other transports, e.g.
+    the simulated device, derive from this class and must
+    implement its abstract methods to be instantiated.
+    """
+    is_open = False
+
+    @property
+    @abc.abstractmethod
+    def in_waiting(self):
+        """
+        @brief Number of bytes that can be read without blocking.
+        """
+
+    @abc.abstractmethod
+    def read(self, size=1):
+        """
+        @brief Read up to size bytes, waiting at most timeout seconds.
+        """
+
+    @abc.abstractmethod
+    def write(self, data):
+        """
+        @brief Write bytes to the device.
+        """
+
+    @abc.abstractmethod
+    def reset_input_buffer(self):
+        """
+        @brief Discard the bytes received and not read yet.
+        """
+
+    def flush(self):
+        """
+        @brief Wait until all the data are written.
+        """
+        pass
+
+    def close(self):
+        """
+        @brief Close the transport.
+        """
+        self.is_open = False
+
+    def isOpen(self):
+        return self.is_open
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def open_transport(port_name, baudrate, timeout):
+    """
+    @brief Open the transport for a port name.
+
+    Names starting with #SIMULATOR_PREFIX open a simulated
+    device, any other name is opened as a serial port.
+    Args:
+        - port_name: name of the port.
+        - baudrate: baudrate for serial communication.
+        - timeout: read timeout (s).
+    """
+    if (port_name.startswith(SIMULATOR_PREFIX)):
+        from simulator import SimulatedTransport
+        return SimulatedTransport.from_url(port_name, baudrate=baudrate, timeout=timeout)
+    return serial.Serial(port=port_name, baudrate=baudrate, timeout=timeout)
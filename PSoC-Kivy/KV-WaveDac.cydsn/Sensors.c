@@ -8,9 +8,13 @@
 #include "Sensors.h"
 #include "Serial_Interface.h"
 #include "Timer_Send.h"
+#include "timer_clock.h"
+#include "cyfitter.h"
 
 static uint8_t is_streaming = 0;
 static uint8_t send_data = 0;
+static uint16_t batch[SERIAL_MAX_BATCH_SIZE];
+static uint8_t batch_count = 0;
 
 CY_ISR_PROTO(isr_send_data);
 
@@ -46,6 +50,7 @@ void Sensors_Reset(void)
 void Sensors_StartStreaming(void)
 {
     is_streaming = 1;
+    batch_count = 0;
     // Start isr
     isr_timer_StartEx(isr_send_data);
     // Start timer 
@@ -88,13 +93,65 @@ void Sensors_SetInputWave(uint8_t wave)
     CR_WDac_Write(wave);
 }
 
+// Set the sample rate
+void Sensors_SetSampleRate(uint32_t rate)
+{
+    uint32_t divider;
+    uint32_t period;
+    if (rate < 1)
+    {
+        rate = 1;
+    }
+    else if (rate > SENSORS_MAX_SAMPLE_RATE)
+    {
+        rate = SENSORS_MAX_SAMPLE_RATE;
+    }
+    // Smallest clock divider for which the period fits the timer
+    divider = (BCLK__BUS_CLK__HZ + rate * (SENSORS_TIMER_MAX_PERIOD + 1) - 1)
+            / (rate * (SENSORS_TIMER_MAX_PERIOD + 1));
+    if (divider > 65536)
+    {
+        divider = 65536;
+    }
+    period = (BCLK__BUS_CLK__HZ / divider + rate / 2) / rate;
+    if (period > SENSORS_TIMER_MAX_PERIOD + 1)
+    {
+        period = SENSORS_TIMER_MAX_PERIOD + 1;
+    }
+    timer_clock_SetDividerValue((uint16_t)divider);
+    Timer_Send_WritePeriod((uint8_t)(period - 1));
+    Timer_Send_WriteCounter((uint8_t)(period - 1));
+}
+
+// Get the sample rate
+uint32_t Sensors_GetSampleRate(void)
+{
+    uint32_t divider = (uint32_t)timer_clock_GetDividerRegister() + 1;
+    uint32_t period = (uint32_t)Timer_Send_ReadPeriod() + 1;
+    return (BCLK__BUS_CLK__HZ / divider + period / 2) / period;
+}
+
 // Send data
 void Sensors_SendData(void)
 {
     if (is_streaming && send_data)
     {
         uint16_t wave = ((uint16_t)ADC_DelSig_Read32());
-        Serial_SendDataPacket(wave);
+        uint8_t batch_size = Serial_GetBatchSize();
+        if (batch_size > 1)
+        {
+            // Collect samples and send them in a single packet
+            batch[batch_count++] = wave;
+            if (batch_count >= batch_size)
+            {
+                Serial_SendDataBatch(batch, batch_count);
+                batch_count = 0;
+            }
+        }
+        else
+        {
+            Serial_SendDataPacket(wave);
+        }
         send_data = 0;
     }
 }
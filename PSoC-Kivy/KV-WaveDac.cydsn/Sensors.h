@@ -49,8 +49,25 @@
     */
     void Sensors_SetInputWave(uint8_t wave);
     
+    /**
+    *   \brief Set the sample rate (Hz).
+    *
+    *   The clock of the timer triggering the samples and its
+    *   period are set to get the closest rate possible, up to
+    *   SENSORS_MAX_SAMPLE_RATE.
+    */
+    void Sensors_SetSampleRate(uint32_t rate);
+    
+    /**
+    *   \brief Get the sample rate (Hz).
+    */
+    uint32_t Sensors_GetSampleRate(void);
+    
     /**
     *   \brief Send sampled data.
+    *
+    *   Samples are collected and sent in packets of the
+    *   batch size set by the host.
     */
     void Sensors_SendData(void);
     
@@ -28,6 +28,16 @@
     */
     #define SENSORS_WAVE_2 1
     
+    /**
+    *   \brief Maximum sample rate, limited by the ADC conversion rate (Hz).
+    */
+    #define SENSORS_MAX_SAMPLE_RATE 10000
+    
+    /**
+    *   \brief Maximum period of the 8-bit timer triggering the samples.
+    */
+    #define SENSORS_TIMER_MAX_PERIOD 255
+    
 #endif
 
 /* [] END OF FILE */
@@ -13,10 +13,44 @@
 #include "Sensors.h"
 #include "stdio.h"
 #include "UART.h"
+#include "UART_IntClock.h"
+#include "cyfitter.h"
+#include "CyLib.h"
 
-static const char conn_msg[] = "Wave Kivy $$$";
+static const char conn_msg[] = "Wave Kivy v4 $$$";
 static const char error_msg[] = "Unknown command ";
 static uint8_t data_packet[SERIAL_PACKET_SIZE];
+static uint8_t batch_packet[SERIAL_BATCH_PACKET_SIZE(SERIAL_MAX_BATCH_SIZE)];
+static uint8_t sequence_number = 0;
+static uint8_t batch_size = 1;
+static uint32_t current_baud_rate = SERIAL_DEFAULT_BAUD_RATE;
+
+// CRC-8 lookup table, polynomial 0x07
+static const uint8_t crc8_table[256] = {
+    0x00, 0x07, 0x0E, 0x09, 0x1C, 0x1B, 0x12, 0x15, 0x38, 0x3F, 0x36, 0x31, 0x24, 0x23, 0x2A, 0x2D,
+    0x70, 0x77, 0x7E, 0x79, 0x6C, 0x6B, 0x62, 0x65, 0x48, 0x4F, 0x46, 0x41, 0x54, 0x53, 0x5A, 0x5D,
+    0xE0, 0xE7, 0xEE, 0xE9, 0xFC, 0xFB, 0xF2, 0xF5, 0xD8, 0xDF, 0xD6, 0xD1, 0xC4, 0xC3, 0xCA, 0xCD,
+    0x90, 0x97, 0x9E, 0x99, 0x8C, 0x8B, 0x82, 0x85, 0xA8, 0xAF, 0xA6, 0xA1, 0xB4, 0xB3, 0xBA, 0xBD,
+    0xC7, 0xC0, 0xC9, 0xCE, 0xDB, 0xDC, 0xD5, 0xD2, 0xFF, 0xF8, 0xF1, 0xF6, 0xE3, 0xE4, 0xED, 0xEA,
+    0xB7, 0xB0, 0xB9, 0xBE, 0xAB, 0xAC, 0xA5, 0xA2, 0x8F, 0x88, 0x81, 0x86, 0x93, 0x94, 0x9D, 0x9A,
+    0x27, 0x20, 0x29, 0x2E, 0x3B, 0x3C, 0x35, 0x32, 0x1F, 0x18, 0x11, 0x16, 0x03, 0x04, 0x0D, 0x0A,
+    0x57, 0x50, 0x59, 0x5E, 0x4B, 0x4C, 0x45, 0x42, 0x6F, 0x68, 0x61, 0x66, 0x73, 0x74, 0x7D, 0x7A,
+    0x89, 0x8E, 0x87, 0x80, 0x95, 0x92, 0x9B, 0x9C, 0xB1, 0xB6, 0xBF, 0xB8, 0xAD, 0xAA, 0xA3, 0xA4,
+    0xF9, 0xFE, 0xF7, 0xF0, 0xE5, 0xE2, 0xEB, 0xEC, 0xC1, 0xC6, 0xCF, 0xC8, 0xDD, 0xDA, 0xD3, 0xD4,
+    0x69, 0x6E, 0x67, 0x60, 0x75, 0x72, 0x7B, 0x7C, 0x51, 0x56, 0x5F, 0x58, 0x4D, 0x4A, 0x43, 0x44,
+    0x19, 0x1E, 0x17, 0x10, 0x05, 0x02, 0x0B, 0x0C, 0x21, 0x26, 0x2F, 0x28, 0x3D, 0x3A, 0x33, 0x34,
+    0x4E, 0x49, 0x40, 0x47, 0x52, 0x55, 0x5C, 0x5B, 0x76, 0x71, 0x78, 0x7F, 0x6A, 0x6D, 0x64, 0x63,
+    0x3E, 0x39, 0x30, 0x37, 0x22, 0x25, 0x2C, 0x2B, 0x06, 0x01, 0x08, 0x0F, 0x1A, 0x1D, 0x14, 0x13,
+    0xAE, 0xA9, 0xA0, 0xA7, 0xB2, 0xB5, 0xBC, 0xBB, 0x96, 0x91, 0x98, 0x9F, 0x8A, 0x8D, 0x84, 0x83,
+    0xDE, 0xD9, 0xD0, 0xD7, 0xC2, 0xC5, 0xCC, 0xCB, 0xE6, 0xE1, 0xE8, 0xEF, 0xFA, 0xFD, 0xF4, 0xF3
+};
+
+static uint8_t Serial_Crc8(const uint8_t* data, uint8_t length);
+static uint8_t Serial_ReadArgument(uint8_t* argument, uint8_t length);
+static void Serial_SetBatchSize(void);
+static void Serial_SetSampleRate(void);
+static void Serial_SendSampleRate(void);
+static void Serial_SetBaudRate(void);
 
 // Start serial module
 void Serial_Start(void)
@@ -46,9 +80,11 @@ void Serial_HandleReceivedCommand()
             // Send string for connection
             Serial_SendConnectionPacket();
             Sensors_Reset();
+            batch_size = 1;
             break;
         case SERIAL_START_STREAMING_CMD:
             // Start streaming
+            Serial_ResetSequence();
             Sensors_StartStreaming();
             break;
         case SERIAL_STOP_STREAMING_CMD:
@@ -71,6 +107,22 @@ void Serial_HandleReceivedCommand()
             // Set range to be large
             Sensors_SetInputRange(SENSORS_RANGE_LARGE);
             break;
+        case SERIAL_BATCH_SIZE_CMD:
+            // Set number of samples per packet
+            Serial_SetBatchSize();
+            break;
+        case SERIAL_GET_SAMPLE_RATE_CMD:
+            // Send sample rate
+            Serial_SendSampleRate();
+            break;
+        case SERIAL_SAMPLE_RATE_CMD:
+            // Set sample rate
+            Serial_SetSampleRate();
+            break;
+        case SERIAL_BAUD_RATE_CMD:
+            // Set baud rate
+            Serial_SetBaudRate();
+            break;
         default:
             Serial_SendErrorMessage(rec);
     }
@@ -80,13 +132,167 @@ void Serial_HandleReceivedCommand()
 void Serial_SendDataPacket(uint16_t wave_1)
 {
     // Send a packet with data
-    data_packet[0] = 0xA0;
-    data_packet[1] = wave_1 >> 8;
-    data_packet[2] = wave_1 & 0xFF;
-    data_packet[3] = 0xC0;
+    data_packet[0] = SERIAL_PACKET_HEADER;
+    data_packet[1] = sequence_number++;
+    data_packet[2] = wave_1 >> 8;
+    data_packet[3] = wave_1 & 0xFF;
+    data_packet[4] = Serial_Crc8(&data_packet[1], 3);
+    data_packet[5] = SERIAL_PACKET_TAIL;
     UART_PutArray(data_packet, SERIAL_PACKET_SIZE);
 }
 
+// Send a packet with a batch of samples
+void Serial_SendDataBatch(const uint16_t* data, uint8_t count)
+{
+    uint8_t i;
+    uint8_t size = SERIAL_BATCH_PACKET_SIZE(count);
+    batch_packet[0] = SERIAL_BATCH_PACKET_HEADER;
+    batch_packet[1] = count;
+    batch_packet[2] = sequence_number;
+    for (i = 0; i < count; i++)
+    {
+        batch_packet[3 + 2 * i] = data[i] >> 8;
+        batch_packet[4 + 2 * i] = data[i] & 0xFF;
+    }
+    batch_packet[size - 2] = Serial_Crc8(&batch_packet[1], size - 3);
+    batch_packet[size - 1] = SERIAL_PACKET_TAIL;
+    sequence_number += count;
+    UART_PutArray(batch_packet, size);
+}
+
+// Get the number of samples per packet
+uint8_t Serial_GetBatchSize(void)
+{
+    return batch_size;
+}
+
+// Read the number of samples per packet and send it back
+static void Serial_SetBatchSize(void)
+{
+    char msg[20];
+    if (!Serial_ReadArgument(&batch_size, 1))
+    {
+        return;
+    }
+    if (batch_size < 1)
+    {
+        batch_size = 1;
+    }
+    else if (batch_size > SERIAL_MAX_BATCH_SIZE)
+    {
+        batch_size = SERIAL_MAX_BATCH_SIZE;
+    }
+    sprintf(msg, "Batch size %u\r\n", batch_size);
+    UART_PutString(msg);
+}
+
+// Set the sample rate and send the one obtained
+static void Serial_SetSampleRate(void)
+{
+    uint8_t argument[2];
+    if (!Serial_ReadArgument(argument, 2))
+    {
+        return;
+    }
+    Sensors_SetSampleRate(((uint16_t)argument[0] << 8) | argument[1]);
+    Serial_SendSampleRate();
+}
+
+// Send the sample rate
+static void Serial_SendSampleRate(void)
+{
+    char msg[24];
+    sprintf(msg, "Sample rate %lu\r\n", (unsigned long)Sensors_GetSampleRate());
+    UART_PutString(msg);
+}
+
+// Set the baud rate, after sending the one used from now on
+static void Serial_SetBaudRate(void)
+{
+    uint8_t argument[4];
+    uint32_t baud_rate;
+    uint32_t divider;
+    uint32_t obtained;
+    uint32_t error;
+    char msg[24];
+    if (!Serial_ReadArgument(argument, 4))
+    {
+        return;
+    }
+    baud_rate = ((uint32_t)argument[0] << 24) | ((uint32_t)argument[1] << 16)
+              | ((uint32_t)argument[2] << 8) | argument[3];
+    if (baud_rate == 0)
+    {
+        return;
+    }
+    // Closest divider of the UART clock
+    divider = (BCLK__BUS_CLK__HZ + (SERIAL_UART_OVERSAMPLING * baud_rate) / 2)
+            / (SERIAL_UART_OVERSAMPLING * baud_rate);
+    if ((divider < 1) || (divider > 65536))
+    {
+        divider = 0;
+    }
+    obtained = divider ? BCLK__BUS_CLK__HZ / (SERIAL_UART_OVERSAMPLING * divider) : 0;
+    error = (obtained > baud_rate) ? (obtained - baud_rate) : (baud_rate - obtained);
+    if ((divider == 0) || (error * SERIAL_BAUD_RATE_TOLERANCE > baud_rate))
+    {
+        // Keep the current baud rate
+        sprintf(msg, "Baud rate %lu\r\n", (unsigned long)current_baud_rate);
+        UART_PutString(msg);
+        return;
+    }
+    // Answer the nominal baud rate, which the host switches to
+    current_baud_rate = baud_rate;
+    sprintf(msg, "Baud rate %lu\r\n", (unsigned long)current_baud_rate);
+    UART_PutString(msg);
+    // Wait for the response to be sent at the current baud rate
+    while (UART_GetTxBufferSize() > 0);
+    while (!(UART_ReadTxStatus() & UART_TX_STS_COMPLETE));
+    UART_IntClock_SetDividerValue((uint16_t)divider);
+    UART_ClearRxBuffer();
+}
+
+// Read the argument of a command, waiting for it at most SERIAL_ARGUMENT_TIMEOUT_MS
+static uint8_t Serial_ReadArgument(uint8_t* argument, uint8_t length)
+{
+    uint8_t timeout = SERIAL_ARGUMENT_TIMEOUT_MS;
+    uint8_t i = 0;
+    while (i < length)
+    {
+        if (UART_GetRxBufferSize() > 0)
+        {
+            argument[i++] = UART_GetChar();
+        }
+        else if (timeout > 0)
+        {
+            CyDelay(1);
+            timeout--;
+        }
+        else
+        {
+            return 0;
+        }
+    }
+    return 1;
+}
+
+// Restart the sequence number
+void Serial_ResetSequence(void)
+{
+    sequence_number = 0;
+}
+
+// Compute the CRC-8 of a buffer
+static uint8_t Serial_Crc8(const uint8_t* data, uint8_t length)
+{
+    uint8_t crc = 0;
+    while (length--)
+    {
+        crc = crc8_table[crc ^ *data++];
+    }
+    return crc;
+}
+
 // Send connection packet
 void Serial_SendConnectionPacket(void)
 {
@@ -34,9 +34,30 @@
     
     /**
     *   \brief Send a packet with signal data.
+    *
+    *   Each packet carries a sequence number, incremented at
+    *   each packet, and the CRC-8 of sequence number and data.
     */
     void Serial_SendDataPacket(uint16_t wave);
     
+    /**
+    *   \brief Send a packet with a batch of samples.
+    *
+    *   The sequence number of the packet is the one of the
+    *   first sample, and is incremented by the number of samples.
+    */
+    void Serial_SendDataBatch(const uint16_t* data, uint8_t count);
+    
+    /**
+    *   \brief Get the number of samples to be sent in each packet.
+    */
+    uint8_t Serial_GetBatchSize(void);
+    
+    /**
+    *   \brief Restart the sequence number of the data packets from 0.
+    */
+    void Serial_ResetSequence(void);
+    
     /**
     *   \brief Send a packet with a predefined string.
     */
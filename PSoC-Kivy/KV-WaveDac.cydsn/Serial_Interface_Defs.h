@@ -7,10 +7,67 @@
     
     #define __SERIAL_INTERFACE_DEFS_H__
     
+    /**
+    *   \brief Version of the data packet format.
+    *
+    *   Advertised in the connection message, so that the host
+    *   can select the matching decoder.
+    */
+    #define SERIAL_PROTOCOL_VERSION 4
+    
     /**
     *   \brief Size of the packet to be transmitted.
+    *
+    *   Header | Sequence | Data MSB | Data LSB | CRC-8 | Tail
+    */
+    #define SERIAL_PACKET_SIZE 6
+    
+    /**
+    *   \brief First byte of the data packet.
+    */
+    #define SERIAL_PACKET_HEADER 0xA1
+    
+    /**
+    *   \brief Last byte of the data packet.
+    */
+    #define SERIAL_PACKET_TAIL 0xC0
+    
+    /**
+    *   \brief First byte of the data packet with a batch of samples.
+    */
+    #define SERIAL_BATCH_PACKET_HEADER 0xA2
+    
+    /**
+    *   \brief Maximum number of samples in a batch packet.
+    */
+    #define SERIAL_MAX_BATCH_SIZE 64
+    
+    /**
+    *   \brief Size of a batch packet with n samples.
+    *
+    *   Header | Count | Sequence | n x (Data MSB | Data LSB) | CRC-8 | Tail
+    */
+    #define SERIAL_BATCH_PACKET_SIZE(n) (2 * (n) + 5)
+    
+    /**
+    *   \brief Maximum time to wait for the argument of a command (ms).
     */
-    #define SERIAL_PACKET_SIZE 4
+    #define SERIAL_ARGUMENT_TIMEOUT_MS 100
+    
+    /**
+    *   \brief Baud rate set in the design.
+    */
+    #define SERIAL_DEFAULT_BAUD_RATE 115200
+    
+    /**
+    *   \brief Maximum relative error of the baud rate, as 1/n.
+    */
+    #define SERIAL_BAUD_RATE_TOLERANCE 50
+    
+    /**
+    *   \brief Oversampling of the UART.
+    */
+    #define SERIAL_UART_OVERSAMPLING 8
     
     /**
     *   \brief Connection command.
@@ -47,5 +104,25 @@
     */
     #define SERIAL_RANGE_LARGE_CMD 'y'
     
+    /**
+    *   \brief Batch size command, followed by the number of samples per packet.
+    */
+    #define SERIAL_BATCH_SIZE_CMD 'n'
+    
+    /**
+    *   \brief Sample rate query command.
+    */
+    #define SERIAL_GET_SAMPLE_RATE_CMD 'q'
+    
+    /**
+    *   \brief Sample rate command, followed by the rate in Hz (2 bytes, MSB first).
+    */
+    #define SERIAL_SAMPLE_RATE_CMD 'r'
+    
+    /**
+    *   \brief Baud rate command, followed by the baud rate (4 bytes, MSB first).
+    */
+    #define SERIAL_BAUD_RATE_CMD 'u'
+    
 #endif
 /* [] END OF FILE */